@@ -0,0 +1,46 @@
+"""
+Materialized yearly series for locked baselines
+A locked baseline's AOI and year never change, and neither do the stats of
+closed years, so monitoring results are stored per baseline and appended
+one year at a time instead of living in the expiring stats cache
+"""
+from app.composites import year_range
+from app.database import hash_aoi, get_baseline_series, save_baseline_series
+from app.cache_policy import is_closed_period
+
+def is_closed_year(year: int) -> bool:
+    return is_closed_period(year_range(year)[1])
+
+def baseline_series_id(baseline: dict, aoi_geojson: dict):
+    """
+    Series ID for monitoring a baseline over an AOI, or None
+    Only locked baselines monitored over their own AOI are materialized
+    """
+    if not baseline["locked"]:
+        return None
+    if hash_aoi(aoi_geojson, "", "") != hash_aoi(baseline["aoi_geojson"], "", ""):
+        return None
+    return baseline["baseline_id"]
+
+def materialized_series(series_id: str, kind: str, years: list, compute) -> dict:
+    """
+    {year: record} for one kind of series
+    Stored years are read locally; compute(missing_years) -> {year: record}
+    fills the rest, and the closed years among them are appended
+    """
+    records = get_baseline_series(series_id, kind, years)
+    missing_years = [year for year in years if year not in records]
+    if missing_years:
+        computed = compute(missing_years)
+        closed = {year: computed[year] for year in missing_years if is_closed_year(year)}
+        if closed:
+            save_baseline_series(series_id, kind, closed)
+        records.update(computed)
+    return records
+
+def seed_baseline_series(baseline: dict, kind: str):
+    """Store the locked baseline's own stats as the first year of its series"""
+    if is_closed_year(baseline["baseline_year"]):
+        save_baseline_series(baseline["baseline_id"], kind, {
+            baseline["baseline_year"]: {"stats": baseline["stats"], "area_km2": baseline["area_km2"]}
+        })
@@ -0,0 +1,64 @@
+"""
+LULC cache policy
+Expiry rules for cached tile URLs and stats, plus a background sweeper
+that purges expired rows and caps total cache size
+"""
+import logging
+import os
+import threading
+import time
+from datetime import date
+from dotenv import load_dotenv
+from app.database import purge_expired_cache, evict_lru_cache
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# getMapId URLs stop working after a few hours
+TILE_URL_TTL_SECONDS = float(os.getenv("TILE_URL_TTL_HOURS", 4)) * 3600
+# Stats for periods that have not ended yet can still change
+OPEN_PERIOD_STATS_TTL_SECONDS = float(os.getenv("OPEN_PERIOD_STATS_TTL_HOURS", 24)) * 3600
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 50000))
+CACHE_SWEEP_INTERVAL_SECONDS = float(os.getenv("CACHE_SWEEP_INTERVAL_SECONDS", 600))
+
+_sweeper_stop = threading.Event()
+_sweeper_thread = None
+
+def tile_url_expires_at() -> float:
+    return time.time() + TILE_URL_TTL_SECONDS
+
+def is_closed_period(end_date: str) -> bool:
+    """True once the period has ended and its stats can no longer change"""
+    try:
+        return date.fromisoformat(end_date) < date.today()
+    except ValueError:
+        return False
+
+def stats_expires_at(end_date: str):
+    """None (never expires) for closed periods, a short TTL otherwise"""
+    return None if is_closed_period(end_date) else time.time() + OPEN_PERIOD_STATS_TTL_SECONDS
+
+def sweep_cache():
+    """Purge expired rows, then evict least recently used rows over the cap"""
+    expired = purge_expired_cache()
+    evicted = evict_lru_cache(CACHE_MAX_ENTRIES)
+    return {"expired": expired, "evicted": evicted}
+
+def _sweeper_loop():
+    while not _sweeper_stop.wait(CACHE_SWEEP_INTERVAL_SECONDS):
+        try:
+            sweep_cache()
+        except Exception as e:
+            logger.error("Cache sweep error: %s", e)
+
+def start_cache_sweeper():
+    global _sweeper_thread
+    if _sweeper_thread and _sweeper_thread.is_alive():
+        return
+    _sweeper_stop.clear()
+    _sweeper_thread = threading.Thread(target=_sweeper_loop, name="cache-sweeper", daemon=True)
+    _sweeper_thread.start()
+
+def stop_cache_sweeper():
+    _sweeper_stop.set()
@@ -0,0 +1,40 @@
+"""
+Cache key replay report
+Replays the requests table and compares cache hit rates for raw GeoJSON
+keys against canonicalized AOI keys
+
+Usage: python -m app.cache_report
+"""
+import json
+from app.database import get_connection, canonical_aoi_json
+
+def replay_request_log(limit: int = None) -> dict:
+    """Simulated hit rates of an unbounded cache over the logged AOIs"""
+    conn = get_connection()
+    query = "SELECT aoi_geojson FROM requests ORDER BY id"
+    rows = conn.execute(query + " LIMIT ?", (limit,)) if limit else conn.execute(query)
+
+    raw_seen, canonical_seen = set(), set()
+    total = raw_hits = canonical_hits = 0
+
+    for (aoi_text,) in rows:
+        aoi_geojson = json.loads(aoi_text)
+        raw_key = json.dumps(aoi_geojson, sort_keys=True)
+        canonical_key = canonical_aoi_json(aoi_geojson)
+
+        total += 1
+        raw_hits += raw_key in raw_seen
+        canonical_hits += canonical_key in canonical_seen
+        raw_seen.add(raw_key)
+        canonical_seen.add(canonical_key)
+
+    return {
+        "requests": total,
+        "raw_hit_rate": round(raw_hits / total, 4) if total else 0.0,
+        "canonical_hit_rate": round(canonical_hits / total, 4) if total else 0.0,
+        "distinct_raw_aois": len(raw_seen),
+        "distinct_canonical_aois": len(canonical_seen)
+    }
+
+if __name__ == "__main__":
+    print(json.dumps(replay_request_log(), indent=2))
@@ -2,6 +2,8 @@
 Change Detection Engine
 Computes LULC transitions and changes between baseline and current year
 """
+import numpy as np
+from app.histograms import NUM_CLASSES, as_histogram
 
 LULC_CLASSES = {
     0: "Water",
@@ -15,35 +17,56 @@ LULC_CLASSES = {
     8: "Snow & Ice"
 }
 
-def calculate_changes(baseline_stats: dict, current_stats: dict, area_km2: float):
+# Key transitions to monitor
+KEY_TRANSITIONS = [
+    (1, 6, "forest_to_urban"),      # Trees → Built
+    (1, 7, "forest_to_bare"),       # Trees → Bare
+    (4, 1, "cropland_to_forest"),   # Crops → Trees
+    (2, 6, "grass_to_urban"),       # Grass → Built
+    (0, 7, "water_loss"),           # Water → Bare
+]
+
+def class_key(class_id: int) -> str:
+    return LULC_CLASSES[class_id].lower().replace(" ", "_")
+
+def transition_matrix(histogram: dict) -> np.ndarray:
+    """9x9 from→to pixel counts from a baseline*9 + current histogram"""
+    matrix = np.zeros((NUM_CLASSES, NUM_CLASSES))
+    for code, count in histogram.items():
+        from_class, to_class = divmod(int(float(code)), NUM_CLASSES)
+        matrix[from_class, to_class] += count
+    return matrix
+
+def transition_matrix_report(matrix: np.ndarray, pixel_area_m2: float = 100):
+    """Response form of a transition matrix (rows = baseline, columns = current)"""
+    return {
+        "classes": [LULC_CLASSES[class_id] for class_id in range(NUM_CLASSES)],
+        "pixels": matrix.tolist(),
+        "area_km2": np.round(matrix * pixel_area_m2 / 1e6, 4).tolist()
+    }
+
+def calculate_changes(baseline_stats, current_stats, area_km2: float):
     """
     Calculate changes between baseline and current year
     Returns absolute and percentage changes for each class
     """
     changes = {}
+    baseline = as_histogram(baseline_stats)
+    current = as_histogram(current_stats)
     
-    # Get total pixels for percentage calculation
-    baseline_total = sum(baseline_stats.values())
-    current_total = sum(current_stats.values())
+    # Every class at once (assuming 10m resolution = 100m² per pixel)
+    columns = zip(
+        baseline.percentages.tolist(),
+        current.percentages.tolist(),
+        (current.percentages - baseline.percentages).tolist(),
+        ((current.counts - baseline.counts) * 100 / 1e6).tolist(),
+        (baseline.counts * 100 / 1e6).tolist(),
+        (current.counts * 100 / 1e6).tolist()
+    )
     
-    for class_id in range(9):
-        class_id_str = str(class_id)
+    for class_id, (baseline_pct, current_pct, pct_change, area_change_km2, baseline_km2, current_km2) in enumerate(columns):
         class_name = LULC_CLASSES[class_id]
         
-        baseline_pixels = baseline_stats.get(class_id_str, 0)
-        current_pixels = current_stats.get(class_id_str, 0)
-        
-        # Calculate percentages
-        baseline_pct = (baseline_pixels / baseline_total * 100) if baseline_total > 0 else 0
-        current_pct = (current_pixels / current_total * 100) if current_total > 0 else 0
-        
-        # Calculate changes
-        pixel_change = current_pixels - baseline_pixels
-        pct_change = current_pct - baseline_pct
-        
-        # Calculate area change (assuming 10m resolution = 100m² per pixel)
-        area_change_km2 = (pixel_change * 100) / 1e6
-        
         # Generate human-readable summary
         if abs(pct_change) < 0.1:
             summary = f"{class_name} remained stable"
@@ -52,13 +75,13 @@ def calculate_changes(baseline_stats: dict, current_stats: dict, area_km2: float
         else:
             summary = f"{class_name} decreased by {abs(pct_change):.1f}% ({abs(area_change_km2):.2f} km²)"
         
-        changes[class_name.lower().replace(" ", "_")] = {
+        changes[class_key(class_id)] = {
             "class_id": class_id,
             "class_name": class_name,
             "baseline_pct": round(baseline_pct, 2),
             "current_pct": round(current_pct, 2),
-            "baseline_km2": round((baseline_pixels * 100) / 1e6, 2),
-            "current_km2": round((current_pixels * 100) / 1e6, 2),
+            "baseline_km2": round(baseline_km2, 2),
+            "current_km2": round(current_km2, 2),
             "change_km2": round(area_change_km2, 2),
             "change_pct": round(pct_change, 2),
             "summary": summary
@@ -66,43 +89,44 @@ def calculate_changes(baseline_stats: dict, current_stats: dict, area_km2: float
     
     return changes
 
-def detect_key_transitions(baseline_stats: dict, current_stats: dict):
+def detect_key_transitions(baseline_stats, current_stats, matrix: np.ndarray = None,
+                           pixel_area_m2: float = 100):
     """
     Detect significant LULC transitions (e.g., forest to urban)
+    With a per-pixel transition matrix every from→to pair is read exactly;
+    without one, key pairs are estimated from the two histograms
     """
     transitions = {}
     
-    # Key transitions to monitor
-    transition_pairs = [
-        (1, 6, "forest_to_urban"),      # Trees → Built
-        (1, 7, "forest_to_bare"),       # Trees → Bare
-        (4, 1, "cropland_to_forest"),   # Crops → Trees
-        (2, 6, "grass_to_urban"),       # Grass → Built
-        (0, 7, "water_loss"),           # Water → Bare
-    ]
+    if matrix is not None:
+        named = {(from_class, to_class): name for from_class, to_class, name in KEY_TRANSITIONS}
+        areas_km2 = matrix * pixel_area_m2 / 1e6
+        for from_class, to_class in zip(*np.nonzero(areas_km2 > 0.01)):  # Only report if > 0.01 km²
+            if from_class == to_class:
+                continue
+            name = named.get((from_class, to_class), f"{class_key(from_class)}_to_{class_key(to_class)}")
+            transitions[name] = {
+                "from_class": LULC_CLASSES[from_class],
+                "to_class": LULC_CLASSES[to_class],
+                "area_km2": round(float(areas_km2[from_class, to_class]), 2),
+                "description": f"{LULC_CLASSES[from_class]} converted to {LULC_CLASSES[to_class]}"
+            }
+        return transitions
     
-    for from_class, to_class, transition_name in transition_pairs:
-        from_str = str(from_class)
-        to_str = str(to_class)
-        
-        baseline_from = baseline_stats.get(from_str, 0)
-        current_from = current_stats.get(from_str, 0)
-        current_to = current_stats.get(to_str, 0)
-        baseline_to = baseline_stats.get(to_str, 0)
-        
-        # Estimate transition (simplified)
-        from_loss = max(0, baseline_from - current_from)
-        to_gain = max(0, current_to - baseline_to)
-        
-        # Assume some of the loss contributed to the gain
-        estimated_transition = min(from_loss, to_gain)
-        transition_km2 = (estimated_transition * 100) / 1e6
-        
+    # Histogram estimate: part of each from-class loss fed the to-class gain
+    baseline = as_histogram(baseline_stats).counts
+    current = as_histogram(current_stats).counts
+    from_classes, to_classes, names = zip(*KEY_TRANSITIONS)
+    from_loss = np.maximum(baseline[list(from_classes)] - current[list(from_classes)], 0)
+    to_gain = np.maximum(current[list(to_classes)] - baseline[list(to_classes)], 0)
+    estimated_km2 = np.minimum(from_loss, to_gain) * 100 / 1e6
+    
+    for from_class, to_class, transition_name, transition_km2 in zip(from_classes, to_classes, names, estimated_km2):
         if transition_km2 > 0.01:  # Only report if > 0.01 km²
             transitions[transition_name] = {
                 "from_class": LULC_CLASSES[from_class],
                 "to_class": LULC_CLASSES[to_class],
-                "area_km2": round(transition_km2, 2),
+                "area_km2": round(float(transition_km2), 2),
                 "description": f"{LULC_CLASSES[from_class]} converted to {LULC_CLASSES[to_class]}"
             }
     
@@ -0,0 +1,73 @@
+"""
+Shared Dynamic World composite provider
+Builds each mode composite once per process and hands the same ee.Image
+to every analysis module, keyed by date window and snapped bounds
+"""
+import math
+import os
+import ee
+from dotenv import load_dotenv
+from app.geometry import bounding_box
+from app.lru_cache import LRUCache
+
+load_dotenv()
+
+DW_COLLECTION = "GOOGLE/DYNAMICWORLD/V1"
+
+# Bounds are snapped outward to this grid so nearby AOIs, buffers and
+# KNN candidate areas in one request resolve to the same composite
+COMPOSITE_BOUNDS_GRID_DEG = float(os.getenv("COMPOSITE_BOUNDS_GRID_DEG", 1.0))
+COMPOSITE_CACHE_MAX_ENTRIES = int(os.getenv("COMPOSITE_CACHE_MAX_ENTRIES", 256))
+
+_composites = LRUCache(COMPOSITE_CACHE_MAX_ENTRIES)
+
+def year_range(year: int):
+    """Calendar-year date window used for yearly composites"""
+    return f"{year}-01-01", f"{year}-12-31"
+
+def aoi_bounds(aoi_geojson: dict, buffer_km: float = 0) -> tuple:
+    """Bounding box of an AOI padded by buffer_km and snapped outward to the grid"""
+    min_lon, min_lat, max_lon, max_lat = bounding_box(aoi_geojson)
+
+    pad_lat = buffer_km / 111
+    pad_lon = pad_lat / max(math.cos(math.radians(max(abs(min_lat), abs(max_lat)))), 0.01)
+
+    grid = COMPOSITE_BOUNDS_GRID_DEG
+    return (
+        max(math.floor((min_lon - pad_lon) / grid) * grid, -180),
+        max(math.floor((min_lat - pad_lat) / grid) * grid, -90),
+        min(math.ceil((max_lon + pad_lon) / grid) * grid, 180),
+        min(math.ceil((max_lat + pad_lat) / grid) * grid, 90)
+    )
+
+def union_bounds(bounds_list) -> tuple:
+    """Smallest box covering several (min_lon, min_lat, max_lon, max_lat) boxes"""
+    bounds_list = list(bounds_list)
+    return (
+        min(b[0] for b in bounds_list),
+        min(b[1] for b in bounds_list),
+        max(b[2] for b in bounds_list),
+        max(b[3] for b in bounds_list)
+    )
+
+def get_composite(start_date: str, end_date: str, bounds: tuple = None):
+    """Mode composite of Dynamic World labels, memoized per (window, bounds)"""
+    key = (start_date, end_date, bounds)
+    composite = _composites.get(key)
+    if composite is not None:
+        return composite
+
+    # cspell:disable-next-line
+    collection = ee.ImageCollection(DW_COLLECTION).filterDate(start_date, end_date)
+    if bounds is not None:
+        collection = collection.filterBounds(ee.Geometry.Rectangle(list(bounds)))
+
+    composite = collection.select("label").mode()
+    _composites.put(key, composite)
+    return composite
+
+def get_yearly_composite(year: int, bounds: tuple = None):
+    return get_composite(*year_range(year), bounds=bounds)
+
+def composite_cache_stats() -> dict:
+    return _composites.stats()
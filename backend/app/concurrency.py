@@ -0,0 +1,122 @@
+"""
+Shared worker pools for blocking Earth Engine calls
+Bounds total GEE concurrency and per-request fan-out, and coalesces
+identical in-flight computations into a single future
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+
+load_dotenv()
+
+GEE_MAX_WORKERS = int(os.getenv("GEE_MAX_WORKERS", 16))
+REQUEST_MAX_CONCURRENCY = int(os.getenv("REQUEST_MAX_CONCURRENCY", 4))
+REQUEST_WORKERS = int(os.getenv("REQUEST_WORKERS", 32))
+BUDGET_WORKERS = int(os.getenv("BUDGET_WORKERS", REQUEST_WORKERS))
+
+# Leaf GEE calls run on gee_executor; whole request handlers run on
+# request_executor so they can fan out to gee_executor without deadlocking.
+# Time-boxed sub-tasks of a handler get their own pool so they never queue
+# behind the handlers waiting on them
+gee_executor = ThreadPoolExecutor(max_workers=GEE_MAX_WORKERS, thread_name_prefix="gee")
+request_executor = ThreadPoolExecutor(max_workers=REQUEST_WORKERS, thread_name_prefix="request")
+budget_executor = ThreadPoolExecutor(max_workers=BUDGET_WORKERS, thread_name_prefix="budget")
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+def iter_bounded(fn, items, max_in_flight: int = REQUEST_MAX_CONCURRENCY, executor=gee_executor):
+    """
+    Run fn over items on a shared pool, yielding (index, result) as calls finish
+    At most max_in_flight calls run at once
+    """
+    items = list(items)
+    pending = {}
+    next_index = 0
+    max_in_flight = max(1, max_in_flight)
+
+    while next_index < len(items) or pending:
+        while next_index < len(items) and len(pending) < max_in_flight:
+            future = executor.submit(fn, items[next_index])
+            pending[future] = next_index
+            next_index += 1
+
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield pending.pop(future), future.result()
+
+def map_bounded(fn, items, max_in_flight: int = REQUEST_MAX_CONCURRENCY):
+    """
+    Run fn over items on the shared GEE pool
+    At most max_in_flight calls run at once; results keep input order
+    """
+    items = list(items)
+    results = [None] * len(items)
+    for index, result in iter_bounded(fn, items, max_in_flight):
+        results[index] = result
+    return results
+
+def _release(key, future):
+    with _inflight_lock:
+        if _inflight.get(key) is future:
+            del _inflight[key]
+
+def call_coalesced(key, fn, *args):
+    """
+    Blocking call shared by concurrent callers with the same key
+    The first caller computes in its own thread; the rest wait for its result
+    """
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _inflight[key] = future
+
+    if not leader:
+        return future.result()
+
+    try:
+        result = fn(*args)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        _release(key, future)
+
+def call_with_budget(fn, timeout_seconds: float, *args):
+    """
+    Blocking call on the budget pool with a time budget: (finished, result)
+    Work that overruns is not cancelled, so its results still reach the caches
+    """
+    future = budget_executor.submit(fn, *args)
+    try:
+        return True, future.result(timeout=timeout_seconds)
+    except TimeoutError:
+        return False, None
+
+async def run_coalesced(key, fn, *args):
+    """
+    Await fn(*args) on the request pool, joining any identical computation
+    already in flight instead of starting a new one
+    """
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = request_executor.submit(fn, *args)
+            _inflight[key] = future
+
+    if leader:
+        future.add_done_callback(lambda done: _release(key, done))
+
+    # Shield so one caller going away never cancels the shared work
+    return await asyncio.shield(asyncio.wrap_future(future))
+
+async def run_blocking(fn, *args):
+    """Await a blocking call on the request pool without coalescing"""
+    return await asyncio.get_running_loop().run_in_executor(request_executor, fn, *args)
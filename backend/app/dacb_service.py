@@ -1,68 +1,189 @@
+import os
 import ee
-from app.gee_service import geojson_to_ee, generate_lulc
-from app.knn_service import select_control_areas_knn
+from dotenv import load_dotenv
+from app.gee_service import geojson_to_ee, generate_zone_series
+from app.lulc_service import year_range, read_cached_series, save_series, get_lulc_series_batch, get_lulc_tile
+from app.composites import aoi_bounds, union_bounds
+from app.database import hash_aoi
+from app.lru_cache import LRUCache
+from app.quality_tiers import LEGACY_TIER, estimated_error_pct
+from app.knn_service import select_control_areas_knn, select_control_areas_knn_batch
+from app.concurrency import iter_bounded, map_bounded, request_executor
+from app.histograms import FOREST_CLASS, ClassHistogram, histogram_counts
 import numpy as np
 
+load_dotenv()
+
+# Projects per portfolio chunk (one KNN query and one zone reduction each)
+DACB_PORTFOLIO_CHUNK_SIZE = int(os.getenv("DACB_PORTFOLIO_CHUNK_SIZE", 25))
+
+# Buffer control rings by (AOI hash, buffer_km); rings never change
+_buffer_geojsons = LRUCache(1024)
+
+def buffer_geometry(aoi, buffer_km=5):
+    """Server-side buffer ring around an ee.Geometry"""
+    buffer_meters = buffer_km * 1000
+    return aoi.buffer(buffer_meters).difference(aoi)
+
+def buffer_key(aoi_geojson, buffer_km):
+    return hash_aoi(aoi_geojson, "", ""), buffer_km
+
 def generate_buffer(aoi_geojson, buffer_km=5):
     """Generate buffer zone around AOI"""
-    aoi = geojson_to_ee(aoi_geojson)
-    buffer_meters = buffer_km * 1000
-    buffer = aoi.buffer(buffer_meters).difference(aoi)
-    
-    buffer_geojson = {
-        "type": "Feature",
-        "geometry": buffer.getInfo()
-    }
+    key = buffer_key(aoi_geojson, buffer_km)
+    buffer_geojson = _buffer_geojsons.get(key)
+    if buffer_geojson is None:
+        buffer = buffer_geometry(geojson_to_ee(aoi_geojson), buffer_km)
+        buffer_geojson = {
+            "type": "Feature",
+            "geometry": buffer.getInfo()
+        }
+        _buffer_geojsons.put(key, buffer_geojson)
     
     return buffer_geojson
 
+# Array-native DACB math: every argument is a NumPy array (or scalar) with
+# one entry per project, and every result is a column of the same length
+
+def forest_area_array(counts, total_area_km2):
+    """Forest km² per row of a (n, NUM_CLASSES) histogram array"""
+    counts = np.asarray(counts, dtype=float)
+    total_pixels = counts.sum(axis=-1)
+    forest_pct = np.divide(
+        counts[..., FOREST_CLASS], total_pixels,
+        out=np.zeros(total_pixels.shape), where=total_pixels != 0
+    )
+    return np.asarray(total_area_km2, dtype=float) * forest_pct
+
+def control_trend_array(F_c_t0, F_c_tn, years):
+    """Annual control forest loss rate (0 where no time has elapsed)"""
+    loss, years = np.broadcast_arrays(np.asarray(F_c_t0, dtype=float) - F_c_tn, np.asarray(years, dtype=float))
+    return np.divide(loss, years, out=np.zeros(loss.shape), where=years != 0)
+
+def dynamic_baseline_array(F_p_t0, control_trend, years):
+    return np.maximum(np.asarray(F_p_t0, dtype=float) - control_trend * np.asarray(years, dtype=float), 0)
+
+def avoided_deforestation_array(F_hat_p_tn, F_p_obs_tn):
+    return np.maximum(np.asarray(F_hat_p_tn, dtype=float) - F_p_obs_tn, 0)
+
+def leakage_ratio_array(project_loss, control_loss):
+    """Control loss over project loss (0 where the project did not change)"""
+    project_loss = np.asarray(project_loss, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.asarray(control_loss, dtype=float) / (project_loss + 0.1)
+    return np.where(project_loss != 0, ratio, 0.0)
+
+def leakage_adjustment_array(AD, leakage_ratio):
+    """Adjusted AD, discount factor and severity label per project"""
+    leakage_ratio = np.asarray(leakage_ratio, dtype=float)
+    conditions = [leakage_ratio < 0.8, leakage_ratio <= 1.5]
+    lambda_factor = np.select(conditions, [1.00, 0.75], default=0.50)
+    severity = np.select(conditions, ["LOW", "MEDIUM"], default="HIGH")
+    return np.asarray(AD, dtype=float) * lambda_factor, lambda_factor, severity
+
+def permanence_score_array(F_p_t0, F_p_obs_tn, leakage_ratio):
+    """Unrounded permanence confidence (0-100)"""
+    F_p_t0 = np.asarray(F_p_t0, dtype=float)
+    forest_change = np.abs(F_p_t0 - F_p_obs_tn)
+    FSI = 1 - np.divide(forest_change, F_p_t0, out=np.ones(F_p_t0.shape), where=F_p_t0 > 0)
+    FSI = np.clip(FSI, 0, 1)
+    
+    L_norm = np.minimum(np.asarray(leakage_ratio, dtype=float) / 2, 1)
+    return 100 * FSI * (1 - L_norm)
+
+def control_similarity_array(F_p_t0, A_p, F_c_t0, A_c):
+    """Project and control forest percentages and their similarity (0-1)"""
+    A_p, A_c = np.asarray(A_p, dtype=float), np.asarray(A_c, dtype=float)
+    forest_pct_p = np.divide(F_p_t0, A_p, out=np.zeros(A_p.shape), where=A_p > 0) * 100
+    forest_pct_c = np.divide(F_c_t0, A_c, out=np.zeros(A_c.shape), where=A_c > 0) * 100
+    similarity = np.clip(1 - np.abs(forest_pct_p - forest_pct_c) / 100, 0, 1)
+    return similarity, forest_pct_p, forest_pct_c
+
+def dacb_metrics_array(pa_counts_t0, pa_counts_tn, pa_area_km2, ca_counts_t0, ca_counts_tn, ca_area_km2, years):
+    """
+    Columnar DACB metrics for many projects
+    Histogram arguments are (n, NUM_CLASSES) arrays, areas and years are
+    length-n arrays (or scalars); returns a dict of length-n columns
+    """
+    F_p_t0 = forest_area_array(pa_counts_t0, pa_area_km2)
+    F_p_obs_tn = forest_area_array(pa_counts_tn, pa_area_km2)
+    F_c_t0 = forest_area_array(ca_counts_t0, ca_area_km2)
+    F_c_tn = forest_area_array(ca_counts_tn, ca_area_km2)
+    
+    r_c = control_trend_array(F_c_t0, F_c_tn, years)
+    F_hat_p_tn = dynamic_baseline_array(F_p_t0, r_c, years)
+    AD = avoided_deforestation_array(F_hat_p_tn, F_p_obs_tn)
+    
+    leakage_ratio = leakage_ratio_array(F_p_t0 - F_p_obs_tn, F_c_t0 - F_c_tn)
+    AD_adj, lambda_factor, leakage_severity = leakage_adjustment_array(AD, leakage_ratio)
+    PCS = np.round(permanence_score_array(F_p_t0, F_p_obs_tn, leakage_ratio), 1)
+    similarity, forest_pct_p, forest_pct_c = control_similarity_array(F_p_t0, pa_area_km2, F_c_t0, ca_area_km2)
+    
+    return {
+        "project_forest_baseline_km2": F_p_t0,
+        "project_forest_current_km2": F_p_obs_tn,
+        "control_forest_baseline_km2": F_c_t0,
+        "control_forest_current_km2": F_c_tn,
+        "control_trend_km2_per_year": r_c,
+        "expected_forest_km2": F_hat_p_tn,
+        "avoided_deforestation_km2": AD,
+        "leakage_ratio": leakage_ratio,
+        "leakage_severity": leakage_severity,
+        "leakage_adjustment_factor": lambda_factor,
+        "adjusted_avoided_deforestation_km2": AD_adj,
+        "permanence_score": PCS,
+        "control_similarity": similarity,
+        "project_forest_pct": forest_pct_p,
+        "control_forest_pct": forest_pct_c,
+        "confidence": np.select([PCS > 70, PCS > 50], ["HIGH", "MEDIUM"], default="LOW")
+    }
+
+# Scalar DACB math for a single project: plain arithmetic, the same
+# formulas as the array versions above without per-call array allocation
+
 def extract_forest_area(stats, total_area_km2):
     """Extract forest area from LULC stats (Class 1 = Trees)"""
-    total_pixels = sum(stats.values())
-    tree_pixels = stats.get("1", 0)
+    if isinstance(stats, ClassHistogram):
+        total_pixels, tree_pixels = stats.total, stats[FOREST_CLASS]
+    else:
+        total_pixels, tree_pixels = sum(stats.values()), stats.get(str(FOREST_CLASS), 0)
     
     if total_pixels == 0:
         return 0.0
     
-    forest_pct = tree_pixels / total_pixels
-    forest_km2 = total_area_km2 * forest_pct
-    
-    return forest_km2
+    return total_area_km2 * (tree_pixels / total_pixels)
 
 def calculate_control_trend(control_stats_t0, control_area_t0, control_stats_tn, control_area_tn, years):
     """Calculate annual forest loss rate in control area"""
     F_c_t0 = extract_forest_area(control_stats_t0, control_area_t0)
     F_c_tn = extract_forest_area(control_stats_tn, control_area_tn)
     
-    r_c = (F_c_t0 - F_c_tn) / years
+    r_c = (F_c_t0 - F_c_tn) / years if years != 0 else 0.0
     
     return r_c, F_c_t0, F_c_tn
 
 def dynamic_baseline(F_p_t0, control_trend, years):
     """Calculate expected forest area at current year"""
-    F_hat_p_tn = F_p_t0 - control_trend * years
-    return max(F_hat_p_tn, 0)
+    return max(F_p_t0 - control_trend * years, 0)
 
 def calculate_avoided_deforestation(F_hat_p_tn, F_p_obs_tn):
     """Calculate avoided deforestation"""
-    AD = F_hat_p_tn - F_p_obs_tn
-    return max(AD, 0)
+    return max(F_hat_p_tn - F_p_obs_tn, 0)
+
+def calculate_leakage_ratio(project_loss, control_loss):
+    """Control loss over project loss (0 where the project did not change)"""
+    return control_loss / (project_loss + 0.1) if project_loss != 0 else 0
 
 def apply_leakage_adjustment(AD, leakage_ratio):
     """Apply leakage discount factor"""
     if leakage_ratio < 0.8:
-        lambda_factor = 1.00
-        severity = "LOW"
+        lambda_factor, severity = 1.00, "LOW"
     elif leakage_ratio <= 1.5:
-        lambda_factor = 0.75
-        severity = "MEDIUM"
+        lambda_factor, severity = 0.75, "MEDIUM"
     else:
-        lambda_factor = 0.50
-        severity = "HIGH"
+        lambda_factor, severity = 0.50, "HIGH"
     
-    AD_adj = AD * lambda_factor
-    
-    return AD_adj, lambda_factor, severity
+    return AD * lambda_factor, lambda_factor, severity
 
 def calculate_permanence_score(F_p_t0, F_p_obs_tn, leakage_ratio):
     """Calculate permanence confidence (0-100)"""
@@ -71,18 +192,16 @@ def calculate_permanence_score(F_p_t0, F_p_obs_tn, leakage_ratio):
     FSI = max(0, min(FSI, 1))
     
     L_norm = min(leakage_ratio / 2, 1)
-    PCS = 100 * FSI * (1 - L_norm)
-    
-    return round(PCS, 1)
+    return round(100 * FSI * (1 - L_norm), 1)
 
-def control_area_quality_score(F_p_t0, A_p, F_c_t0, A_c):
-    """Score similarity between PA and CA"""
+def control_similarity(F_p_t0, A_p, F_c_t0, A_c):
+    """Project and control forest percentages and their similarity (0-1)"""
     forest_pct_p = (F_p_t0 / A_p * 100) if A_p > 0 else 0
     forest_pct_c = (F_c_t0 / A_c * 100) if A_c > 0 else 0
-    
-    similarity = 1 - abs(forest_pct_p - forest_pct_c) / 100
-    similarity = max(0, min(similarity, 1))
-    
+    similarity = max(0, min(1 - abs(forest_pct_p - forest_pct_c) / 100, 1))
+    return similarity, forest_pct_p, forest_pct_c
+
+def control_quality(similarity, forest_pct_p, forest_pct_c):
     quality = "HIGH" if similarity > 0.8 else "MEDIUM" if similarity > 0.6 else "LOW"
     
     return {
@@ -92,85 +211,286 @@ def control_area_quality_score(F_p_t0, A_p, F_c_t0, A_c):
         "control_forest_pct": round(forest_pct_c, 1)
     }
 
-def dacb_analysis(aoi_geojson, baseline_year, current_year, buffer_km=5, use_knn=False):
-    """Complete DACB analysis with optional KNN control selection"""
+def control_area_quality_score(F_p_t0, A_p, F_c_t0, A_c):
+    """Score similarity between PA and CA"""
+    return control_quality(*control_similarity(F_p_t0, A_p, F_c_t0, A_c))
+
+def dacb_metrics(pa_stats_t0, pa_stats_tn, A_p, ca_stats_t0, ca_stats_tn, A_c, years):
+    """DACB metrics for one project, keyed like the dacb_metrics_array columns"""
+    F_p_t0 = extract_forest_area(pa_stats_t0, A_p)
+    F_p_obs_tn = extract_forest_area(pa_stats_tn, A_p)
+    r_c, F_c_t0, F_c_tn = calculate_control_trend(ca_stats_t0, A_c, ca_stats_tn, A_c, years)
+    
+    F_hat_p_tn = dynamic_baseline(F_p_t0, r_c, years)
+    AD = calculate_avoided_deforestation(F_hat_p_tn, F_p_obs_tn)
+    
+    leakage_ratio = calculate_leakage_ratio(F_p_t0 - F_p_obs_tn, F_c_t0 - F_c_tn)
+    AD_adj, lambda_factor, leakage_severity = apply_leakage_adjustment(AD, leakage_ratio)
+    PCS = calculate_permanence_score(F_p_t0, F_p_obs_tn, leakage_ratio)
+    similarity, forest_pct_p, forest_pct_c = control_similarity(F_p_t0, A_p, F_c_t0, A_c)
+    
+    return {
+        "project_forest_baseline_km2": F_p_t0,
+        "project_forest_current_km2": F_p_obs_tn,
+        "control_forest_baseline_km2": F_c_t0,
+        "control_forest_current_km2": F_c_tn,
+        "control_trend_km2_per_year": r_c,
+        "expected_forest_km2": F_hat_p_tn,
+        "avoided_deforestation_km2": AD,
+        "leakage_ratio": leakage_ratio,
+        "leakage_severity": leakage_severity,
+        "leakage_adjustment_factor": lambda_factor,
+        "adjusted_avoided_deforestation_km2": AD_adj,
+        "permanence_score": PCS,
+        "control_similarity": similarity,
+        "project_forest_pct": forest_pct_p,
+        "control_forest_pct": forest_pct_c,
+        "confidence": "HIGH" if PCS > 70 else "MEDIUM" if PCS > 50 else "LOW"
+    }
+
+def knn_control_metadata(knn_result):
+    """Control selection metadata for a KNN result"""
+    return {
+        'method': 'KNN',
+        'k_value': knn_result['k_value'],
+        'features': knn_result['features_used'],
+        'distance_metric': knn_result['distance_metric'],
+        'selected_tiles': [t['tile_id'] for t in knn_result['selected_tiles']],
+        'avg_similarity': round(np.mean([t['similarity_score'] for t in knn_result['selected_tiles']]), 3)
+    }
+
+def format_dacb_result(metrics, baseline_year, current_year, buffer_km,
+                       project_tile_url, control_tile_url, control_geojson, control_metadata,
+                       quality_tier=LEGACY_TIER, estimated_error_pct=0.0):
+    """DACB response for one project from its dacb_metrics (or one dacb_metrics_array row)"""
+    F_p_obs_tn = float(metrics["project_forest_current_km2"])
     
-    years = current_year - baseline_year
+    return {
+        "baseline_model": "Dynamic Area Control Baseline",
+        "baseline_year": baseline_year,
+        "current_year": current_year,
+        "years_elapsed": current_year - baseline_year,
+        "buffer_km": buffer_km,
+        "project_tile_url": project_tile_url,
+        "control_tile_url": control_tile_url,
+        "control_geojson": control_geojson,
+        "project_forest_baseline_km2": round(float(metrics["project_forest_baseline_km2"]), 2),
+        "project_forest_current_km2": round(F_p_obs_tn, 2),
+        "control_forest_baseline_km2": round(float(metrics["control_forest_baseline_km2"]), 2),
+        "control_forest_current_km2": round(float(metrics["control_forest_current_km2"]), 2),
+        "control_trend_km2_per_year": round(float(metrics["control_trend_km2_per_year"]), 3),
+        "expected_forest_km2": round(float(metrics["expected_forest_km2"]), 2),
+        "observed_forest_km2": round(F_p_obs_tn, 2),
+        "avoided_deforestation_km2": round(float(metrics["avoided_deforestation_km2"]), 2),
+        "leakage_ratio": round(float(metrics["leakage_ratio"]), 2),
+        "leakage_severity": str(metrics["leakage_severity"]),
+        "leakage_adjustment_factor": float(metrics["leakage_adjustment_factor"]),
+        "adjusted_avoided_deforestation_km2": round(float(metrics["adjusted_avoided_deforestation_km2"]), 2),
+        "permanence_score": float(metrics["permanence_score"]),
+        "control_area_quality": control_quality(
+            float(metrics["control_similarity"]),
+            float(metrics["project_forest_pct"]),
+            float(metrics["control_forest_pct"])
+        ),
+        "confidence": str(metrics["confidence"]),
+        "control_selection": control_metadata,
+        "quality_tier": quality_tier,
+        "estimated_error_pct": estimated_error_pct
+    }
+
+def dacb_result(pa_series, ca_series, baseline_year, current_year, buffer_km,
+                project_tile_url, control_tile_url, control_geojson, control_metadata,
+                quality_tier=LEGACY_TIER, estimated_error_pct=0.0):
+    """DACB metrics from project and control series (pure math, no GEE calls)"""
+    metrics = dacb_metrics(
+        pa_series['stats'][baseline_year], pa_series['stats'][current_year], pa_series['area_km2'],
+        ca_series['stats'][baseline_year], ca_series['stats'][current_year], ca_series['area_km2'],
+        current_year - baseline_year
+    )
+    return format_dacb_result(
+        metrics, baseline_year, current_year, buffer_km,
+        project_tile_url, control_tile_url, control_geojson, control_metadata,
+        quality_tier, estimated_error_pct
+    )
+
+def dacb_analysis(aoi_geojson, baseline_year, current_year, buffer_km=5, use_knn=False, quality_tier=LEGACY_TIER):
+    """
+    Complete DACB analysis with optional KNN control selection
+    Uncached project and control stats come from one grouped reduction,
+    submitted alongside tile minting; a buffer control stays server-side
+    and its GeoJSON rides along in the same round trip
+    """
+    years = [baseline_year, current_year]
+    aoi = geojson_to_ee(aoi_geojson)
+    control_geojson = None
     
     # Select control area
     if use_knn:
         try:
             knn_result = select_control_areas_knn(aoi_geojson, baseline_year, current_year, k=5, buffer_km=buffer_km*2)
             control_geojson = knn_result['control_geojson']
-            control_metadata = {
-                'method': 'KNN',
-                'k_value': knn_result['k_value'],
-                'features': knn_result['features_used'],
-                'selected_tiles': [t['tile_id'] for t in knn_result['selected_tiles']],
-                'avg_similarity': round(np.mean([t['similarity_score'] for t in knn_result['selected_tiles']]), 3)
-            }
+            control_geometry = knn_result['control_geometry']
+            control_metadata = knn_control_metadata(knn_result)
         except Exception as e:
             # Fallback to buffer if KNN fails
-            control_geojson = generate_buffer(aoi_geojson, buffer_km)
             control_metadata = {'method': 'BUFFER_FALLBACK', 'buffer_km': buffer_km, 'knn_error': str(e)}
     else:
-        control_geojson = generate_buffer(aoi_geojson, buffer_km)
         control_metadata = {'method': 'BUFFER', 'buffer_km': buffer_km}
     
-    pa_baseline = generate_lulc(aoi_geojson, f"{baseline_year}-01-01", f"{baseline_year}-12-31")
-    pa_current = generate_lulc(aoi_geojson, f"{current_year}-01-01", f"{current_year}-12-31")
-    ca_baseline = generate_lulc(control_geojson, f"{baseline_year}-01-01", f"{baseline_year}-12-31")
-    ca_current = generate_lulc(control_geojson, f"{current_year}-01-01", f"{current_year}-12-31")
+    if control_geojson is None:
+        control_geometry = buffer_geometry(aoi, buffer_km)
+        control_geojson = _buffer_geojsons.get(buffer_key(aoi_geojson, buffer_km))
+    
+    # Cached years are read locally
+    pa_stats, pa_area, pa_missing = read_cached_series(aoi_geojson, years, quality_tier)
+    if control_geojson is not None:
+        ca_stats, ca_area, ca_missing = read_cached_series(control_geojson, years, quality_tier)
+    else:
+        ca_stats, ca_area, ca_missing = {}, None, list(years)
+    
+    needs_reduction = bool(pa_missing or ca_missing) or control_geojson is None
+    if control_geojson is not None:
+        bounds = union_bounds([aoi_bounds(aoi_geojson), aoi_bounds(control_geojson)])
+    else:
+        bounds = aoi_bounds(aoi_geojson, buffer_km)
+    
+    def reduce_zones():
+        geometries = ([aoi] if pa_missing else []) + ([control_geometry] if ca_missing else [])
+        extras = {'control_geometry': control_geometry} if control_geojson is None else None
+        zone_years = sorted(set(pa_missing) | set(ca_missing))
+        return generate_zone_series(geometries, zone_years, bounds, extras, quality_tier)
+    
+    # The grouped reduction and tile minting run concurrently
+    tasks = {'project_tile': lambda: get_lulc_tile(aoi_geojson, *year_range(current_year))}
+    if needs_reduction:
+        tasks['zones'] = reduce_zones
+    if control_geojson is not None:
+        tasks['control_tile'] = lambda: get_lulc_tile(control_geojson, *year_range(current_year))
+    results = dict(zip(tasks, map_bounded(lambda task: task(), tasks.values())))
+    
+    if needs_reduction:
+        series, extras = results['zones']
+        if control_geojson is None:
+            control_geojson = {"type": "Feature", "geometry": extras['control_geometry']}
+            _buffer_geojsons.put(buffer_key(aoi_geojson, buffer_km), control_geojson)
+        
+        series = iter(series)
+        if pa_missing:
+            pa = next(series)
+            save_series(aoi_geojson, pa, pa_missing, quality_tier)
+            pa_stats.update(pa['stats'])
+            pa_area = pa['area_km2']
+        if ca_missing:
+            ca = next(series)
+            save_series(control_geojson, ca, ca_missing, quality_tier)
+            ca_stats.update(ca['stats'])
+            ca_area = ca['area_km2']
     
-    F_p_t0 = extract_forest_area(pa_baseline['stats'], pa_baseline['area_km2'])
-    F_p_obs_tn = extract_forest_area(pa_current['stats'], pa_current['area_km2'])
+    # A buffer ring evaluated just now mints its tile afterwards
+    control_tile_url = results.get('control_tile') or get_lulc_tile(control_geojson, *year_range(current_year))
     
-    r_c, F_c_t0, F_c_tn = calculate_control_trend(
-        ca_baseline['stats'], ca_baseline['area_km2'],
-        ca_current['stats'], ca_current['area_km2'],
-        years
+    return dacb_result(
+        {'stats': pa_stats, 'area_km2': pa_area or 0}, {'stats': ca_stats, 'area_km2': ca_area or 0},
+        baseline_year, current_year, buffer_km,
+        results['project_tile'], control_tile_url, control_geojson, control_metadata,
+        quality_tier, estimated_error_pct(aoi_geojson, quality_tier)
     )
+
+def portfolio_chunks(projects, chunk_size=DACB_PORTFOLIO_CHUNK_SIZE):
+    """Split projects into chunks sharing a year pair and tier (composites, KNN index, reductions)"""
+    groups = {}
+    for project in projects:
+        key = (project['baseline_year'], project['current_year'], project['quality_tier'])
+        groups.setdefault(key, []).append(project)
     
-    F_hat_p_tn = dynamic_baseline(F_p_t0, r_c, years)
-    AD = calculate_avoided_deforestation(F_hat_p_tn, F_p_obs_tn)
+    return [
+        group[start:start + chunk_size]
+        for group in groups.values()
+        for start in range(0, len(group), chunk_size)
+    ]
+
+def run_portfolio_chunk(chunk):
+    """
+    DACB for projects sharing a year pair and quality tier
+    KNN projects are matched with one batched query per buffer size, both
+    zones of every project are reduced in one FeatureCollection pass and
+    the DACB math runs once over the chunk's count arrays
+    """
+    baseline_year, current_year = chunk[0]['baseline_year'], chunk[0]['current_year']
+    quality_tier = chunk[0]['quality_tier']
+    controls = [None] * len(chunk)
     
-    project_loss = F_p_t0 - F_p_obs_tn
-    control_loss = F_c_t0 - F_c_tn
-    leakage_ratio = control_loss / (project_loss + 0.1) if project_loss != 0 else 0
+    # Batched KNN per buffer size; failures fall back to the buffer ring
+    knn_groups = {}
+    for i, project in enumerate(chunk):
+        if project['use_knn']:
+            knn_groups.setdefault(project['buffer_km'], []).append(i)
     
-    AD_adj, lambda_factor, leakage_severity = apply_leakage_adjustment(AD, leakage_ratio)
-    PCS = calculate_permanence_score(F_p_t0, F_p_obs_tn, leakage_ratio)
+    for buffer_km, indices in knn_groups.items():
+        try:
+            knn_results = select_control_areas_knn_batch(
+                [chunk[i]['aoi'] for i in indices], baseline_year, current_year, k=5, buffer_km=buffer_km*2
+            )
+            for i, knn_result in zip(indices, knn_results):
+                controls[i] = (knn_result['control_geojson'], knn_control_metadata(knn_result))
+        except Exception as e:
+            for i in indices:
+                controls[i] = (None, {'method': 'BUFFER_FALLBACK', 'buffer_km': buffer_km, 'knn_error': str(e)})
+    
+    buffered = [i for i in range(len(chunk)) if controls[i] is None or controls[i][0] is None]
+    buffers = map_bounded(lambda i: generate_buffer(chunk[i]['aoi'], chunk[i]['buffer_km']), buffered)
+    for i, buffer_geojson in zip(buffered, buffers):
+        metadata = controls[i][1] if controls[i] else {'method': 'BUFFER', 'buffer_km': chunk[i]['buffer_km']}
+        controls[i] = (buffer_geojson, metadata)
     
-    quality = control_area_quality_score(
-        F_p_t0, pa_baseline['area_km2'],
-        F_c_t0, ca_baseline['area_km2']
+    # One reduction for every project and control zone in the chunk
+    zones = [project['aoi'] for project in chunk] + [control_geojson for control_geojson, _ in controls]
+    series = get_lulc_series_batch(zones, [baseline_year, current_year], quality_tier)
+    tile_urls = map_bounded(lambda zone: get_lulc_tile(zone, *year_range(current_year)), zones)
+    
+    # The whole chunk's math in one columnar pass
+    projects, control_zones = series[:len(chunk)], series[len(chunk):]
+    metrics = dacb_metrics_array(
+        histogram_counts([pa['stats'][baseline_year] for pa in projects]),
+        histogram_counts([pa['stats'][current_year] for pa in projects]),
+        np.array([pa['area_km2'] for pa in projects], dtype=float),
+        histogram_counts([ca['stats'][baseline_year] for ca in control_zones]),
+        histogram_counts([ca['stats'][current_year] for ca in control_zones]),
+        np.array([ca['area_km2'] for ca in control_zones], dtype=float),
+        current_year - baseline_year
     )
     
-    confidence = "HIGH" if PCS > 70 else "MEDIUM" if PCS > 50 else "LOW"
+    # Plain Python columns so per-project formatting skips NumPy scalars
+    columns = {name: column.tolist() for name, column in metrics.items()}
     
-    return {
-        "baseline_model": "Dynamic Area Control Baseline",
-        "baseline_year": baseline_year,
-        "current_year": current_year,
-        "years_elapsed": years,
-        "buffer_km": buffer_km,
-        "project_tile_url": pa_current['tile_url'],
-        "control_tile_url": ca_current['tile_url'],
-        "control_geojson": control_geojson,
-        "project_forest_baseline_km2": round(F_p_t0, 2),
-        "project_forest_current_km2": round(F_p_obs_tn, 2),
-        "control_forest_baseline_km2": round(F_c_t0, 2),
-        "control_forest_current_km2": round(F_c_tn, 2),
-        "control_trend_km2_per_year": round(r_c, 3),
-        "expected_forest_km2": round(F_hat_p_tn, 2),
-        "observed_forest_km2": round(F_p_obs_tn, 2),
-        "avoided_deforestation_km2": round(AD, 2),
-        "leakage_ratio": round(leakage_ratio, 2),
-        "leakage_severity": leakage_severity,
-        "leakage_adjustment_factor": lambda_factor,
-        "adjusted_avoided_deforestation_km2": round(AD_adj, 2),
-        "permanence_score": PCS,
-        "control_area_quality": quality,
-        "confidence": confidence,
-        "control_selection": control_metadata
-    }
+    results = []
+    for i, project in enumerate(chunk):
+        control_geojson, control_metadata = controls[i]
+        results.append({
+            'project_id': project['project_id'],
+            'result': format_dacb_result(
+                {name: column[i] for name, column in columns.items()},
+                baseline_year, current_year, project['buffer_km'],
+                tile_urls[i], tile_urls[len(chunk) + i], control_geojson, control_metadata,
+                quality_tier, estimated_error_pct(project['aoi'], quality_tier)
+            )
+        })
+    return results
+
+def dacb_portfolio(projects, chunk_size=DACB_PORTFOLIO_CHUNK_SIZE):
+    """
+    DACB for many projects, yielding per-project results as chunks finish
+    Chunks run on the request pool so their leaf GEE calls can fan out to
+    the GEE pool; a failed chunk yields an error per project
+    """
+    projects = [{**project, 'quality_tier': project.get('quality_tier') or LEGACY_TIER} for project in projects]
+    chunks = portfolio_chunks(projects, chunk_size)
+    
+    def run_chunk(chunk):
+        try:
+            return run_portfolio_chunk(chunk)
+        except Exception as e:
+            return [{'project_id': project['project_id'], 'error': str(e)} for project in chunk]
+    
+    for _, results in iter_bounded(run_chunk, chunks, executor=request_executor):
+        yield from results
@@ -1,12 +1,51 @@
 import sqlite3
 import json
+import os
+import threading
+import time
 from datetime import datetime
 import hashlib
+from dotenv import load_dotenv
+from app.lru_cache import LRUCache
+from app.geometry import canonicalize_aoi
+
+load_dotenv()
 
 DB_PATH = "sylithe.db"
 
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", 20000))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+
+# Decimal places kept when canonicalizing AOI coordinates (6 ≈ 0.1 m)
+AOI_HASH_PRECISION = int(os.getenv("AOI_HASH_PRECISION", 6))
+MEMORY_CACHE_MAX_ENTRIES = int(os.getenv("MEMORY_CACHE_MAX_ENTRIES", 4096))
+
+# In-process LRU front caches keyed by the same digests as the tables
+record_memory_cache = LRUCache(MEMORY_CACHE_MAX_ENTRIES)
+baseline_memory_cache = LRUCache(MEMORY_CACHE_MAX_ENTRIES)
+
+# Per-thread connections are reused across requests; sqlite3 keeps a
+# per-connection cache of prepared statements keyed by SQL text
+_local = threading.local()
+
+def get_connection():
+    """Thread-local SQLite connection with WAL journaling"""
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.path == DB_PATH:
+        return conn
+    
+    conn = sqlite3.connect(DB_PATH, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, cached_statements=256)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    
+    _local.conn = conn
+    _local.path = DB_PATH
+    return conn
+
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute("""
@@ -24,10 +63,23 @@ def init_db():
             aoi_hash TEXT PRIMARY KEY,
             tile_url TEXT NOT NULL,
             stats TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            record TEXT,
+            expires_at REAL,
+            accessed_at REAL
         )
     """)
     
+    # Databases created before versioned records / cache policy lack these columns
+    cursor.execute("PRAGMA table_info(cache)")
+    cache_columns = [column[1] for column in cursor.fetchall()]
+    for column, column_type in [("record", "TEXT"), ("expires_at", "REAL"), ("accessed_at", "REAL")]:
+        if column not in cache_columns:
+            cursor.execute(f"ALTER TABLE cache ADD COLUMN {column} {column_type}")
+    
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_cache_expires_at ON cache (expires_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed_at ON cache (accessed_at)")
+    
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS baselines (
             id TEXT PRIMARY KEY,
@@ -43,58 +95,225 @@ def init_db():
         )
     """)
     
+    # Materialized yearly series for locked baselines; rows are only
+    # written for closed years, so they never expire
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS baseline_series (
+            baseline_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            record TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (baseline_id, kind, year)
+        )
+    """)
+    
+    # Per-tile Dynamic World class fractions for KNN control selection,
+    # keyed by global grid tile ID and year
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS tile_features (
+            tile_id TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            geometry TEXT NOT NULL,
+            fractions TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (tile_id, year)
+        )
+    """)
+    
     conn.commit()
-    conn.close()
+
+def canonical_aoi_json(aoi_geojson: dict) -> str:
+    """Stable text for an AOI so equivalent polygons share cache keys"""
+    canonical = canonicalize_aoi(aoi_geojson, AOI_HASH_PRECISION)
+    return json.dumps(canonical, sort_keys=True, separators=(",", ":"))
 
 def hash_aoi(aoi_geojson: dict, start_date: str, end_date: str) -> str:
+    data = f"{canonical_aoi_json(aoi_geojson)}{start_date}{end_date}"
+    return hashlib.sha256(data.encode()).hexdigest()
+
+def hash_aoi_legacy(aoi_geojson: dict, start_date: str, end_date: str) -> str:
+    """Cache key scheme used before AOI canonicalization"""
     data = f"{json.dumps(aoi_geojson, sort_keys=True)}{start_date}{end_date}"
     return hashlib.sha256(data.encode()).hexdigest()
 
 def hash_baseline(aoi_geojson: dict, year: int) -> str:
+    data = f"{canonical_aoi_json(aoi_geojson)}{year}"
+    return hashlib.sha256(data.encode()).hexdigest()
+
+def hash_baseline_legacy(aoi_geojson: dict, year: int) -> str:
+    """Baseline ID scheme used before AOI canonicalization"""
     data = f"{json.dumps(aoi_geojson, sort_keys=True)}{year}"
     return hashlib.sha256(data.encode()).hexdigest()
 
-def get_cached(aoi_hash: str):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT tile_url, stats FROM cache WHERE aoi_hash = ?", (aoi_hash,))
-    result = cursor.fetchone()
-    conn.close()
-    return result
+# Versioned cache records
+# Each cache row holds one compact JSON record; rows written before the
+# record column existed are migrated lazily on first read
+CACHE_SCHEMA_VERSION = 2
 
-def save_cache(aoi_hash: str, tile_url: str, stats: dict):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT OR REPLACE INTO cache (aoi_hash, tile_url, stats) VALUES (?, ?, ?)",
-        (aoi_hash, tile_url, json.dumps(stats))
-    )
-    conn.commit()
-    conn.close()
+def build_cache_record(stats: dict = None, area_km2: float = None, tile_url: str = None, created_at: str = None) -> dict:
+    return {
+        "v": CACHE_SCHEMA_VERSION,
+        "stats": stats,
+        "area_km2": area_km2,
+        "tile_url": tile_url,
+        "created_at": created_at or datetime.now().isoformat()
+    }
+
+def encode_cache_record(stats: dict = None, area_km2: float = None, tile_url: str = None, created_at: str = None) -> str:
+    return json.dumps(build_cache_record(stats, area_km2, tile_url, created_at), separators=(",", ":"))
+
+def decode_cache_record(raw: str):
+    record = json.loads(raw)
+    if record.get("v") != CACHE_SCHEMA_VERSION:
+        return None
+    return record
+
+def migrate_legacy_cache_row(cache_key: str, tile_url: str, stats: str, created_at: str) -> str:
+    """Convert a pre-versioned cache row into an encoded record"""
+    payload = json.loads(stats) if stats else None
+    
+    if cache_key.startswith("stats:"):
+        return encode_cache_record(stats=payload["stats"], area_km2=payload["area_km2"], created_at=created_at)
+    if cache_key.startswith("tile:"):
+        return encode_cache_record(tile_url=tile_url, created_at=created_at)
+    
+    # Combined stats + tile row; the AOI area was never stored
+    return encode_cache_record(stats=payload, tile_url=tile_url or None, created_at=created_at)
+
+# Reads refresh accessed_at for LRU eviction at most this often per row
+CACHE_ACCESS_TOUCH_SECONDS = 60
+
+SELECT_CACHE_ROW = "SELECT tile_url, stats, created_at, record, expires_at, accessed_at FROM cache WHERE aoi_hash = ?"
+UPDATE_CACHE_RECORD = "UPDATE cache SET record = ?, accessed_at = ? WHERE aoi_hash = ?"
+TOUCH_CACHE_ROW = "UPDATE cache SET accessed_at = ? WHERE aoi_hash = ?"
+UPSERT_CACHE_RECORD = (
+    "INSERT OR REPLACE INTO cache (aoi_hash, tile_url, stats, record, expires_at, accessed_at) "
+    "VALUES (?, ?, NULL, ?, ?, ?)"
+)
+
+def touch_cache_row(conn, cache_key: str, now: float):
+    with conn:
+        conn.execute(TOUCH_CACHE_ROW, (now, cache_key))
+
+def get_cache_record(cache_key: str):
+    """Decoded cache record, or None when missing or expired"""
+    # Memory entries are [record, accessed_at] so hot rows still refresh
+    # accessed_at and are not the first ones LRU eviction removes
+    entry = record_memory_cache.get(cache_key)
+    if entry is not None:
+        record, accessed_at = entry
+        now = time.time()
+        if now - accessed_at > CACHE_ACCESS_TOUCH_SECONDS:
+            entry[1] = now
+            touch_cache_row(get_connection(), cache_key, now)
+        return record
+    
+    conn = get_connection()
+    result = conn.execute(SELECT_CACHE_ROW, (cache_key,)).fetchone()
+    if not result:
+        return None
+    
+    tile_url, stats, created_at, record, expires_at, accessed_at = result
+    now = time.time()
+    if expires_at is not None and expires_at <= now:
+        return None
+    
+    if record is None:
+        record = migrate_legacy_cache_row(cache_key, tile_url, stats, created_at)
+        with conn:
+            conn.execute(UPDATE_CACHE_RECORD, (record, now, cache_key))
+        accessed_at = now
+    elif accessed_at is None or now - accessed_at > CACHE_ACCESS_TOUCH_SECONDS:
+        touch_cache_row(conn, cache_key, now)
+        accessed_at = now
+    
+    record = decode_cache_record(record)
+    if record is not None:
+        record_memory_cache.put(cache_key, [record, accessed_at], expires_at)
+    return record
+
+def save_cache_record(cache_key: str, stats: dict = None, area_km2: float = None, tile_url: str = None,
+                      expires_at: float = None):
+    record = build_cache_record(stats, area_km2, tile_url)
+    now = time.time()
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            UPSERT_CACHE_RECORD,
+            (cache_key, tile_url or "", json.dumps(record, separators=(",", ":")), expires_at, now)
+        )
+    
+    # Write-through so the next read never touches disk
+    record_memory_cache.put(cache_key, [record, now], expires_at)
+
+def purge_expired_cache(now: float = None) -> int:
+    """Delete cache rows past their expiry; returns rows removed"""
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute(
+            "DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?",
+            (now or time.time(),)
+        )
+    return cursor.rowcount
+
+def evict_lru_cache(max_entries: int) -> int:
+    """Trim the cache to max_entries rows, least recently accessed first"""
+    conn = get_connection()
+    total = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+    if total <= max_entries:
+        return 0
+    
+    with conn:
+        cursor = conn.execute(
+            "DELETE FROM cache WHERE aoi_hash IN ("
+            "SELECT aoi_hash FROM cache ORDER BY accessed_at LIMIT ?)",
+            (total - max_entries,)
+        )
+    return cursor.rowcount
+
+# Split cache entries: stats and tile URLs are cached independently so
+# analytic endpoints never pay for map id creation
+def get_cached_stats(aoi_hash: str):
+    record = get_cache_record(f"stats:{aoi_hash}")
+    if record and record["stats"] is not None:
+        return {"stats": record["stats"], "area_km2": record["area_km2"]}
+    return None
+
+def save_cached_stats(aoi_hash: str, stats: dict, area_km2: float, expires_at: float = None):
+    save_cache_record(f"stats:{aoi_hash}", stats=stats, area_km2=area_km2, expires_at=expires_at)
+
+def get_cached_tile(aoi_hash: str):
+    record = get_cache_record(f"tile:{aoi_hash}")
+    return record["tile_url"] if record else None
+
+def save_cached_tile(aoi_hash: str, tile_url: str, expires_at: float = None):
+    save_cache_record(f"tile:{aoi_hash}", tile_url=tile_url, expires_at=expires_at)
 
 def log_request(aoi_geojson: dict, tile_url: str, stats: dict):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO requests (aoi_geojson, tile_url, stats) VALUES (?, ?, ?)",
-        (json.dumps(aoi_geojson), tile_url, json.dumps(stats))
-    )
-    conn.commit()
-    conn.close()
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "INSERT INTO requests (aoi_geojson, tile_url, stats) VALUES (?, ?, ?)",
+            (json.dumps(aoi_geojson), tile_url, json.dumps(stats))
+        )
 
 # Baseline functions
+SELECT_BASELINE = (
+    "SELECT id, aoi_geojson, baseline_year, stats, tile_url, area_km2, locked, created_at, locked_at "
+    "FROM baselines WHERE id = ?"
+)
+
 def get_baseline(baseline_id: str):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT id, aoi_geojson, baseline_year, stats, tile_url, area_km2, locked, created_at, locked_at FROM baselines WHERE id = ?",
-        (baseline_id,)
-    )
-    result = cursor.fetchone()
-    conn.close()
+    baseline = baseline_memory_cache.get(baseline_id)
+    if baseline is not None:
+        return baseline
+    
+    conn = get_connection()
+    result = conn.execute(SELECT_BASELINE, (baseline_id,)).fetchone()
     
     if result:
-        return {
+        baseline = {
             "baseline_id": result[0],
             "aoi_geojson": json.loads(result[1]),
             "baseline_year": result[2],
@@ -105,27 +324,113 @@ def get_baseline(baseline_id: str):
             "created_at": result[7],
             "locked_at": result[8]
         }
+        baseline_memory_cache.put(baseline_id, baseline)
+        return baseline
     return None
 
 def save_baseline(baseline_id: str, aoi_geojson: dict, baseline_year: int, stats: dict, tile_url: str, area_km2: float):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO baselines (id, aoi_geojson, baseline_year, stats, tile_url, area_km2) VALUES (?, ?, ?, ?, ?, ?)",
-        (baseline_id, json.dumps(aoi_geojson), baseline_year, json.dumps(stats), tile_url, area_km2)
-    )
-    conn.commit()
-    conn.close()
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "INSERT INTO baselines (id, aoi_geojson, baseline_year, stats, tile_url, area_km2) VALUES (?, ?, ?, ?, ?, ?)",
+            (baseline_id, json.dumps(aoi_geojson), baseline_year, json.dumps(stats), tile_url, area_km2)
+        )
+    baseline_memory_cache.invalidate(baseline_id)
 
 def lock_baseline(baseline_id: str, locked_by: str = "system"):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE baselines SET locked = TRUE, locked_at = ?, locked_by = ? WHERE id = ?",
-        (datetime.now().isoformat(), locked_by, baseline_id)
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "UPDATE baselines SET locked = TRUE, locked_at = ?, locked_by = ? WHERE id = ?",
+            (datetime.now().isoformat(), locked_by, baseline_id)
+        )
+    baseline_memory_cache.invalidate(baseline_id)
+
+# Baseline series
+BASELINE_SERIES_QUERY_CHUNK = 500
+
+def get_baseline_series(baseline_id: str, kind: str, years: list) -> dict:
+    """Materialized records of one kind as {year: record}"""
+    conn = get_connection()
+    rows = conn.execute(
+        f"SELECT year, record FROM baseline_series "
+        f"WHERE baseline_id = ? AND kind = ? AND year IN ({','.join('?' * len(years))})",
+        (baseline_id, kind, *years)
     )
-    conn.commit()
-    conn.close()
+    return {year: json.loads(record) for year, record in rows}
+
+def save_baseline_series(baseline_id: str, kind: str, records: dict):
+    """Append {year: record} to a baseline's series"""
+    conn = get_connection()
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO baseline_series (baseline_id, kind, year, record) VALUES (?, ?, ?, ?)",
+            [(baseline_id, kind, year, json.dumps(record)) for year, record in records.items()]
+        )
+
+def get_baseline_series_many(baseline_ids: list, kind: str) -> dict:
+    """Every materialized record of one kind as {baseline_id: {year: record}}"""
+    conn = get_connection()
+    series = {}
+    
+    for start in range(0, len(baseline_ids), BASELINE_SERIES_QUERY_CHUNK):
+        chunk = baseline_ids[start:start + BASELINE_SERIES_QUERY_CHUNK]
+        rows = conn.execute(
+            f"SELECT baseline_id, year, record FROM baseline_series "
+            f"WHERE kind = ? AND baseline_id IN ({','.join('?' * len(chunk))})",
+            (kind, *chunk)
+        )
+        for baseline_id, year, record in rows:
+            series.setdefault(baseline_id, {})[year] = json.loads(record)
+    
+    return series
+
+def get_locked_baselines(baseline_ids: list = None) -> list:
+    """(baseline_id, baseline_year, stats) for locked baselines, optionally only the given IDs"""
+    conn = get_connection()
+    rows = conn.execute("SELECT id, baseline_year, stats FROM baselines WHERE locked = TRUE ORDER BY id")
+    wanted = set(baseline_ids) if baseline_ids is not None else None
+    return [
+        (baseline_id, baseline_year, json.loads(stats))
+        for baseline_id, baseline_year, stats in rows
+        if wanted is None or baseline_id in wanted
+    ]
+
+# Tile feature store
+TILE_FEATURE_QUERY_CHUNK = 500
+
+def get_tile_features(tile_ids: list, years: list) -> dict:
+    """Stored class fractions as {(tile_id, year): {class_name: fraction}}"""
+    conn = get_connection()
+    year_marks = ",".join("?" * len(years))
+    features = {}
+    
+    for start in range(0, len(tile_ids), TILE_FEATURE_QUERY_CHUNK):
+        chunk = tile_ids[start:start + TILE_FEATURE_QUERY_CHUNK]
+        rows = conn.execute(
+            f"SELECT tile_id, year, fractions FROM tile_features "
+            f"WHERE tile_id IN ({','.join('?' * len(chunk))}) AND year IN ({year_marks})",
+            (*chunk, *years)
+        )
+        for tile_id, year, fractions in rows:
+            features[(tile_id, year)] = json.loads(fractions)
+    
+    return features
+
+def save_tile_features(rows: list):
+    """Persist (tile_id, year, geometry, fractions) rows"""
+    conn = get_connection()
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO tile_features (tile_id, year, geometry, fractions) VALUES (?, ?, ?, ?)",
+            [(tile_id, year, json.dumps(geometry), json.dumps(fractions)) for tile_id, year, geometry, fractions in rows]
+        )
+
+def memory_cache_stats() -> dict:
+    return {
+        "cache": record_memory_cache.stats(),
+        "baselines": baseline_memory_cache.stats()
+    }
 
 def is_baseline_locked(baseline_id: str) -> bool:
     baseline = get_baseline(baseline_id)
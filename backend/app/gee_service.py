@@ -1,9 +1,21 @@
 import ee
+import logging
 import os
 from dotenv import load_dotenv
+from app.composites import get_composite, aoi_bounds, union_bounds, year_range
+from app.quality_tiers import LEGACY_TIER, get_tier, reduce_region_args, reduce_regions_args
+from app.geometry import geodesic_area_km2, split_bounds
+from app.concurrency import map_bounded
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# AOIs above this many pixels (at the tier's scale) are reduced as sub-tiles
+AOI_TILE_MAX_PIXELS = float(os.getenv("AOI_TILE_MAX_PIXELS", 2.5e7))
+# Sub-tiles per reduceRegions call; batches run in parallel
+AOI_TILE_BATCH_SIZE = int(os.getenv("AOI_TILE_BATCH_SIZE", 16))
+
 def init_gee():
     """Initialize Google Earth Engine with service account"""
     try:
@@ -16,52 +28,224 @@ def init_gee():
         else:
             ee.Initialize()
     except Exception as e:
-        print(f"GEE initialization error: {e}")
+        logger.error("GEE initialization error: %s", e)
         raise
 
 def geojson_to_ee(aoi_geojson: dict):
     """Convert GeoJSON to Earth Engine Geometry"""
-    coords = aoi_geojson["geometry"]["coordinates"]
-    return ee.Geometry.Polygon(coords)
+    geometry = aoi_geojson["geometry"]
+    if geometry["type"] == "MultiPolygon":
+        # KNN control areas are merged tiles
+        return ee.Geometry.MultiPolygon(geometry["coordinates"])
+    return ee.Geometry.Polygon(geometry["coordinates"])
+
+DW_VIS_PARAMS = {
+    "min": 0,
+    "max": 8,
+    "palette": [
+        "#419BDF", "#397D49", "#88B053", "#7A87C6",
+        "#E49635", "#DFC35A", "#C4281B", "#A59B8F", "#B39FE1"
+    ]
+}
+
+def dynamic_world_composite(aoi_geojson: dict, aoi, start_date: str, end_date: str):
+    """Shared Dynamic World mode composite clipped to the AOI"""
+    return get_composite(start_date, end_date, aoi_bounds(aoi_geojson)).clip(aoi)
+
+def needs_tiling(aoi_geojson: dict, tier: str = LEGACY_TIER) -> bool:
+    """Local pixel estimate; no Earth Engine call"""
+    pixels = geodesic_area_km2(aoi_geojson) * 1e6 / get_tier(tier)["scale"] ** 2
+    return pixels > AOI_TILE_MAX_PIXELS
+
+def merge_histograms(histograms) -> dict:
+    """Exact sum of per-class pixel counts"""
+    merged = {}
+    for histogram in histograms:
+        for class_id, count in (histogram or {}).items():
+            merged[class_id] = merged.get(class_id, 0) + count
+    return merged
 
-def generate_lulc(aoi_geojson: dict, start_date: str, end_date: str):
-    """Generate LULC map using Dynamic World dataset"""
+def reduce_histograms_tiled(aoi_geojson: dict, stack, bands: list, tier: str = LEGACY_TIER):
+    """
+    Per-band histograms of a large AOI reduced as sub-tiles
+    The AOI is cut into grid cells under AOI_TILE_MAX_PIXELS, cells are
+    reduced in parallel reduceRegions batches and the counts are summed;
+    returns ({band: histogram}, area_km2)
+    """
+    aoi = geojson_to_ee(aoi_geojson)
+    cell_km = (AOI_TILE_MAX_PIXELS ** 0.5) * get_tier(tier)["scale"] / 1000
+    pieces = [aoi.intersection(ee.Geometry.Rectangle(cell), 1) for cell in split_bounds(aoi_geojson, cell_km)]
+    batches = [pieces[i:i + AOI_TILE_BATCH_SIZE] for i in range(0, len(pieces), AOI_TILE_BATCH_SIZE)]
+    
+    def reduce_batch(batch):
+        fc = ee.FeatureCollection([ee.Feature(piece, {"area_m2": piece.area(1)}) for piece in batch])
+        return stack.reduceRegions(
+            collection=fc,
+            reducer=ee.Reducer.frequencyHistogram().forEachBand(stack),
+            **reduce_regions_args(tier)
+        ).getInfo()["features"]
+    
+    rows = [row["properties"] for rows in map_bounded(reduce_batch, batches) for row in rows]
+    histograms = {band: merge_histograms(row.get(band) for row in rows) for band in bands}
+    return histograms, sum(row["area_m2"] for row in rows) / 1e6
+
+def generate_lulc_stats(aoi_geojson: dict, start_date: str, end_date: str, tier: str = LEGACY_TIER):
+    """Compute LULC histogram and AOI area without minting a tile URL"""
+    if needs_tiling(aoi_geojson, tier):
+        lulc = get_composite(start_date, end_date, aoi_bounds(aoi_geojson))
+        histograms, area_km2 = reduce_histograms_tiled(aoi_geojson, lulc, ["label"], tier)
+        return {"stats": histograms["label"], "area_km2": area_km2}
+    
     aoi = geojson_to_ee(aoi_geojson)
+    lulc = dynamic_world_composite(aoi_geojson, aoi, start_date, end_date)
     
-    # Dynamic World LULC dataset from Google Earth Engine
-    # cspell:disable-next-line
-    dw = (
-        ee.ImageCollection("GOOGLE/DYNAMICWORLD/V1")
-        .filterBounds(aoi)
-        .filterDate(start_date, end_date)
+    histogram = lulc.reduceRegion(
+        reducer=ee.Reducer.frequencyHistogram(),
+        geometry=aoi,
+        **reduce_region_args(tier)
     )
     
-    lulc = dw.select("label").mode().clip(aoi)
+    result = ee.Dictionary({
+        "histogram": histogram,
+        "area_m2": aoi.area()
+    }).getInfo()
+    
+    return {
+        "stats": (result.get("histogram") or {}).get("label") or {},
+        "area_km2": result["area_m2"] / 1e6
+    }
+
+def generate_lulc_series(aoi_geojson: dict, years: list, tier: str = LEGACY_TIER):
+    """
+    Compute LULC histograms for several years in one round trip
+    Stacks one label band per year and returns every histogram plus the
+    AOI area from a single getInfo
+    """
+    years = sorted(set(years))
     
-    # Generate tile URL
-    map_id = lulc.getMapId({
-        "min": 0,
-        "max": 8,
-        "palette": [
-            "#419BDF", "#397D49", "#88B053", "#7A87C6",
-            "#E49635", "#DFC35A", "#C4281B", "#A59B8F", "#B39FE1"
-        ]
-    })
+    if needs_tiling(aoi_geojson, tier):
+        bounds = aoi_bounds(aoi_geojson)
+        bands = [f"label_{year}" for year in years]
+        stack = ee.Image.cat([get_composite(*year_range(year), bounds).rename(f"label_{year}") for year in years])
+        histograms, area_km2 = reduce_histograms_tiled(aoi_geojson, stack, bands, tier)
+        return {"stats": {year: histograms[f"label_{year}"] for year in years}, "area_km2": area_km2}
     
-    # Calculate statistics
-    stats = lulc.reduceRegion(
+    aoi = geojson_to_ee(aoi_geojson)
+    stack = ee.Image.cat([
+        dynamic_world_composite(aoi_geojson, aoi, *year_range(year)).rename(f"label_{year}")
+        for year in years
+    ])
+    
+    histograms = stack.reduceRegion(
         reducer=ee.Reducer.frequencyHistogram(),
         geometry=aoi,
-        scale=10,
-        maxPixels=1e9
-    ).getInfo()
+        **reduce_region_args(tier)
+    )
     
-    # Calculate area
-    area_m2 = aoi.area().getInfo()
-    area_km2 = area_m2 / 1e6
+    result = ee.Dictionary({
+        "histograms": histograms,
+        "area_m2": aoi.area()
+    }).getInfo()
+    
+    histograms = result.get("histograms") or {}
     
     return {
-        "tile_url": map_id["tile_fetcher"].url_format,
-        "stats": stats.get("label", {}),
-        "area_km2": area_km2
+        "stats": {year: histograms.get(f"label_{year}") or {} for year in years},
+        "area_km2": result["area_m2"] / 1e6
     }
+
+def zone_series_collection(geometries: list, years: list, bounds: tuple, tier: str = LEGACY_TIER):
+    """
+    Server-side yearly histograms for several zones
+    Every geometry is a feature of one FeatureCollection, reduced with
+    reduceRegions over a stacked label band per year
+    """
+    fc = ee.FeatureCollection([
+        ee.Feature(geometry, {"idx": i, "area_m2": geometry.area(1)})
+        for i, geometry in enumerate(geometries)
+    ])
+    
+    stack = ee.Image.cat([
+        get_composite(*year_range(year), bounds).rename(f"label_{year}")
+        for year in years
+    ])
+    
+    # forEachBand keeps one output property per band, even for a single year
+    return stack.reduceRegions(
+        collection=fc,
+        reducer=ee.Reducer.frequencyHistogram().forEachBand(stack),
+        **reduce_regions_args(tier)
+    )
+
+def generate_zone_series(geometries: list, years: list, bounds: tuple, extras: dict = None, tier: str = LEGACY_TIER):
+    """
+    Yearly LULC histograms for server-side zone geometries in one round trip
+    Extra server-side values (e.g. a derived geometry) ride along in the
+    same getInfo; returns (series per zone, evaluated extras)
+    """
+    years = sorted(set(years))
+    request = dict(extras or {})
+    if geometries:
+        request["zones"] = zone_series_collection(geometries, years, bounds, tier)
+    
+    result = ee.Dictionary(request).getInfo() if request else {}
+    
+    rows = sorted((result.get("zones") or {}).get("features", []), key=lambda f: f["properties"].get("idx", 0))
+    series = [
+        {
+            "stats": {year: row["properties"].get(f"label_{year}") or {} for year in years},
+            "area_km2": row["properties"]["area_m2"] / 1e6
+        }
+        for row in rows
+    ]
+    return series, {key: result[key] for key in extras or {}}
+
+def generate_lulc_series_batch(aoi_geojsons: list, years: list, tier: str = LEGACY_TIER):
+    """Compute LULC histograms for many AOIs and years in one round trip"""
+    bounds = union_bounds(aoi_bounds(aoi_geojson) for aoi_geojson in aoi_geojsons)
+    geometries = [geojson_to_ee(aoi_geojson) for aoi_geojson in aoi_geojsons]
+    series, _ = generate_zone_series(geometries, years, bounds, tier=tier)
+    return series
+
+def generate_transition_histogram(aoi_geojson: dict, baseline_year: int, current_year: int,
+                                  tier: str = LEGACY_TIER):
+    """
+    Per-pixel from->to counts in one reduction
+    Encodes baseline * 9 + current into one band and takes its
+    frequencyHistogram; pixels unlabelled in either year are masked out.
+    The current year's own histogram rides along as a second band
+    """
+    bounds = aoi_bounds(aoi_geojson)
+    baseline = get_composite(*year_range(baseline_year), bounds)
+    current = get_composite(*year_range(current_year), bounds)
+    stack = ee.Image.cat([baseline.multiply(9).add(current).rename("transition"), current.rename("label")])
+    
+    if needs_tiling(aoi_geojson, tier):
+        histograms, area_km2 = reduce_histograms_tiled(aoi_geojson, stack, ["transition", "label"], tier)
+        return {"histogram": histograms["transition"], "current_stats": histograms["label"], "area_km2": area_km2}
+    
+    aoi = geojson_to_ee(aoi_geojson)
+    histograms = stack.clip(aoi).reduceRegion(
+        reducer=ee.Reducer.frequencyHistogram(),
+        geometry=aoi,
+        **reduce_region_args(tier)
+    )
+    
+    result = ee.Dictionary({
+        "histogram": histograms,
+        "area_m2": aoi.area()
+    }).getInfo()
+    
+    histograms = result.get("histogram") or {}
+    
+    return {
+        "histogram": histograms.get("transition") or {},
+        "current_stats": histograms.get("label") or {},
+        "area_km2": result["area_m2"] / 1e6
+    }
+
+def generate_lulc_tile(aoi_geojson: dict, start_date: str, end_date: str) -> str:
+    """Mint a LULC tile URL without computing statistics"""
+    aoi = geojson_to_ee(aoi_geojson)
+    map_id = dynamic_world_composite(aoi_geojson, aoi, start_date, end_date).getMapId(DW_VIS_PARAMS)
+    return map_id["tile_fetcher"].url_format
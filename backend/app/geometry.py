@@ -0,0 +1,187 @@
+"""
+Local GeoJSON geometry helpers
+Pure-Python computations that avoid Earth Engine round trips
+"""
+import math
+import numpy as np
+
+EARTH_RADIUS_M = 6378137
+
+def get_geometry(aoi_geojson: dict) -> dict:
+    """Accept either a Feature or a bare geometry"""
+    return aoi_geojson.get("geometry", aoi_geojson)
+
+def get_polygons(aoi_geojson: dict) -> list:
+    """List of polygons (each a list of rings) for Polygon and MultiPolygon"""
+    geometry = get_geometry(aoi_geojson)
+    if geometry["type"] == "MultiPolygon":
+        return geometry["coordinates"]
+    return [geometry["coordinates"]]
+
+def ring_area_m2(ring: list) -> float:
+    """Spherical area of a lon/lat ring (positive for counter-clockwise)"""
+    if len(ring) < 3:
+        return 0.0
+
+    total = 0.0
+    for i in range(len(ring)):
+        lon1, lat1 = ring[i][0], ring[i][1]
+        lon2, lat2 = ring[(i + 1) % len(ring)][0], ring[(i + 1) % len(ring)][1]
+        total += math.radians(lon2 - lon1) * (2 + math.sin(math.radians(lat1)) + math.sin(math.radians(lat2)))
+
+    return total * EARTH_RADIUS_M ** 2 / 2
+
+def geodesic_area_km2(aoi_geojson: dict) -> float:
+    """Area of a Polygon/MultiPolygon AOI in km², holes excluded"""
+    area_m2 = 0.0
+    for polygon in get_polygons(aoi_geojson):
+        if not polygon:
+            continue
+        area_m2 += abs(ring_area_m2(polygon[0]))
+        for hole in polygon[1:]:
+            area_m2 -= abs(ring_area_m2(hole))
+    return max(area_m2, 0.0) / 1e6
+
+def geodesic_perimeter_km(aoi_geojson: dict) -> float:
+    """Great-circle length of every ring of the AOI in km"""
+    total_m = 0.0
+    for polygon in get_polygons(aoi_geojson):
+        for ring in polygon:
+            for (lon1, lat1, *_), (lon2, lat2, *_) in zip(ring, ring[1:]):
+                phi1, phi2 = math.radians(lat1), math.radians(lat2)
+                d_phi, d_lambda = phi2 - phi1, math.radians(lon2 - lon1)
+                h = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+                total_m += 2 * EARTH_RADIUS_M * math.asin(min(math.sqrt(h), 1.0))
+    return total_m / 1000
+
+def _quantize(value: float, precision: int) -> float:
+    return round(float(value), precision) + 0.0  # + 0.0 folds -0.0 into 0.0
+
+def _rotate_to_min(ring: list) -> list:
+    start = ring.index(min(ring))
+    return ring[start:] + ring[:start]
+
+def _canonical_ring(ring: list, precision: int, counter_clockwise: bool) -> list:
+    """Quantized, deduplicated ring with a canonical start vertex and orientation"""
+    points = []
+    for coord in ring:
+        point = [_quantize(coord[0], precision), _quantize(coord[1], precision)]
+        if not points or points[-1] != point:
+            points.append(point)
+    if len(points) > 1 and points[0] == points[-1]:
+        points.pop()
+    if len(points) < 3:
+        return points
+
+    # Planar signed area is enough to decide winding
+    signed = sum(
+        points[i][0] * points[(i + 1) % len(points)][1] - points[(i + 1) % len(points)][0] * points[i][1]
+        for i in range(len(points))
+    )
+    if (signed > 0) != counter_clockwise:
+        points.reverse()
+
+    points = _rotate_to_min(points)
+    return points + [points[0]]
+
+def _canonical_polygon(polygon: list, precision: int) -> list:
+    # RFC 7946: exterior rings counter-clockwise, holes clockwise
+    exterior = _canonical_ring(polygon[0], precision, counter_clockwise=True)
+    holes = sorted(_canonical_ring(hole, precision, counter_clockwise=False) for hole in polygon[1:])
+    return [exterior] + holes
+
+def canonicalize_aoi(aoi_geojson: dict, precision: int = 6) -> dict:
+    """
+    Canonical geometry for cache keys
+    Equivalent AOIs (different start vertex, winding, float noise or
+    properties) map to the same geometry
+    """
+    polygons = sorted(_canonical_polygon(polygon, precision) for polygon in get_polygons(aoi_geojson) if polygon)
+    if len(polygons) == 1:
+        return {"type": "Polygon", "coordinates": polygons[0]}
+    return {"type": "MultiPolygon", "coordinates": polygons}
+
+def bounding_box(aoi_geojson: dict) -> tuple:
+    """(min_lon, min_lat, max_lon, max_lat) over every ring of the AOI"""
+    lons = [coord[0] for polygon in get_polygons(aoi_geojson) for ring in polygon for coord in ring]
+    lats = [coord[1] for polygon in get_polygons(aoi_geojson) for ring in polygon for coord in ring]
+    return min(lons), min(lats), max(lons), max(lats)
+
+def _polygon_edges(polygons: list):
+    """Edge start/end coordinate arrays over every ring of every polygon"""
+    starts, ends = [], []
+    for polygon in polygons:
+        for ring in polygon:
+            ring = np.asarray(ring, dtype=float)[:, :2]
+            starts.append(ring)
+            ends.append(np.roll(ring, -1, axis=0))
+    return np.concatenate(starts), np.concatenate(ends)
+
+def points_in_polygons(xs, ys, polygons: list) -> np.ndarray:
+    """Even-odd point-in-polygon test for many points at once (holes respected)"""
+    starts, ends = _polygon_edges(polygons)
+    xs = np.asarray(xs, dtype=float)[:, None]
+    ys = np.asarray(ys, dtype=float)[:, None]
+    ax, ay, bx, by = starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1]
+
+    straddles = (ay > ys) != (by > ys)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cross_x = ax + (ys - ay) * (bx - ax) / (by - ay)
+    crossings = straddles & (xs < cross_x)
+    return (crossings.sum(axis=1) % 2) == 1
+
+def rectangles_intersect_polygons(x0, y0, x1, y1, polygons: list, chunk_size: int = 512) -> np.ndarray:
+    """
+    Vectorized rectangle/polygon intersection test
+    A rectangle intersects when any polygon edge clips into it (Liang-Barsky)
+    or when it lies entirely inside the polygon
+    """
+    x0, y0, x1, y1 = (np.asarray(v, dtype=float) for v in (x0, y0, x1, y1))
+    starts, ends = _polygon_edges(polygons)
+    ax, ay = starts[:, 0], starts[:, 1]
+    dx, dy = ends[:, 0] - ax, ends[:, 1] - ay
+
+    result = np.zeros(len(x0), dtype=bool)
+    for start in range(0, len(x0), chunk_size):
+        rect = slice(start, start + chunk_size)
+        rx0, ry0, rx1, ry1 = (v[rect, None] for v in (x0, y0, x1, y1))
+
+        t_enter = np.zeros((len(rx0), len(ax)))
+        t_exit = np.ones((len(rx0), len(ax)))
+        rejected = np.zeros((len(rx0), len(ax)), dtype=bool)
+        for p, q in ((-dx, ax - rx0), (dx, rx1 - ax), (-dy, ay - ry0), (dy, ry1 - ay)):
+            p = np.broadcast_to(p, q.shape)
+            rejected |= (p == 0) & (q < 0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ratio = q / p
+            t_enter = np.where(p < 0, np.maximum(t_enter, ratio), t_enter)
+            t_exit = np.where(p > 0, np.minimum(t_exit, ratio), t_exit)
+
+        clips = (~rejected & (t_enter <= t_exit)).any(axis=1)
+        result[rect] = clips | points_in_polygons(x0[rect], y0[rect], polygons)
+
+    return result
+
+def split_bounds(aoi_geojson: dict, cell_km: float) -> list:
+    """
+    Grid cells about cell_km on a side over the AOI bounding box, keeping
+    only cells that touch the AOI; each is [min_lon, min_lat, max_lon, max_lat]
+    """
+    min_lon, min_lat, max_lon, max_lat = bounding_box(aoi_geojson)
+    d_lat = cell_km / 111
+
+    # Each row's longitude step is sized at its equatorward edge, where a
+    # degree of longitude is widest, so no cell exceeds cell_km across
+    rows = []
+    for lat0 in np.arange(min_lat, max_lat, d_lat):
+        lat1 = min(lat0 + d_lat, max_lat)
+        equatorward = 0.0 if lat0 <= 0 <= lat1 else min(abs(lat0), abs(lat1))
+        d_lon = d_lat / max(math.cos(math.radians(equatorward)), 0.01)
+        lon0 = np.arange(min_lon, max_lon, d_lon)
+        rows.append((lon0, np.full(len(lon0), lat0), np.minimum(lon0 + d_lon, max_lon), np.full(len(lon0), lat1)))
+    if not rows:
+        return []
+    x0, y0, x1, y1 = (np.concatenate(column) for column in zip(*rows))
+
+    keep = rectangles_intersect_polygons(x0, y0, x1, y1, get_polygons(aoi_geojson))
+    return [[float(v) for v in cell] for cell in zip(x0[keep], y0[keep], x1[keep], y1[keep])]
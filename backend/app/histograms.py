@@ -0,0 +1,57 @@
+"""
+Fixed-length Dynamic World class-count histograms
+Analysis modules work on NumPy arrays indexed by class ID; the
+{"class_id": count} JSON form is only read and written at the API and
+cache boundary
+"""
+from functools import cached_property
+import numpy as np
+
+# Dynamic World labels 0-8; class 1 = Trees
+NUM_CLASSES = 9
+FOREST_CLASS = 1
+
+def histogram_counts(stats_list):
+    """(n, NUM_CLASSES) pixel-count array from LULC histogram dicts"""
+    counts = np.zeros((len(stats_list), NUM_CLASSES))
+    for row, stats in enumerate(stats_list):
+        for class_id, count in stats.items():
+            counts[row, int(float(class_id))] = count
+    return counts
+
+def class_percentages(counts):
+    """Per-class share of each row in percent (0 for empty rows)"""
+    counts = np.asarray(counts, dtype=float)
+    totals = counts.sum(axis=-1, keepdims=True)
+    return np.divide(counts, totals, out=np.zeros(counts.shape), where=totals > 0) * 100
+
+class ClassHistogram:
+    """Pixel counts for the NUM_CLASSES Dynamic World classes"""
+
+    def __init__(self, counts):
+        self.counts = np.asarray(counts, dtype=float)
+
+    @classmethod
+    def from_stats(cls, stats: dict):
+        return cls(histogram_counts([stats])[0])
+
+    @cached_property
+    def total(self) -> float:
+        return float(self.counts.sum())
+
+    @cached_property
+    def percentages(self) -> np.ndarray:
+        return class_percentages(self.counts)
+
+    def __getitem__(self, class_id: int) -> float:
+        return float(self.counts[class_id])
+
+def as_histogram(stats) -> ClassHistogram:
+    """Accept either a ClassHistogram or a JSON histogram dict"""
+    return stats if isinstance(stats, ClassHistogram) else ClassHistogram.from_stats(stats)
+
+def stack_histograms(histograms: list) -> np.ndarray:
+    """(n, NUM_CLASSES) array from a year series of histograms (dicts or ClassHistogram)"""
+    if not histograms:
+        return np.zeros((0, NUM_CLASSES))
+    return np.stack([as_histogram(stats).counts for stats in histograms])
@@ -1,176 +1,342 @@
+import os
 import ee
 import numpy as np
+from dotenv import load_dotenv
 from sklearn.neighbors import NearestNeighbors
 from app.gee_service import geojson_to_ee
+from app.geometry import get_polygons, bounding_box, rectangles_intersect_polygons
+from app.composites import get_yearly_composite, aoi_bounds, union_bounds, year_range
+from app.cache_policy import is_closed_period
+from app.database import hash_aoi, get_tile_features, save_tile_features
+from app.lru_cache import LRUCache
+
+load_dotenv()
+
+# Feature preprocessing: zscore | robust | none
+KNN_SCALING = os.getenv("KNN_SCALING", "zscore")
+# Distance in the scaled feature space: euclidean | mahalanobis
+KNN_METRIC = os.getenv("KNN_METRIC", "euclidean")
+
+# Fitted candidate-ring indexes for repeat KNN queries
+_candidate_indexes = LRUCache(64)
 
 def generate_candidate_tiles(aoi_geojson, buffer_km=10, tile_size_km=2):
-    """Generate candidate tiles - OPTIMIZED: larger tiles, smaller buffer"""
-    aoi = geojson_to_ee(aoi_geojson)
+    """
+    Generate candidate tiles locally: vectorized grid + AOI intersection test, no GEE round trips
+    Tiles come from a fixed global grid so the same cell keeps the same ID
+    across projects and its features can be reused from the feature store
+    """
+    polygons = get_polygons(aoi_geojson)
+    min_lon, min_lat, max_lon, max_lat = bounding_box(aoi_geojson)
     
-    buffer_meters = buffer_km * 1000
-    outer_buffer = aoi.buffer(buffer_meters)
+    # Pad the AOI bounds by the search buffer
+    pad_lat = buffer_km / 111
+    pad_lon = pad_lat / max(np.cos(np.radians(max(abs(min_lat), abs(max_lat)))), 0.01)
+    min_lon, max_lon = min_lon - pad_lon, max_lon + pad_lon
+    min_lat, max_lat = min_lat - pad_lat, max_lat + pad_lat
     
-    bounds = outer_buffer.bounds()
-    coords = bounds.coordinates().getInfo()[0]
+    tile_size_deg = tile_size_km / 111
     
-    min_lon, min_lat = coords[0]
-    max_lon, max_lat = coords[2]
+    # Global grid cells anchored at (0, 0)
+    cols = np.arange(np.floor(min_lon / tile_size_deg), np.ceil(max_lon / tile_size_deg), dtype=int)
+    rows = np.arange(np.floor(min_lat / tile_size_deg), np.ceil(max_lat / tile_size_deg), dtype=int)
+    grid_col, grid_row = np.meshgrid(cols, rows)
+    grid_col, grid_row = grid_col.ravel(), grid_row.ravel()
+    x0, y0 = grid_col * tile_size_deg, grid_row * tile_size_deg
+    x1, y1 = x0 + tile_size_deg, y0 + tile_size_deg
     
-    tile_size_deg = tile_size_km / 111
+    # Control candidates must lie outside the project area
+    outside = ~rectangles_intersect_polygons(x0, y0, x1, y1, polygons)
     
     tiles = []
-    lat = min_lat
-    tile_id = 0
-    
-    while lat < max_lat:
-        lon = min_lon
-        while lon < max_lon:
-            tile = ee.Geometry.Rectangle([lon, lat, lon + tile_size_deg, lat + tile_size_deg])
-            
-            if not tile.intersects(aoi).getInfo():
-                tiles.append({
-                    'id': f'tile_{tile_id}',
-                    'geometry': tile
-                })
-                tile_id += 1
-            
-            lon += tile_size_deg
-        lat += tile_size_deg
-    
-    return tiles[:25]  # OPTIMIZED: 25 tiles instead of 100
-
-def extract_features_batch(geometries, baseline_year, current_year):
-    """OPTIMIZED: Extract features for multiple geometries in one call"""
+    for col, row, lon0, lat0, lon1, lat1 in zip(
+        grid_col[outside], grid_row[outside], x0[outside], y0[outside], x1[outside], y1[outside]
+    ):
+        bounds = [float(lon0), float(lat0), float(lon1), float(lat1)]
+        tiles.append({
+            'id': f'g{tile_size_km}_{col}_{row}',
+            'bounds': bounds,
+            'geojson': {'type': 'Polygon', 'coordinates': tile_polygon_coordinates(bounds)},
+            'geometry': ee.Geometry.Rectangle(bounds)
+        })
+    
+    return tiles
+
+def tile_polygon_coordinates(bounds):
+    """GeoJSON polygon coordinates for a [min_lon, min_lat, max_lon, max_lat] tile"""
+    lon0, lat0, lon1, lat1 = bounds
+    return [[[lon0, lat0], [lon1, lat0], [lon1, lat1], [lon0, lat1], [lon0, lat0]]]
+
+# Dynamic World classes that can enter the feature vector
+FEATURE_CLASSES = {
+    'forest': 1,
+    'grass': 2,
+    'crops': 4,
+    'built': 6,
+    'bare': 7
+}
+
+DEFAULT_FEATURE_NAMES = ['forest_pct_baseline', 'forest_loss_rate', 'built_growth_rate', 'volatility']
+
+def feature_names(extra_classes=()):
+    """Column names of the vectors returned by build_feature_vectors"""
+    names = list(DEFAULT_FEATURE_NAMES)
+    for name in extra_classes:
+        names += [f'{name}_pct_baseline', f'{name}_change_rate']
+    return names
+
+def extract_class_fractions(geometries, years, bounds=None):
+    """
+    Per-year class fractions for all geometries in a single pass
+    One stacked image (one band per class and year) is reduced over the
+    whole FeatureCollection with reduceRegions. Returns one
+    {year: {class_name: fraction}} dict per geometry
+    """
+    years = sorted(set(years))
     
     # Create feature collection from geometries
-    features = [ee.Feature(g['geometry']) for g in geometries]
+    features = [ee.Feature(g['geometry'], {'idx': i}) for i, g in enumerate(geometries)]
     fc = ee.FeatureCollection(features)
     
-    # Load images once
-    dw_baseline = ee.ImageCollection('GOOGLE/DYNAMICWORLD/V1') \
-        .filterDate(f'{baseline_year}-01-01', f'{baseline_year}-12-31') \
-        .select('label') \
-        .mode()
-    
-    dw_current = ee.ImageCollection('GOOGLE/DYNAMICWORLD/V1') \
-        .filterDate(f'{current_year}-01-01', f'{current_year}-12-31') \
-        .select('label') \
-        .mode()
+    # Shared yearly composites, built once per process
+    bands = []
+    for year in years:
+        composite = get_yearly_composite(year, bounds)
+        for name, class_id in FEATURE_CLASSES.items():
+            bands.append(composite.eq(class_id).rename(f'{name}_{year}'))
     
-    # Compute forest and built-up for all tiles at once
-    def compute_stats(feature):
-        geom = feature.geometry()
-        
-        forest_base = dw_baseline.eq(1).reduceRegion(
-            reducer=ee.Reducer.mean(),
-            geometry=geom,
-            scale=200,  # OPTIMIZED: 200m instead of 100m
-            maxPixels=1e7
-        ).get('label')
-        
-        forest_curr = dw_current.eq(1).reduceRegion(
-            reducer=ee.Reducer.mean(),
-            geometry=geom,
-            scale=200,
-            maxPixels=1e7
-        ).get('label')
-        
-        built_base = dw_baseline.eq(6).reduceRegion(
-            reducer=ee.Reducer.mean(),
-            geometry=geom,
-            scale=200,
-            maxPixels=1e7
-        ).get('label')
-        
-        built_curr = dw_current.eq(6).reduceRegion(
-            reducer=ee.Reducer.mean(),
-            geometry=geom,
-            scale=200,
-            maxPixels=1e7
-        ).get('label')
-        
-        return feature.set({
-            'forest_base': forest_base,
-            'forest_curr': forest_curr,
-            'built_base': built_base,
-            'built_curr': built_curr
-        })
+    # Single reduction over every geometry
+    results = ee.Image.cat(bands).reduceRegions(
+        collection=fc,
+        reducer=ee.Reducer.mean(),
+        scale=200,  # OPTIMIZED: 200m instead of 100m
+        tileScale=2
+    ).getInfo()
     
-    # Process all at once
-    results = fc.map(compute_stats).getInfo()
-    
-    # Convert to feature vectors
+    rows = sorted(results['features'], key=lambda f: f['properties'].get('idx', 0))
+    return [
+        {
+            year: {name: feat['properties'].get(f'{name}_{year}') or 0 for name in FEATURE_CLASSES}
+            for year in years
+        }
+        for feat in rows
+    ]
+
+def build_feature_vectors(fractions, baseline_year, current_year, extra_classes=()):
+    """Feature vectors (see feature_names) from per-year class fractions"""
     years = current_year - baseline_year
     feature_vectors = []
     
-    for feat in results['features']:
-        props = feat['properties']
-        fb = props.get('forest_base', 0) * 100
-        fc = props.get('forest_curr', 0) * 100
-        bb = props.get('built_base', 0) * 100
-        bc = props.get('built_curr', 0) * 100
+    for by_year in fractions:
+        base, curr = by_year[baseline_year], by_year[current_year]
+        fb, fc = base['forest'] * 100, curr['forest'] * 100
+        bb, bc = base['built'] * 100, curr['built'] * 100
         
         forest_loss_rate = (fb - fc) / years if years > 0 else 0
         built_growth_rate = (bc - bb) / years if years > 0 else 0
         
-        feature_vectors.append([
+        vector = [
             fb,
             forest_loss_rate,
             built_growth_rate,
             abs(fc - fb)
-        ])
+        ]
+        for name in extra_classes:
+            pct_base, pct_curr = base[name] * 100, curr[name] * 100
+            vector += [pct_base, (pct_curr - pct_base) / years if years > 0 else 0]
+        
+        feature_vectors.append(vector)
     
     return np.array(feature_vectors)
 
-def select_control_areas_knn(aoi_geojson, baseline_year, current_year, k=5, buffer_km=10):
-    """OPTIMIZED: Select K most similar control areas using KNN"""
+def load_class_fractions(tiles, years, bounds=None):
+    """
+    Class fractions for tiles from the persistent feature store
+    Only tiles missing one of the years are reduced in Earth Engine; only
+    closed years are persisted, since open-year composites still change
+    """
+    years = sorted(set(years))
+    stored = get_tile_features([t['id'] for t in tiles], years)
+    missing = [t for t in tiles if any((t['id'], year) not in stored for year in years)]
+    
+    if missing:
+        fresh = extract_class_fractions(missing, years, bounds)
+        rows = [
+            (tile['id'], year, tile['geojson'], by_year[year])
+            for tile, by_year in zip(missing, fresh)
+            for year in years
+        ]
+        save_tile_features([row for row in rows if is_closed_period(year_range(row[1])[1])])
+        stored.update({(tile_id, year): fractions for tile_id, year, _, fractions in rows})
+    
+    return [{year: stored[(t['id'], year)] for year in years} for t in tiles]
+
+def fit_feature_transform(features, scaling=KNN_SCALING, metric=KNN_METRIC, weights=None):
+    """
+    Preprocessing fitted on the candidate population
+    Features are centred and scaled (z-score or median/IQR) and weighted;
+    for Mahalanobis they are also whitened, so every metric becomes a
+    Euclidean search in the transformed space. A ring with no more
+    candidates than features cannot estimate a covariance and falls back
+    to scaled Euclidean; 'metric' records the one actually used
+    """
+    features = np.asarray(features, dtype=float)
+    n_features = features.shape[1]
+    
+    if scaling == 'zscore':
+        center, scale = features.mean(axis=0), features.std(axis=0)
+    elif scaling == 'robust':
+        q1, center, q3 = np.percentile(features, [25, 50, 75], axis=0)
+        scale = q3 - q1
+    elif scaling == 'none':
+        center, scale = np.zeros(n_features), np.ones(n_features)
+    else:
+        raise ValueError(f"Unknown KNN scaling: {scaling}")
+    
+    # Constant features would divide by zero
+    scale = np.where(scale > 1e-9, scale, 1.0)
+    projection = np.diag(np.ones(n_features) if weights is None else np.asarray(weights, dtype=float))
     
-    aoi = geojson_to_ee(aoi_geojson)
+    if metric == 'mahalanobis':
+        if len(features) > n_features:
+            # Weighted Mahalanobis: d^2 = (x - y)' W VI W (x - y)
+            covariance = np.atleast_2d(np.cov((features - center) / scale, rowvar=False))
+            eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+            keep = eigenvalues > 1e-9
+            projection = projection @ (eigenvectors[:, keep] / np.sqrt(eigenvalues[keep]))
+        else:
+            metric = 'euclidean'
+    elif metric != 'euclidean':
+        raise ValueError(f"Unknown KNN metric: {metric}")
     
-    # Generate fewer, larger tiles
-    candidates = generate_candidate_tiles(aoi_geojson, buffer_km, tile_size_km=2)
+    return {'center': center, 'scale': scale, 'projection': projection, 'metric': metric}
+
+def apply_feature_transform(transform, features):
+    """Map raw feature vectors (one per row) into the search space"""
+    scaled = (np.atleast_2d(np.asarray(features, dtype=float)) - transform['center']) / transform['scale']
+    return scaled @ transform['projection']
+
+def feature_weight_vector(weights, extra_classes=()):
+    """Per-column weights from a {feature_name: weight} mapping (default 1)"""
+    if not weights:
+        return None
+    return [float(weights.get(name, 1.0)) for name in feature_names(extra_classes)]
+
+def candidate_index(candidates, candidate_features, baseline_year, current_year, extra_classes,
+                    scaling=KNN_SCALING, metric=KNN_METRIC, weights=None):
+    """
+    Fitted transform and NearestNeighbors over a candidate set,
+    reused across repeat queries
+    """
+    key = (
+        tuple(c['id'] for c in candidates), baseline_year, current_year, tuple(extra_classes),
+        scaling, metric, None if weights is None else tuple(weights)
+    )
+    index = _candidate_indexes.get(key)
+    if index is None:
+        transform = fit_feature_transform(candidate_features, scaling, metric, weights)
+        knn = NearestNeighbors(metric='euclidean')
+        knn.fit(apply_feature_transform(transform, candidate_features))
+        index = (transform, knn)
+        _candidate_indexes.put(key, index)
+    return index
+
+def select_control_areas_knn_batch(aoi_geojsons, baseline_year, current_year, k=5, buffer_km=10,
+                                   extra_classes=(), scaling=KNN_SCALING, metric=KNN_METRIC, weights=None):
+    """
+    Select K most similar control areas for several projects at once
+    Features for every project and candidate come from one shared pass;
+    each project's ring is then scaled and indexed on its own, so results
+    do not depend on which other projects share the batch. Projects with
+    the same ring share one kneighbors query
+    """
+    rings = [generate_candidate_tiles(aoi, buffer_km, tile_size_km=2) for aoi in aoi_geojsons]
+    if not all(rings):
+        raise ValueError("No candidate control tiles around the project area")
+    candidates = list({tile['id']: tile for ring in rings for tile in ring}.values())
+    position = {tile['id']: i for i, tile in enumerate(candidates)}
     
-    if len(candidates) < k:
-        k = max(1, len(candidates))
+    # Projects are stored alongside grid tiles under their AOI hash
+    projects = [
+        {
+            'id': f"aoi_{hash_aoi(aoi, '', '')}",
+            'geojson': aoi['geometry'],
+            'geometry': geojson_to_ee(aoi)
+        }
+        for aoi in aoi_geojsons
+    ]
     
-    # Add project area to batch
-    all_geoms = [{'geometry': aoi}] + candidates
+    # One composite window covering every project's search ring
+    bounds = union_bounds(aoi_bounds(aoi, buffer_km) for aoi in aoi_geojsons)
     
-    # Extract features for all in one batch
-    all_features = extract_features_batch(all_geoms, baseline_year, current_year)
+    # Stored features are reused; only missing tiles hit Earth Engine
+    fractions = load_class_fractions(projects + candidates, [baseline_year, current_year], bounds=bounds)
+    all_features = build_feature_vectors(fractions, baseline_year, current_year, extra_classes)
     
-    # Split project and candidates
-    project_features = all_features[0]
-    candidate_features = all_features[1:]
+    # Split projects and candidates
+    project_features = all_features[:len(projects)]
+    candidate_features = all_features[len(projects):]
+    weight_vector = feature_weight_vector(weights, extra_classes)
     
-    # KNN selection
-    knn = NearestNeighbors(n_neighbors=k, metric='euclidean')
-    knn.fit(candidate_features)
+    # Group projects by ring
+    ring_rows = {}
+    for row, ring in enumerate(rings):
+        ring_rows.setdefault(tuple(tile['id'] for tile in ring), []).append(row)
     
-    distances, indices = knn.kneighbors([project_features])
+    neighbours = {}
+    for ring_ids, rows in ring_rows.items():
+        ring = rings[rows[0]]
+        transform, knn = candidate_index(
+            ring, candidate_features[[position[tile_id] for tile_id in ring_ids]],
+            baseline_year, current_year, extra_classes, scaling, metric, weight_vector
+        )
+        distances, indices = knn.kneighbors(
+            apply_feature_transform(transform, project_features[rows]), n_neighbors=min(k, len(ring))
+        )
+        for row, row_distances, row_indices in zip(rows, distances, indices):
+            neighbours[row] = (ring, row_indices, row_distances, transform['metric'])
     
-    # Select control areas
-    selected_controls = []
-    for idx, dist in zip(indices[0], distances[0]):
-        selected_controls.append({
-            'tile_id': candidates[idx]['id'],
-            'geometry': candidates[idx]['geometry'],
-            'similarity_score': float(1 / (1 + dist))
+    results = []
+    for row in range(len(projects)):
+        ring, ring_indices, ring_distances, metric_used = neighbours[row]
+        
+        # Select control areas
+        selected_controls = []
+        for idx, dist in zip(ring_indices, ring_distances):
+            selected_controls.append({
+                'tile_id': ring[idx]['id'],
+                'bounds': ring[idx]['bounds'],
+                'geometry': ring[idx]['geometry'],
+                'similarity_score': float(1 / (1 + dist))
+            })
+        
+        # Merge selected tiles locally; tile bounds are already known
+        control_coordinates = [tile_polygon_coordinates(c['bounds']) for c in selected_controls]
+        merged_control = ee.Geometry.MultiPolygon(control_coordinates)
+        
+        results.append({
+            'control_geometry': merged_control,
+            'control_geojson': {
+                'type': 'Feature',
+                'geometry': {
+                    'type': 'MultiPolygon',
+                    'coordinates': control_coordinates
+                }
+            },
+            'selected_tiles': selected_controls,
+            'k_value': len(selected_controls),
+            'selection_method': 'KNN',
+            'features_used': feature_names(extra_classes),
+            'feature_scaling': scaling,
+            'distance_metric': metric_used,
+            'requested_distance_metric': metric
         })
     
-    # Merge selected tiles
-    control_geometries = [c['geometry'] for c in selected_controls]
-    merged_control = ee.Geometry.MultiPolygon([g.coordinates() for g in control_geometries])
-    
-    return {
-        'control_geometry': merged_control,
-        'control_geojson': {
-            'type': 'Feature',
-            'geometry': merged_control.getInfo()
-        },
-        'selected_tiles': selected_controls,
-        'k_value': k,
-        'selection_method': 'KNN',
-        'features_used': ['forest_pct_baseline', 'forest_loss_rate', 'built_growth_rate', 'volatility'],
-        'distance_metric': 'euclidean'
-    }
+    return results
+
+def select_control_areas_knn(aoi_geojson, baseline_year, current_year, k=5, buffer_km=10, extra_classes=(),
+                             scaling=KNN_SCALING, metric=KNN_METRIC, weights=None):
+    """OPTIMIZED: Select K most similar control areas using KNN"""
+    return select_control_areas_knn_batch(
+        [aoi_geojson], baseline_year, current_year, k, buffer_km, extra_classes, scaling, metric, weights
+    )[0]
@@ -1,77 +1,165 @@
 import ee
+from app.composites import get_yearly_composite, aoi_bounds
+from app.concurrency import map_bounded
+from app.gee_service import geojson_to_ee
+from app.quality_tiers import get_tier, reduce_region_args, estimated_error_pct
+from app.baseline_series import materialized_series
 
-def geojson_to_ee(aoi_geojson: dict):
-    """Convert GeoJSON to Earth Engine Geometry"""
-    coords = aoi_geojson["geometry"]["coordinates"]
-    return ee.Geometry.Polygon(coords)
+# Legacy leakage reductions ran at 100 m with bestEffort
+LEAKAGE_DEFAULT_TIER = "preview"
 
-def generate_buffer_zone(aoi_geojson, buffer_km=5):
-    """Generate buffer zone around AOI (default 5km)"""
-    aoi = geojson_to_ee(aoi_geojson)
-    buffer_meters = buffer_km * 1000
-    buffer = aoi.buffer(buffer_meters).difference(aoi)
-    return buffer
+# Zone labels in the grouped reduction; rings follow the AOI
+AOI_ZONE = 1
 
-def analyze_leakage(aoi_geojson, baseline_year, current_year, buffer_km=5):
-    """Detect deforestation leakage in buffer zone vs project area"""
+def zone_image(aoi, radii_km):
+    """
+    Zone-labelled image: AOI = 1, ring i (between radii i-1 and i) = i + 2
+    Larger buffers are painted first so each pixel keeps its innermost zone
+    """
+    zones = ee.Image(0).byte()
+    for ring in reversed(range(len(radii_km))):
+        zones = zones.paint(ee.FeatureCollection([ee.Feature(aoi.buffer(radii_km[ring] * 1000))]), ring + 2)
+    return zones.paint(ee.FeatureCollection([ee.Feature(aoi)]), AOI_ZONE)
+
+def zone_forest_counts(aoi, radii_km, years, bounds, tier=LEAKAGE_DEFAULT_TIER):
+    """
+    Forest and valid pixel counts per year and zone in one round trip
+    Returns {year: {zone: (forest_sum, valid_count)}}
+    """
+    # Class 1 = Trees
+    stack = ee.Image.cat(
+        [get_yearly_composite(year, bounds).eq(1).rename(f'forest_{year}') for year in years]
+        + [zone_image(aoi, radii_km).rename('zone')]
+    )
+    
+    reducer = ee.Reducer.sum().combine(ee.Reducer.count(), '', True).repeat(len(years)).group(
+        groupField=len(years), groupName='zone'
+    )
+    stats = stack.reduceRegion(
+        reducer=reducer,
+        geometry=aoi.buffer(max(radii_km) * 1000),
+        **reduce_region_args(tier)
+    ).getInfo()
+    
+    counts = {year: {} for year in years}
+    for group in stats.get('groups', []):
+        for index, year in enumerate(years):
+            counts[year][int(group['zone'])] = (group['sum'][index], group['count'][index])
+    return counts
+
+def baseline_zone_counts(aoi, radii_km, baseline_year, current_year, bounds, tier=LEAKAGE_DEFAULT_TIER,
+                         series_id=None):
+    """
+    {zone: (baseline_sum, baseline_count, current_sum, current_count)}
+    With a baseline series_id each year's counts are materialized, so a new
+    current year reduces only that year
+    """
+    years = sorted({baseline_year, current_year})
+    if series_id:
+        def compute_records(missing_years):
+            counts = zone_forest_counts(aoi, radii_km, missing_years, bounds, tier)
+            return {
+                year: {str(zone): list(zone_counts) for zone, zone_counts in counts[year].items()}
+                for year in missing_years
+            }
+        
+        kind = f"leakage:{tier}:" + ",".join(f"{radius:g}" for radius in radii_km)
+        records = materialized_series(series_id, kind, years, compute_records)
+        counts = {year: {int(zone): tuple(zone_counts) for zone, zone_counts in records[year].items()} for year in years}
+    else:
+        counts = zone_forest_counts(aoi, radii_km, years, bounds, tier)
+    
+    baseline, current = counts[baseline_year], counts[current_year]
+    return {
+        zone: baseline.get(zone, (0, 0)) + current.get(zone, (0, 0))
+        for zone in baseline.keys() | current.keys()
+    }
+
+def forest_stats(forest_pixels, total_pixels, scale=100):
+    forest_pct = (forest_pixels / total_pixels * 100) if total_pixels > 0 else 0
+    area_km2 = total_pixels * scale ** 2 / 1e6  # pixels to km²
+    return {"forest_pct": forest_pct, "area_km2": area_km2}
+
+def zone_summary(counts, scale=100):
+    """Baseline/current forest stats for the summed counts of several zones"""
+    baseline_sum, baseline_count, current_sum, current_count = [sum(column) for column in zip(*counts)] or [0, 0, 0, 0]
+    return forest_stats(baseline_sum, baseline_count, scale), forest_stats(current_sum, current_count, scale)
+
+def classify_leakage(buffer_deforestation, aoi_deforestation):
+    """(leakage_detected, severity, ratio) for buffer vs project forest loss"""
+    leakage_detected = False
+    leakage_severity = "NONE"
+    leakage_ratio = 0
+    
+    if buffer_deforestation > 2:  # Significant buffer deforestation
+        leakage_detected = True
+        leakage_ratio = buffer_deforestation / max(abs(aoi_deforestation), 0.1)
+        
+        if leakage_ratio > 1.5:
+            leakage_severity = "HIGH"
+        elif leakage_ratio > 0.8:
+            leakage_severity = "MEDIUM"
+        else:
+            leakage_severity = "LOW"
+    
+    return leakage_detected, leakage_severity, leakage_ratio
+
+def analyze_leakage(aoi_geojson, baseline_year, current_year, buffer_km=5, ring_radii_km=None,
+                    quality_tier=LEAKAGE_DEFAULT_TIER, series_id=None):
+    """
+    Detect deforestation leakage in buffer zone vs project area
+    Every zone (project area and each buffer ring) and both years come from
+    one grouped reduction; ring_radii_km adds a ring-wise leakage profile.
+    series_id materializes the zone counts in a locked baseline's series
+    """
     try:
         aoi = geojson_to_ee(aoi_geojson)
-        buffer = generate_buffer_zone(aoi_geojson, buffer_km)
+        radii_km = sorted(set(ring_radii_km or []) | {buffer_km})
+        bounds = aoi_bounds(aoi_geojson, max(radii_km))
         
-        # Generate buffer visualization with outline
-        buffer_outline = ee.Image().paint(buffer, 0, 3)  # 3px outline
-        buffer_map = buffer_outline.getMapId({'palette': ['#FFA500']})
-        buffer_tile_url = buffer_map['tile_fetcher'].url_format
+        def buffer_tile():
+            # Generate buffer visualization with outline
+            buffers = ee.FeatureCollection([ee.Feature(aoi.buffer(radius * 1000)) for radius in radii_km])
+            buffer_outline = ee.Image().paint(buffers, 0, 3)  # 3px outline
+            buffer_map = buffer_outline.getMapId({'palette': ['#FFA500']})
+            return buffer_map['tile_fetcher'].url_format
         
-        # Get forest cover for both zones
-        def get_forest_stats(geometry, year):
-            start = f"{year}-01-01"
-            end = f"{year}-12-31"
-            dw = ee.ImageCollection('GOOGLE/DYNAMICWORLD/V1').filterDate(start, end).filterBounds(geometry).select('label').mode()
-            
-            # Class 1 = Trees
-            forest = dw.eq(1)
-            stats = forest.reduceRegion(
-                reducer=ee.Reducer.sum().combine(ee.Reducer.count(), '', True),
-                geometry=geometry,
-                scale=100,  # Increased scale for faster computation
-                maxPixels=1e9,
-                bestEffort=True
-            )
-            
-            stats_info = stats.getInfo()
-            forest_pixels = stats_info.get('label_sum', 0)
-            total_pixels = stats_info.get('label_count', 1)
-            forest_pct = (forest_pixels / total_pixels * 100) if total_pixels > 0 else 0
-            area_km2 = total_pixels * 10000 / 1e6  # 100m pixels to km²
-            
-            return {"forest_pct": forest_pct, "area_km2": area_km2}
+        # Outline tile is minted while the grouped reduction runs
+        buffer_tile_url, counts = map_bounded(lambda task: task(), [
+            buffer_tile,
+            lambda: baseline_zone_counts(aoi, radii_km, baseline_year, current_year, bounds, quality_tier, series_id)
+        ])
         
-        # Analyze both zones
-        aoi_baseline = get_forest_stats(aoi, baseline_year)
-        aoi_current = get_forest_stats(aoi, current_year)
-        buffer_baseline = get_forest_stats(buffer, baseline_year)
-        buffer_current = get_forest_stats(buffer, current_year)
+        # Analyze both zones; the buffer zone spans every ring out to buffer_km
+        empty = (0, 0, 0, 0)
+        scale = get_tier(quality_tier)["scale"]
+        aoi_baseline, aoi_current = zone_summary([counts.get(AOI_ZONE, empty)], scale)
+        buffer_rings = [counts.get(ring + 2, empty) for ring, radius in enumerate(radii_km) if radius <= buffer_km]
+        buffer_baseline, buffer_current = zone_summary(buffer_rings, scale)
         
         # Calculate deforestation rates
         aoi_deforestation = aoi_baseline['forest_pct'] - aoi_current['forest_pct']
         buffer_deforestation = buffer_baseline['forest_pct'] - buffer_current['forest_pct']
         
         # Leakage detection logic
-        leakage_detected = False
-        leakage_severity = "NONE"
-        leakage_ratio = 0
+        leakage_detected, leakage_severity, leakage_ratio = classify_leakage(buffer_deforestation, aoi_deforestation)
         
-        if buffer_deforestation > 2:  # Significant buffer deforestation
-            leakage_detected = True
-            leakage_ratio = buffer_deforestation / max(abs(aoi_deforestation), 0.1)
-            
-            if leakage_ratio > 1.5:
-                leakage_severity = "HIGH"
-            elif leakage_ratio > 0.8:
-                leakage_severity = "MEDIUM"
-            else:
-                leakage_severity = "LOW"
+        # Ring-wise profile
+        rings = []
+        for ring, radius in enumerate(radii_km):
+            ring_baseline, ring_current = zone_summary([counts.get(ring + 2, empty)], scale)
+            ring_deforestation = ring_baseline['forest_pct'] - ring_current['forest_pct']
+            _, ring_severity, ring_ratio = classify_leakage(ring_deforestation, aoi_deforestation)
+            rings.append({
+                "inner_km": radii_km[ring - 1] if ring > 0 else 0,
+                "outer_km": radius,
+                "baseline_forest_pct": round(ring_baseline['forest_pct'], 2),
+                "current_forest_pct": round(ring_current['forest_pct'], 2),
+                "deforestation_pct": round(ring_deforestation, 2),
+                "area_km2": round(ring_baseline['area_km2'], 2),
+                "leakage_ratio": round(ring_ratio, 2),
+                "leakage_severity": ring_severity
+            })
         
         # Generate summary
         if leakage_detected:
@@ -98,6 +186,9 @@ def analyze_leakage(aoi_geojson, baseline_year, current_year, buffer_km=5):
                 "deforestation_pct": round(buffer_deforestation, 2),
                 "area_km2": round(buffer_baseline['area_km2'], 2)
             },
+            "rings": rings,
+            "quality_tier": quality_tier,
+            "estimated_error_pct": estimated_error_pct(aoi_geojson, quality_tier),
             "summary": summary,
             "recommendation": "Consider expanding monitoring to buffer zone" if leakage_detected else "Continue monitoring project area"
         }
@@ -121,6 +212,8 @@ def analyze_leakage(aoi_geojson, baseline_year, current_year, buffer_km=5):
                 "deforestation_pct": 0.0,
                 "area_km2": 0.0
             },
+            "quality_tier": quality_tier,
+            "estimated_error_pct": 100.0,
             "summary": f"⚠️ Leakage analysis failed: {str(e)}. Buffer zone may be too large for computation.",
             "recommendation": "Try a smaller AOI or contact support"
         }
@@ -0,0 +1,205 @@
+"""
+Cached LULC access layer
+Stats and tile URLs are computed and cached independently; concurrent
+misses for the same key share one Earth Engine computation
+"""
+from app.composites import year_range
+from app.gee_service import (
+    generate_lulc_stats, generate_lulc_series, generate_lulc_series_batch, generate_lulc_tile,
+    generate_transition_histogram
+)
+from app.database import (
+    hash_aoi, hash_aoi_legacy, get_cache_record, get_cached_stats, save_cached_stats, get_cached_tile, save_cached_tile
+)
+from app.geometry import geodesic_area_km2
+from app.cache_policy import stats_expires_at, tile_url_expires_at
+from app.concurrency import map_bounded, call_coalesced
+from app.quality_tiers import LEGACY_TIER, tier_cache_key
+from app.baseline_series import materialized_series
+
+def stats_key(aoi_geojson: dict, start_date: str, end_date: str, tier: str = LEGACY_TIER) -> str:
+    """Stats cache key; each quality tier is cached separately"""
+    return tier_cache_key(hash_aoi(aoi_geojson, start_date, end_date), tier)
+
+def read_cached_stats(aoi_geojson: dict, start_date: str, end_date: str, tier: str = LEGACY_TIER):
+    """Cached stats for an AOI, migrating rows keyed before AOI canonicalization"""
+    aoi_hash = stats_key(aoi_geojson, start_date, end_date, tier)
+    cached = get_cached_stats(aoi_hash)
+    if cached or tier != LEGACY_TIER:
+        return cached
+
+    # Older rows are keyed by the raw-JSON hash and were always reduced at
+    # 10 m: split stats rows first, then combined stats + tile rows
+    legacy_hash = hash_aoi_legacy(aoi_geojson, start_date, end_date)
+    cached = get_cached_stats(legacy_hash)
+    if cached is None:
+        legacy = get_cache_record(legacy_hash)
+        if legacy is None or legacy["stats"] is None:
+            return None
+        # Legacy tile URLs are not carried over; they have long since expired
+        cached = {"stats": legacy["stats"], "area_km2": legacy["area_km2"] or geodesic_area_km2(aoi_geojson)}
+
+    save_cached_stats(aoi_hash, cached["stats"], cached["area_km2"], stats_expires_at(end_date))
+    return cached
+
+def get_lulc_stats(aoi_geojson: dict, start_date: str, end_date: str, tier: str = LEGACY_TIER):
+    """Stats-only entry point: {"stats", "area_km2"}, never mints a map id"""
+    aoi_hash = stats_key(aoi_geojson, start_date, end_date, tier)
+    cached = read_cached_stats(aoi_geojson, start_date, end_date, tier)
+    if cached:
+        return cached
+
+    def compute():
+        result = generate_lulc_stats(aoi_geojson, start_date, end_date, tier)
+        save_cached_stats(aoi_hash, result["stats"], result["area_km2"], stats_expires_at(end_date))
+        return result
+
+    return call_coalesced(("stats", aoi_hash), compute)
+
+def read_cached_series(aoi_geojson: dict, years: list, tier: str = LEGACY_TIER):
+    """Cached yearly stats for an AOI: (stats by year, area_km2, missing years)"""
+    stats = {}
+    area_km2 = None
+    missing_years = []
+
+    for year in years:
+        start_date, end_date = year_range(year)
+        cached = read_cached_stats(aoi_geojson, start_date, end_date, tier)
+        if cached:
+            stats[year] = cached["stats"]
+            area_km2 = cached["area_km2"]
+        else:
+            missing_years.append(year)
+
+    return stats, area_km2, missing_years
+
+def save_series(aoi_geojson: dict, series: dict, years: list, tier: str = LEGACY_TIER):
+    """Cache the given years of a computed series"""
+    for year in years:
+        start_date, end_date = year_range(year)
+        save_cached_stats(
+            stats_key(aoi_geojson, start_date, end_date, tier),
+            series["stats"][year], series["area_km2"], stats_expires_at(end_date)
+        )
+
+def get_lulc_series(aoi_geojson: dict, years: list, tier: str = LEGACY_TIER, series_id: str = None):
+    """
+    Yearly stats for several years
+    Cached years are read locally, the rest come from one batched reduction;
+    with a baseline series_id, closed years are materialized for good
+    """
+    years = sorted(set(years))
+    if series_id:
+        def compute_records(missing_years):
+            series = get_lulc_series(aoi_geojson, missing_years, tier)
+            return {year: {"stats": series["stats"][year], "area_km2": series["area_km2"]} for year in missing_years}
+        
+        records = materialized_series(series_id, f"lulc:{tier}", years, compute_records)
+        return {
+            "stats": {year: records[year]["stats"] for year in years},
+            "area_km2": records[years[-1]]["area_km2"] if years else 0
+        }
+    
+    stats, area_km2, missing_years = read_cached_series(aoi_geojson, years, tier)
+
+    def compute():
+        series = generate_lulc_series(aoi_geojson, missing_years, tier)
+        save_series(aoi_geojson, series, missing_years, tier)
+        return series
+
+    if missing_years:
+        key = ("series", hash_aoi(aoi_geojson, "", ""), tuple(missing_years), tier)
+        series = call_coalesced(key, compute)
+        area_km2 = series["area_km2"]
+        for year in missing_years:
+            stats[year] = series["stats"][year]
+
+    return {"stats": stats, "area_km2": area_km2 or 0}
+
+def get_lulc_series_batch(aoi_geojsons: list, years: list, tier: str = LEGACY_TIER):
+    """
+    Yearly stats for many AOIs, in input order
+    Cached years are read locally; every AOI missing a year (duplicates
+    counted once) joins a single FeatureCollection reduction
+    """
+    years = sorted(set(years))
+    results = {}
+    missing = {}
+
+    for aoi_geojson in aoi_geojsons:
+        aoi_key = hash_aoi(aoi_geojson, "", "")
+        if aoi_key in results:
+            continue
+        stats, area_km2, missing_years = read_cached_series(aoi_geojson, years, tier)
+        results[aoi_key] = {"stats": stats, "area_km2": area_km2}
+        if missing_years:
+            missing[aoi_key] = aoi_geojson
+
+    if missing:
+        missing_years = sorted({year for key in missing for year in years if year not in results[key]["stats"]})
+        computed = generate_lulc_series_batch(list(missing.values()), missing_years, tier)
+        for (aoi_key, aoi_geojson), series in zip(missing.items(), computed):
+            save_series(aoi_geojson, series, missing_years, tier)
+            results[aoi_key]["stats"].update(series["stats"])
+            results[aoi_key]["area_km2"] = series["area_km2"]
+
+    return [
+        {"stats": results[key]["stats"], "area_km2": results[key]["area_km2"] or 0}
+        for key in (hash_aoi(aoi_geojson, "", "") for aoi_geojson in aoi_geojsons)
+    ]
+
+def get_transition_histogram(aoi_geojson: dict, baseline_year: int, current_year: int, tier: str = LEGACY_TIER,
+                             series_id: str = None):
+    """
+    Cached baseline*9 + current pixel counts for a year pair
+    {"stats": {code: count}, "area_km2"}; cached like yearly stats, or
+    materialized in the baseline's series when series_id is given.
+    A miss also caches the current year's stats from the same reduction
+    """
+    if series_id:
+        def compute_records(missing_years):
+            return {
+                year: get_transition_histogram(aoi_geojson, baseline_year, year, tier)
+                for year in missing_years
+            }
+        
+        return materialized_series(series_id, f"transition:{tier}", [current_year], compute_records)[current_year]
+    
+    _, end_date = year_range(current_year)
+    key = stats_key(aoi_geojson, f"transition:{baseline_year}", str(current_year), tier)
+    cached = get_cached_stats(key)
+    if cached:
+        return cached
+
+    def compute():
+        result = generate_transition_histogram(aoi_geojson, baseline_year, current_year, tier)
+        save_cached_stats(key, result["histogram"], result["area_km2"], stats_expires_at(end_date))
+        save_cached_stats(
+            stats_key(aoi_geojson, *year_range(current_year), tier),
+            result["current_stats"], result["area_km2"], stats_expires_at(end_date)
+        )
+        return {"stats": result["histogram"], "area_km2": result["area_km2"]}
+
+    return call_coalesced(("transition", key), compute)
+
+def get_lulc_tile(aoi_geojson: dict, start_date: str, end_date: str) -> str:
+    """
+    Tiles-only entry point: returns a cached map id without touching histograms
+    Expired tile URLs are re-minted here while the stats stay cached
+    """
+    aoi_hash = hash_aoi(aoi_geojson, start_date, end_date)
+    tile_url = get_cached_tile(aoi_hash)
+    if tile_url:
+        return tile_url
+
+    def compute():
+        tile_url = generate_lulc_tile(aoi_geojson, start_date, end_date)
+        save_cached_tile(aoi_hash, tile_url, tile_url_expires_at())
+        return tile_url
+
+    return call_coalesced(("tile", aoi_hash), compute)
+
+def get_lulc_tiles(aoi_geojson: dict, years: list):
+    """Yearly tile URLs, minted concurrently for uncached years"""
+    tile_urls = map_bounded(lambda year: get_lulc_tile(aoi_geojson, *year_range(year)), years)
+    return dict(zip(years, tile_urls))
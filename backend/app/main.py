@@ -1,25 +1,47 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.schemas import (
-    AOIRequest, LULCResponse, TimelineRequest, TimelineResponse, TimelineYearData,
+    AOIRequest, LULCResponse, LULCTileResponse, TimelineRequest, TimelineResponse, TimelineYearData,
     BaselineRequest, BaselineResponse, LockBaselineRequest,
     ChangeDetectionRequest, ChangeDetectionResponse, RiskAssessmentResponse,
-    LeakageAnalysisResponse, DACBRequest, DACBResponse
+    RiskRescoreRequest, RiskRescoreResponse, RiskRescoreResult,
+    LeakageAnalysisRequest, LeakageAnalysisResponse, DACBRequest, DACBResponse, DACBPortfolioRequest, DACBPortfolioResult
+)
+from app.gee_service import init_gee
+from app.lulc_service import (
+    year_range, get_lulc_stats, get_lulc_series, get_lulc_tile, get_lulc_tiles, get_transition_histogram
 )
-from app.gee_service import init_gee, generate_lulc
 from app.database import (
-    init_db, hash_aoi, get_cached, save_cache, log_request,
-    hash_baseline, get_baseline, save_baseline, lock_baseline, is_baseline_locked
+    init_db, log_request, memory_cache_stats, hash_aoi,
+    hash_baseline, hash_baseline_legacy, get_baseline, save_baseline, lock_baseline, is_baseline_locked,
+    get_locked_baselines, get_baseline_series_many
+)
+from app.change_detection import (
+    calculate_changes, detect_key_transitions, generate_change_summary, transition_matrix, transition_matrix_report
 )
-from app.change_detection import calculate_changes, detect_key_transitions, generate_change_summary
-from app.risk_assessment import assess_carbon_risk
-from app.leakage_analysis import analyze_leakage
-from app.dacb_service import dacb_analysis
+from app.risk_assessment import assess_carbon_risk, score_portfolio, volatility_array
+from app.risk_rules import RISK_RULES, compile_risk_methodology
+from app.leakage_analysis import analyze_leakage, LEAKAGE_DEFAULT_TIER
+from app.dacb_service import dacb_analysis, dacb_portfolio
+from app.cache_policy import start_cache_sweeper, stop_cache_sweeper
+from app.concurrency import run_coalesced, run_blocking, call_with_budget
+from app.quality_tiers import LEGACY_TIER, estimated_error_pct
+from app.geometry import geodesic_area_km2
+from app.histograms import ClassHistogram, histogram_counts
+from app.baseline_series import baseline_series_id, seed_baseline_series
+import logging
 import os
+import numpy as np
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# The volatility timeline is optional; risk is scored without it past this budget
+RISK_VOLATILITY_TIMEOUT_SECONDS = float(os.getenv("RISK_VOLATILITY_TIMEOUT_SECONDS", 20))
+
 app = FastAPI(title="Sylithe LULC API")
 
 # CORS
@@ -31,107 +53,131 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def monitoring_key(endpoint: str, request: ChangeDetectionRequest) -> tuple:
+    """Coalescing key for baseline monitoring endpoints"""
+    return (endpoint, request.baseline_id, hash_aoi(request.aoi, str(request.current_year), ""))
+
+def timeline_key(request: TimelineRequest) -> tuple:
+    """Coalescing key for timeline requests, including the rendered years"""
+    tile_years = tuple(sorted(request.tile_years)) if request.tile_years is not None else None
+    aoi_hash = hash_aoi(request.aoi, str(request.start_year), str(request.end_year))
+    return ("timeline", aoi_hash, tile_years, request.quality_tier or LEGACY_TIER)
+
 @app.on_event("startup")
 def startup():
     init_db()
     init_gee()
+    start_cache_sweeper()
+
+@app.on_event("shutdown")
+def shutdown():
+    stop_cache_sweeper()
 
 @app.get("/api/health")
 def health():
     return {"status": "ok"}
 
-@app.post("/api/lulc/analyze", response_model=LULCResponse)
-def analyze_lulc(request: AOIRequest):
+@app.get("/api/cache/stats")
+def cache_stats():
+    return memory_cache_stats()
+
+def run_analyze_lulc(request: AOIRequest):
+    # Validate AOI size locally, before any Earth Engine work
+    max_area = float(os.getenv("MAX_AOI_AREA_KM2", 10000))
+    if geodesic_area_km2(request.aoi) > max_area:
+        raise HTTPException(400, f"AOI exceeds max area of {max_area} km²")
+    
     try:
-        # Check cache
-        aoi_hash = hash_aoi(request.aoi, request.start_date, request.end_date)
-        cached = get_cached(aoi_hash)
-        
-        if cached:
-            return LULCResponse(
-                tile_url=cached[0],
-                stats=eval(cached[1]) if cached[1] else None,
-                aoi_area_km2=0
-            )
-        
-        # Generate LULC
-        result = generate_lulc(request.aoi, request.start_date, request.end_date)
+        # Stats and tile are cached independently; hits and misses
+        # return the same full response; large AOIs are reduced as sub-tiles
+        tier = request.quality_tier or LEGACY_TIER
+        result = get_lulc_stats(request.aoi, request.start_date, request.end_date, tier)
         
-        # Validate AOI size
-        max_area = float(os.getenv("MAX_AOI_AREA_KM2", 10000))
-        if result["area_km2"] > max_area:
-            raise HTTPException(400, f"AOI exceeds max area of {max_area} km²")
-        
-        # Cache and log
-        save_cache(aoi_hash, result["tile_url"], result["stats"])
-        log_request(request.aoi, result["tile_url"], result["stats"])
+        tile_url = get_lulc_tile(request.aoi, request.start_date, request.end_date)
         
         return LULCResponse(
-            tile_url=result["tile_url"],
+            tile_url=tile_url,
             stats=result["stats"],
-            aoi_area_km2=result["area_km2"]
+            aoi_area_km2=result["area_km2"],
+            quality_tier=tier,
+            estimated_error_pct=estimated_error_pct(request.aoi, tier)
         )
     except Exception as e:
         raise HTTPException(500, str(e))
 
-@app.post("/api/lulc/timeline", response_model=TimelineResponse)
-def analyze_timeline(request: TimelineRequest):
+@app.post("/api/lulc/analyze", response_model=LULCResponse)
+async def analyze_lulc(request: AOIRequest):
+    aoi_hash = hash_aoi(request.aoi, request.start_date, request.end_date)
+    key = ("lulc", aoi_hash, request.quality_tier or LEGACY_TIER)
+    response = await run_coalesced(key, run_analyze_lulc, request)
+    
+    # Every caller is logged, including followers of a coalesced request
+    await run_blocking(log_request, request.aoi, response.tile_url, response.stats)
+    return response
+
+def run_lulc_tiles(request: AOIRequest):
     try:
-        timeline = []
-        area_km2 = 0
+        tile_url = get_lulc_tile(request.aoi, request.start_date, request.end_date)
+        return LULCTileResponse(tile_url=tile_url)
+    except Exception as e:
+        raise HTTPException(500, str(e))
+
+@app.post("/api/lulc/tiles", response_model=LULCTileResponse)
+async def lulc_tiles(request: AOIRequest):
+    key = ("tiles", hash_aoi(request.aoi, request.start_date, request.end_date))
+    return await run_coalesced(key, run_lulc_tiles, request)
+
+def run_analyze_timeline(request: TimelineRequest):
+    try:
+        years = list(range(request.start_year, request.end_year + 1))
+        tile_years = years if request.tile_years is None else [y for y in years if y in request.tile_years]
         
-        for year in range(request.start_year, request.end_year + 1):
-            start_date = f"{year}-01-01"
-            end_date = f"{year}-12-31"
-            
-            # Check cache
-            aoi_hash = hash_aoi(request.aoi, start_date, end_date)
-            cached = get_cached(aoi_hash)
-            
-            if cached:
-                timeline.append(TimelineYearData(
-                    year=year,
-                    tile_url=cached[0],
-                    stats=eval(cached[1]) if cached[1] else {}
-                ))
-            else:
-                # Generate LULC for this year
-                result = generate_lulc(request.aoi, start_date, end_date)
-                area_km2 = result["area_km2"]
-                
-                # Cache result
-                save_cache(aoi_hash, result["tile_url"], result["stats"])
-                
-                timeline.append(TimelineYearData(
-                    year=year,
-                    tile_url=result["tile_url"],
-                    stats=result["stats"]
-                ))
+        # Cached years are read locally, the rest share one reduction
+        tier = request.quality_tier or LEGACY_TIER
+        series = get_lulc_series(request.aoi, years, tier)
+        
+        # Mint tiles only for the years the client renders
+        tile_urls = get_lulc_tiles(request.aoi, tile_years)
+        
+        timeline = [
+            TimelineYearData(
+                year=year,
+                tile_url=tile_urls.get(year),
+                stats=series["stats"][year]
+            )
+            for year in years
+        ]
         
         return TimelineResponse(
             timeline=timeline,
-            aoi_area_km2=area_km2
+            aoi_area_km2=series["area_km2"],
+            quality_tier=tier,
+            estimated_error_pct=estimated_error_pct(request.aoi, tier)
         )
     except Exception as e:
         raise HTTPException(500, str(e))
 
-@app.post("/api/baseline/create", response_model=BaselineResponse)
-def create_baseline(request: BaselineRequest):
+@app.post("/api/lulc/timeline", response_model=TimelineResponse)
+async def analyze_timeline(request: TimelineRequest):
+    return await run_coalesced(timeline_key(request), run_analyze_timeline, request)
+
+def run_create_baseline(request: BaselineRequest):
     try:
         # Generate baseline ID
         baseline_id = hash_baseline(request.aoi, request.baseline_year)
         
-        # Check if baseline already exists
-        existing = get_baseline(baseline_id)
+        # Check if baseline already exists (including IDs minted before
+        # AOI canonicalization)
+        existing = get_baseline(baseline_id) or get_baseline(hash_baseline_legacy(request.aoi, request.baseline_year))
         if existing:
             if existing["locked"]:
                 raise HTTPException(400, "Baseline already locked. Cannot modify.")
             return BaselineResponse(**existing)
         
         # Generate LULC for baseline year
-        start_date = f"{request.baseline_year}-01-01"
-        end_date = f"{request.baseline_year}-12-31"
-        result = generate_lulc(request.aoi, start_date, end_date)
+        start_date, end_date = year_range(request.baseline_year)
+        result = get_lulc_stats(request.aoi, start_date, end_date)
+        tile_url = get_lulc_tile(request.aoi, start_date, end_date)
         
         # Save baseline
         save_baseline(
@@ -139,7 +185,7 @@ def create_baseline(request: BaselineRequest):
             request.aoi,
             request.baseline_year,
             result["stats"],
-            result["tile_url"],
+            tile_url,
             result["area_km2"]
         )
         
@@ -149,6 +195,11 @@ def create_baseline(request: BaselineRequest):
     except Exception as e:
         raise HTTPException(500, str(e))
 
+@app.post("/api/baseline/create", response_model=BaselineResponse)
+async def create_baseline(request: BaselineRequest):
+    key = ("baseline", hash_baseline(request.aoi, request.baseline_year))
+    return await run_coalesced(key, run_create_baseline, request)
+
 @app.post("/api/baseline/lock")
 def lock_baseline_endpoint(request: LockBaselineRequest):
     try:
@@ -161,8 +212,9 @@ def lock_baseline_endpoint(request: LockBaselineRequest):
         if baseline["locked"]:
             raise HTTPException(400, "Baseline already locked")
         
-        # Lock baseline
+        # Lock baseline; its stats open the materialized monitoring series
         lock_baseline(request.baseline_id, request.locked_by)
+        seed_baseline_series(baseline, f"lulc:{LEGACY_TIER}")
         
         return {
             "success": True,
@@ -183,30 +235,44 @@ def get_baseline_endpoint(baseline_id: str):
     except Exception as e:
         raise HTTPException(500, str(e))
 
-@app.post("/api/change-detection", response_model=ChangeDetectionResponse)
-def detect_changes(request: ChangeDetectionRequest):
+def run_detect_changes(request: ChangeDetectionRequest):
     try:
         # Get baseline
         baseline = get_baseline(request.baseline_id)
         if not baseline:
             raise HTTPException(404, "Baseline not found")
         
-        # Get current year LULC
-        start_date = f"{request.current_year}-01-01"
-        end_date = f"{request.current_year}-12-31"
-        current_result = generate_lulc(request.aoi, start_date, end_date)
+        # Per-pixel transition matrix and current year LULC, read from the
+        # baseline's materialized series when it is locked; a cold transition
+        # reduction also caches the current year's stats
+        series_id = baseline_series_id(baseline, request.aoi)
+        start_date, end_date = year_range(request.current_year)
+        transition_result = get_transition_histogram(
+            request.aoi, baseline["baseline_year"], request.current_year, series_id=series_id
+        )
+        current_series = get_lulc_series(request.aoi, [request.current_year], series_id=series_id)
+        current_result = {
+            "stats": current_series["stats"][request.current_year],
+            "area_km2": current_series["area_km2"]
+        }
+        matrix = transition_matrix(transition_result["stats"])
+        
+        # JSON histograms become class-count arrays here
+        baseline_histogram = ClassHistogram.from_stats(baseline["stats"])
+        current_histogram = ClassHistogram.from_stats(current_result["stats"])
         
         # Calculate changes
         changes = calculate_changes(
-            baseline["stats"],
-            current_result["stats"],
+            baseline_histogram,
+            current_histogram,
             current_result["area_km2"]
         )
         
         # Detect transitions
         transitions = detect_key_transitions(
-            baseline["stats"],
-            current_result["stats"]
+            baseline_histogram,
+            current_histogram,
+            matrix
         )
         
         # Generate summary
@@ -223,53 +289,113 @@ def detect_changes(request: ChangeDetectionRequest):
             changes=changes,
             transitions=transitions,
             summary=summary,
-            current_tile_url=current_result["tile_url"]
+            current_tile_url=get_lulc_tile(request.aoi, start_date, end_date),
+            transition_matrix=transition_matrix_report(matrix)
         )
     except Exception as e:
         raise HTTPException(500, str(e))
 
-@app.post("/api/risk-assessment", response_model=RiskAssessmentResponse)
-def assess_risk(request: ChangeDetectionRequest):
+@app.post("/api/change-detection", response_model=ChangeDetectionResponse)
+async def detect_changes(request: ChangeDetectionRequest):
+    key = monitoring_key("changes", request)
+    return await run_coalesced(key, run_detect_changes, request)
+
+def run_assess_risk(request: ChangeDetectionRequest):
     try:
         # Get baseline
         baseline = get_baseline(request.baseline_id)
         if not baseline:
             raise HTTPException(404, "Baseline not found")
         
-        # Get current year LULC
-        start_date = f"{request.current_year}-01-01"
-        end_date = f"{request.current_year}-12-31"
-        current_result = generate_lulc(request.aoi, start_date, end_date)
+        # Current year from the shared yearly stats (required)
+        series_id = baseline_series_id(baseline, request.aoi)
+        current = get_lulc_series(request.aoi, [request.current_year], series_id=series_id)
+        current_stats = ClassHistogram.from_stats(current["stats"][request.current_year])
         
-        # Get timeline for volatility calculation (optional)
-        timeline_stats = None
+        # Volatility timeline from the same source (optional, time-boxed)
+        years = list(range(baseline["baseline_year"], request.current_year + 1))
         try:
-            timeline_result = []
-            for year in range(baseline["baseline_year"], request.current_year + 1):
-                year_start = f"{year}-01-01"
-                year_end = f"{year}-12-31"
-                year_result = generate_lulc(request.aoi, year_start, year_end)
-                timeline_result.append({
-                    "year": year,
-                    "stats": year_result["stats"]
-                })
-            timeline_stats = timeline_result
-        except:
-            pass  # Timeline is optional
+            volatility_complete, series = call_with_budget(
+                get_lulc_series, RISK_VOLATILITY_TIMEOUT_SECONDS, request.aoi, years, LEGACY_TIER, series_id
+            )
+        except Exception as e:
+            logger.warning("Volatility timeline failed: %s", e)
+            volatility_complete, series = False, None
+        timeline_stats = histogram_counts([series["stats"][year] for year in years]) if series else None
         
         # Assess risk
         risk_assessment = assess_carbon_risk(
-            baseline["stats"],
-            current_result["stats"],
+            ClassHistogram.from_stats(baseline["stats"]),
+            current_stats,
             timeline_stats
         )
         
-        return RiskAssessmentResponse(**risk_assessment)
+        return RiskAssessmentResponse(**risk_assessment, volatility_complete=volatility_complete)
     except Exception as e:
         raise HTTPException(500, str(e))
 
-@app.post("/api/leakage-analysis", response_model=LeakageAnalysisResponse)
-def analyze_leakage_endpoint(request: ChangeDetectionRequest):
+@app.post("/api/risk-assessment", response_model=RiskAssessmentResponse)
+async def assess_risk(request: ChangeDetectionRequest):
+    key = monitoring_key("risk", request)
+    return await run_coalesced(key, run_assess_risk, request)
+
+@app.post("/api/risk-assessment/rescore", response_model=RiskRescoreResponse)
+def rescore_risk(request: RiskRescoreRequest):
+    """
+    Re-score locked baselines from their materialized series only
+    No Earth Engine calls: baselines without a stored current year are skipped
+    """
+    try:
+        rules = compile_risk_methodology(request.methodology) if request.methodology else RISK_RULES
+    except ValueError as e:
+        raise HTTPException(400, f"Invalid risk methodology: {e}")
+    
+    try:
+        baselines = get_locked_baselines(request.baseline_ids)
+        series = get_baseline_series_many([baseline[0] for baseline in baselines], f"lulc:{LEGACY_TIER}")
+        
+        scored_ids, baseline_stats, current_stats, volatility, skipped = [], [], [], [], []
+        for baseline_id, baseline_year, stats in baselines:
+            records = series.get(baseline_id, {})
+            if request.current_year not in records:
+                skipped.append(baseline_id)
+                continue
+            
+            # Volatility needs every year of a timeline longer than two years
+            years = range(baseline_year, request.current_year + 1)
+            complete = all(year in records for year in years)
+            if complete and len(years) > 2:
+                volatility.append(volatility_array(histogram_counts([records[year]["stats"] for year in years])))
+            else:
+                volatility.append(float("nan"))
+            
+            scored_ids.append((baseline_id, complete))
+            baseline_stats.append(stats)
+            current_stats.append(records[request.current_year]["stats"])
+        
+        scored = score_portfolio(
+            histogram_counts(baseline_stats),
+            histogram_counts(current_stats),
+            np.array(volatility),
+            rules
+        )
+        
+        results = [
+            RiskRescoreResult(
+                baseline_id=baseline_id,
+                risk_score=int(scored["risk_score"][row]),
+                risk_level=str(scored["risk_level"][row]),
+                permanence_confidence=int(scored["permanence_confidence"][row]),
+                flag_types=scored["flag_types"][row],
+                volatility_complete=complete
+            )
+            for row, (baseline_id, complete) in enumerate(scored_ids)
+        ]
+        return RiskRescoreResponse(current_year=request.current_year, results=results, skipped=skipped)
+    except Exception as e:
+        raise HTTPException(500, str(e))
+
+def run_analyze_leakage_endpoint(request: LeakageAnalysisRequest):
     try:
         # Get baseline
         baseline = get_baseline(request.baseline_id)
@@ -281,15 +407,23 @@ def analyze_leakage_endpoint(request: ChangeDetectionRequest):
             request.aoi,
             baseline["baseline_year"],
             request.current_year,
-            buffer_km=5
+            buffer_km=request.buffer_km,
+            ring_radii_km=request.ring_radii_km,
+            quality_tier=request.quality_tier or LEAKAGE_DEFAULT_TIER,
+            series_id=baseline_series_id(baseline, request.aoi)
         )
         
         return LeakageAnalysisResponse(**leakage_result)
     except Exception as e:
         raise HTTPException(500, str(e))
 
-@app.post("/api/dacb/analyze", response_model=DACBResponse)
-def analyze_dacb(request: DACBRequest):
+@app.post("/api/leakage-analysis", response_model=LeakageAnalysisResponse)
+async def analyze_leakage_endpoint(request: LeakageAnalysisRequest):
+    radii = tuple(sorted(set(request.ring_radii_km or [])))
+    key = monitoring_key("leakage", request) + (request.buffer_km, radii, request.quality_tier)
+    return await run_coalesced(key, run_analyze_leakage_endpoint, request)
+
+def run_analyze_dacb(request: DACBRequest):
     try:
         # Run DACB analysis
         dacb_result = dacb_analysis(
@@ -297,9 +431,31 @@ def analyze_dacb(request: DACBRequest):
             request.baseline_year,
             request.current_year,
             request.buffer_km,
-            request.use_knn
+            request.use_knn,
+            request.quality_tier or LEGACY_TIER
         )
         
         return DACBResponse(**dacb_result)
     except Exception as e:
         raise HTTPException(500, str(e))
+
+@app.post("/api/dacb/analyze", response_model=DACBResponse)
+async def analyze_dacb(request: DACBRequest):
+    aoi_hash = hash_aoi(request.aoi, str(request.baseline_year), str(request.current_year))
+    key = ("dacb", aoi_hash, request.buffer_km, request.use_knn, request.quality_tier or LEGACY_TIER)
+    return await run_coalesced(key, run_analyze_dacb, request)
+
+@app.post("/api/dacb/portfolio")
+def analyze_dacb_portfolio(request: DACBPortfolioRequest):
+    """Stream one NDJSON line per project as its chunk completes"""
+    project_ids = [project.project_id for project in request.projects]
+    if len(set(project_ids)) != len(project_ids):
+        raise HTTPException(400, "project_id values must be unique")
+    
+    projects = [project.model_dump() for project in request.projects]
+    
+    def lines():
+        for item in dacb_portfolio(projects):
+            yield DACBPortfolioResult(**item).model_dump_json() + "\n"
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
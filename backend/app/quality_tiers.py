@@ -0,0 +1,53 @@
+"""
+Named accuracy/latency tiers for Earth Engine reductions
+Every reduction picks its scale, pixel budget and tiling from one tier so
+the same AOI gives comparable numbers wherever it is reduced
+"""
+from app.geometry import geodesic_area_km2, geodesic_perimeter_km
+
+QUALITY_TIERS = {
+    # Interactive dashboards: coarse pixels, EE may coarsen further
+    "preview": {"scale": 100, "max_pixels": 1e8, "tile_scale": 2, "best_effort": True},
+    "standard": {"scale": 30, "max_pixels": 1e9, "tile_scale": 4, "best_effort": True},
+    # Certification: native Dynamic World resolution, never coarsened
+    "audit": {"scale": 10, "max_pixels": 1e13, "tile_scale": 16, "best_effort": False},
+}
+
+# Stats cached before tiers existed were reduced at 10 m
+LEGACY_TIER = "audit"
+
+def get_tier(tier: str) -> dict:
+    if tier not in QUALITY_TIERS:
+        raise ValueError(f"Unknown quality tier: {tier}")
+    return QUALITY_TIERS[tier]
+
+def reduce_region_args(tier: str) -> dict:
+    """Keyword arguments for Image.reduceRegion"""
+    params = get_tier(tier)
+    return {
+        "scale": params["scale"],
+        "maxPixels": params["max_pixels"],
+        "tileScale": params["tile_scale"],
+        "bestEffort": params["best_effort"]
+    }
+
+def reduce_regions_args(tier: str) -> dict:
+    """Keyword arguments for Image.reduceRegions (no pixel budget there)"""
+    params = get_tier(tier)
+    return {"scale": params["scale"], "tileScale": params["tile_scale"]}
+
+def tier_cache_key(aoi_hash: str, tier: str) -> str:
+    """Stats cache key for a tier; legacy-tier keys are unchanged"""
+    return aoi_hash if tier == LEGACY_TIER else f"{aoi_hash}:{tier}"
+
+def estimated_error_pct(aoi_geojson: dict, tier: str) -> float:
+    """
+    Bound on class-share error from boundary pixels
+    Pixels straddling the AOI edge are counted whole or not at all, so up
+    to half a pixel along the perimeter can be misattributed
+    """
+    area_km2 = geodesic_area_km2(aoi_geojson)
+    if area_km2 <= 0:
+        return 100.0
+    edge_band_km2 = geodesic_perimeter_km(aoi_geojson) * get_tier(tier)["scale"] / 1000 / 2
+    return round(min(100 * edge_band_km2 / area_km2, 100.0), 2)
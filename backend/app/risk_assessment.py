@@ -2,186 +2,60 @@
 Carbon Risk Assessment Engine
 Evaluates permanence, reversal risk, and project integrity
 """
+import numpy as np
+from app.histograms import as_histogram, stack_histograms
+from app.risk_rules import RISK_RULES, risk_metrics, evaluate_risk_rules, risk_flags
 
-def calculate_volatility(timeline_stats: list):
+def volatility_array(counts):
     """
-    Calculate year-to-year LULC volatility
-    High volatility = unstable land use
+    Mean year-to-year change for a (years, NUM_CLASSES) count array
+    Each step's total absolute class change is normalized by that year's pixels
     """
-    if len(timeline_stats) < 2:
+    counts = np.asarray(counts, dtype=float)
+    if len(counts) < 2:
         return 0.0
     
-    volatility_scores = []
-    
-    for i in range(1, len(timeline_stats)):
-        prev_stats = timeline_stats[i-1]["stats"]
-        curr_stats = timeline_stats[i]["stats"]
-        
-        # Calculate total change between years
-        total_change = 0
-        for class_id in range(9):
-            class_str = str(class_id)
-            prev_val = prev_stats.get(class_str, 0)
-            curr_val = curr_stats.get(class_str, 0)
-            total_change += abs(curr_val - prev_val)
-        
-        # Normalize by total pixels
-        total_pixels = sum(curr_stats.values())
-        if total_pixels > 0:
-            volatility_scores.append(total_change / total_pixels)
-    
-    return sum(volatility_scores) / len(volatility_scores) if volatility_scores else 0.0
+    total_change = np.abs(np.diff(counts, axis=0)).sum(axis=1)
+    total_pixels = counts[1:].sum(axis=1)
+    valid = total_pixels > 0
+    return float((total_change[valid] / total_pixels[valid]).mean()) if valid.any() else 0.0
 
-def assess_carbon_risk(baseline_stats: dict, current_stats: dict, timeline_stats: list = None):
+def calculate_volatility(timeline_stats):
+    """
+    Calculate year-to-year LULC volatility
+    High volatility = unstable land use
+    Accepts a stacked (years, NUM_CLASSES) array or [{"year", "stats"}] entries
+    """
+    if not isinstance(timeline_stats, np.ndarray):
+        timeline_stats = stack_histograms([entry["stats"] for entry in timeline_stats])
+    return volatility_array(timeline_stats)
+
+def assess_carbon_risk(baseline_stats, current_stats, timeline_stats=None, rules: dict = None):
     """
     Comprehensive carbon risk assessment
     Returns risk score, flags, and permanence confidence
+    Histograms may be ClassHistogram or JSON dicts; timeline_stats may be a
+    stacked (years, NUM_CLASSES) array. Scoring follows the compiled rule
+    table (RISK_RULES unless given)
     """
-    risk_score = 0
-    flags = []
-    
-    # Get total pixels for percentage calculation
-    baseline_total = sum(baseline_stats.values())
-    current_total = sum(current_stats.values())
-    
-    # Calculate percentages for key classes
-    baseline_trees_pct = (baseline_stats.get("1", 0) / baseline_total * 100) if baseline_total > 0 else 0
-    current_trees_pct = (current_stats.get("1", 0) / current_total * 100) if current_total > 0 else 0
+    rules = rules or RISK_RULES
     
-    baseline_built_pct = (baseline_stats.get("6", 0) / baseline_total * 100) if baseline_total > 0 else 0
-    current_built_pct = (current_stats.get("6", 0) / current_total * 100) if current_total > 0 else 0
-    
-    baseline_water_pct = (baseline_stats.get("0", 0) / baseline_total * 100) if baseline_total > 0 else 0
-    current_water_pct = (current_stats.get("0", 0) / current_total * 100) if current_total > 0 else 0
-    
-    # Rule 1: Urbanization Risk (HIGH PRIORITY)
-    built_growth = current_built_pct - baseline_built_pct
-    if built_growth > 20:
-        risk_score += 40
-        flags.append({
-            "type": "URBANIZATION_RISK",
-            "severity": "CRITICAL",
-            "score_impact": 40,
-            "reason": f"Built-up area increased by {built_growth:.1f}%",
-            "explanation": "Rapid urbanization indicates high reversal risk. Carbon sequestration may be reversed by development.",
-            "recommendation": "Project not suitable for carbon credits due to urban encroachment"
-        })
-    elif built_growth > 10:
-        risk_score += 25
-        flags.append({
-            "type": "URBANIZATION_RISK",
-            "severity": "HIGH",
-            "score_impact": 25,
-            "reason": f"Built-up area increased by {built_growth:.1f}%",
-            "explanation": "Moderate urban expansion detected. Permanence may be compromised.",
-            "recommendation": "Implement buffer zones and monitoring protocols"
-        })
-    elif built_growth > 5:
-        risk_score += 10
-        flags.append({
-            "type": "URBANIZATION_RISK",
-            "severity": "MEDIUM",
-            "score_impact": 10,
-            "reason": f"Built-up area increased by {built_growth:.1f}%",
-            "explanation": "Minor urban growth detected. Monitor for acceleration.",
-            "recommendation": "Increase monitoring frequency"
-        })
-    
-    # Rule 2: Deforestation Risk
-    tree_loss_pct = baseline_trees_pct - current_trees_pct
-    if tree_loss_pct > 15:
-        risk_score += 35
-        flags.append({
-            "type": "DEFORESTATION",
-            "severity": "CRITICAL",
-            "score_impact": 35,
-            "reason": f"Tree cover decreased by {tree_loss_pct:.1f}%",
-            "explanation": "Significant forest loss detected. Project fails permanence criteria.",
-            "recommendation": "Project ineligible for carbon credits"
-        })
-    elif tree_loss_pct > 10:
-        risk_score += 20
-        flags.append({
-            "type": "DEFORESTATION",
-            "severity": "HIGH",
-            "score_impact": 20,
-            "reason": f"Tree cover decreased by {tree_loss_pct:.1f}%",
-            "explanation": "Moderate deforestation detected. Reversal risk is high.",
-            "recommendation": "Investigate causes and implement protection measures"
-        })
-    elif tree_loss_pct > 5:
-        risk_score += 10
-        flags.append({
-            "type": "DEFORESTATION",
-            "severity": "MEDIUM",
-            "score_impact": 10,
-            "reason": f"Tree cover decreased by {tree_loss_pct:.1f}%",
-            "explanation": "Minor forest loss. May be within natural variation.",
-            "recommendation": "Continue monitoring"
-        })
-    
-    # Rule 3: Water Body Changes
-    water_loss_pct = baseline_water_pct - current_water_pct
-    if abs(water_loss_pct) > 10:
-        risk_score += 15
-        flags.append({
-            "type": "WATER_INSTABILITY",
-            "severity": "MEDIUM",
-            "score_impact": 15,
-            "reason": f"Water bodies changed by {abs(water_loss_pct):.1f}%",
-            "explanation": "Significant water body changes indicate environmental instability.",
-            "recommendation": "Assess hydrological impacts on project"
-        })
-    
-    # Rule 4: LULC Volatility (if timeline available)
-    if timeline_stats and len(timeline_stats) > 2:
+    # Volatility only counts with more than two years of timeline
+    volatility = np.nan
+    if timeline_stats is not None and len(timeline_stats) > 2:
         volatility = calculate_volatility(timeline_stats)
-        if volatility > 0.25:
-            risk_score += 20
-            flags.append({
-                "type": "HIGH_VOLATILITY",
-                "severity": "HIGH",
-                "score_impact": 20,
-                "reason": f"LULC volatility index: {volatility:.2f}",
-                "explanation": "High year-to-year land use changes indicate instability.",
-                "recommendation": "Project requires enhanced monitoring and verification"
-            })
-        elif volatility > 0.15:
-            risk_score += 10
-            flags.append({
-                "type": "MODERATE_VOLATILITY",
-                "severity": "MEDIUM",
-                "score_impact": 10,
-                "reason": f"LULC volatility index: {volatility:.2f}",
-                "explanation": "Moderate land use variability detected.",
-                "recommendation": "Quarterly monitoring recommended"
-            })
     
-    # Rule 5: Positive Indicators (reduce risk)
-    tree_gain_pct = current_trees_pct - baseline_trees_pct
-    if tree_gain_pct > 15:
-        risk_score = max(0, risk_score - 15)
-        flags.append({
-            "type": "POSITIVE_REFORESTATION",
-            "severity": "LOW",
-            "score_impact": -15,
-            "reason": f"Tree cover increased by {tree_gain_pct:.1f}%",
-            "explanation": "Significant reforestation detected. Strong additionality.",
-            "recommendation": "Project shows positive carbon sequestration trend"
-        })
+    metrics = risk_metrics(
+        as_histogram(baseline_stats).counts,
+        as_histogram(current_stats).counts,
+        np.array([volatility])
+    )
+    scored = evaluate_risk_rules(rules, metrics)
+    flags = risk_flags(rules, metrics, scored["bands"])
     
-    # Calculate Permanence Confidence Index (0-100)
-    permanence_confidence = max(0, min(100, 100 - risk_score))
-    
-    # Determine overall risk level
-    if risk_score >= 60:
-        risk_level = "CRITICAL"
-    elif risk_score >= 40:
-        risk_level = "HIGH"
-    elif risk_score >= 20:
-        risk_level = "MEDIUM"
-    else:
-        risk_level = "LOW"
+    risk_score = int(scored["risk_score"][0])
+    risk_level = str(scored["risk_level"][0])
+    permanence_confidence = int(scored["permanence_confidence"][0])
     
     return {
         "risk_score": risk_score,
@@ -194,6 +68,22 @@ def assess_carbon_risk(baseline_stats: dict, current_stats: dict, timeline_stats
         "summary": generate_risk_summary(risk_level, permanence_confidence, flags)
     }
 
+def score_portfolio(baseline_counts, current_counts, volatility=None, rules: dict = None) -> dict:
+    """
+    Risk columns for many projects in one pass
+    Count arguments are (n, NUM_CLASSES) arrays; volatility is a length-n
+    array with NaN where no timeline is available
+    """
+    rules = rules or RISK_RULES
+    metrics = risk_metrics(baseline_counts, current_counts, volatility)
+    scored = evaluate_risk_rules(rules, metrics)
+    band_types = [[band.get("type", rule["type"]) for band in rule["bands"]] for rule in rules["rules"]]
+    scored["flag_types"] = [
+        [band_types[column][band] for column, band in enumerate(row) if band >= 0]
+        for row in scored["bands"].tolist()
+    ]
+    return scored
+
 def generate_risk_summary(risk_level: str, permanence: float, flags: list):
     """Generate executive risk summary"""
     if risk_level == "CRITICAL":
@@ -0,0 +1,260 @@
+"""
+Declarative carbon risk methodology
+Rules (metric, threshold bands, severity, score impact, text) are plain data,
+loaded from RISK_RULES_PATH when set, and compiled once into array evaluators
+so a whole portfolio is scored in one pass
+"""
+import json
+import os
+import numpy as np
+from dotenv import load_dotenv
+from app.histograms import class_percentages
+
+load_dotenv()
+
+# Optional JSON file replacing DEFAULT_RISK_METHODOLOGY
+RISK_RULES_PATH = os.getenv("RISK_RULES_PATH")
+
+# Each rule flags the first band whose threshold its metric exceeds
+# (bands are checked from the highest threshold down); "reason" is
+# formatted with the metric value
+DEFAULT_RISK_METHODOLOGY = {
+    "rules": [
+        {
+            "type": "URBANIZATION_RISK",
+            "metric": "built_growth_pct",
+            "reason": "Built-up area increased by {value:.1f}%",
+            "bands": [
+                {
+                    "above": 20, "severity": "CRITICAL", "score_impact": 40,
+                    "explanation": "Rapid urbanization indicates high reversal risk. Carbon sequestration may be reversed by development.",
+                    "recommendation": "Project not suitable for carbon credits due to urban encroachment"
+                },
+                {
+                    "above": 10, "severity": "HIGH", "score_impact": 25,
+                    "explanation": "Moderate urban expansion detected. Permanence may be compromised.",
+                    "recommendation": "Implement buffer zones and monitoring protocols"
+                },
+                {
+                    "above": 5, "severity": "MEDIUM", "score_impact": 10,
+                    "explanation": "Minor urban growth detected. Monitor for acceleration.",
+                    "recommendation": "Increase monitoring frequency"
+                }
+            ]
+        },
+        {
+            "type": "DEFORESTATION",
+            "metric": "tree_loss_pct",
+            "reason": "Tree cover decreased by {value:.1f}%",
+            "bands": [
+                {
+                    "above": 15, "severity": "CRITICAL", "score_impact": 35,
+                    "explanation": "Significant forest loss detected. Project fails permanence criteria.",
+                    "recommendation": "Project ineligible for carbon credits"
+                },
+                {
+                    "above": 10, "severity": "HIGH", "score_impact": 20,
+                    "explanation": "Moderate deforestation detected. Reversal risk is high.",
+                    "recommendation": "Investigate causes and implement protection measures"
+                },
+                {
+                    "above": 5, "severity": "MEDIUM", "score_impact": 10,
+                    "explanation": "Minor forest loss. May be within natural variation.",
+                    "recommendation": "Continue monitoring"
+                }
+            ]
+        },
+        {
+            "type": "WATER_INSTABILITY",
+            "metric": "water_change_pct",
+            "reason": "Water bodies changed by {value:.1f}%",
+            "bands": [
+                {
+                    "above": 10, "severity": "MEDIUM", "score_impact": 15,
+                    "explanation": "Significant water body changes indicate environmental instability.",
+                    "recommendation": "Assess hydrological impacts on project"
+                }
+            ]
+        },
+        {
+            "type": "HIGH_VOLATILITY",
+            "metric": "volatility",
+            "reason": "LULC volatility index: {value:.2f}",
+            "bands": [
+                {
+                    "above": 0.25, "severity": "HIGH", "score_impact": 20,
+                    "explanation": "High year-to-year land use changes indicate instability.",
+                    "recommendation": "Project requires enhanced monitoring and verification"
+                },
+                {
+                    "above": 0.15, "type": "MODERATE_VOLATILITY", "severity": "MEDIUM", "score_impact": 10,
+                    "explanation": "Moderate land use variability detected.",
+                    "recommendation": "Quarterly monitoring recommended"
+                }
+            ]
+        },
+        {
+            "type": "POSITIVE_REFORESTATION",
+            "metric": "tree_gain_pct",
+            "reason": "Tree cover increased by {value:.1f}%",
+            "bands": [
+                {
+                    "above": 15, "severity": "LOW", "score_impact": -15,
+                    "explanation": "Significant reforestation detected. Strong additionality.",
+                    "recommendation": "Project shows positive carbon sequestration trend"
+                }
+            ]
+        }
+    ],
+    # Highest matching minimum score wins; anything below is LOW
+    "levels": [
+        {"min_score": 60, "level": "CRITICAL"},
+        {"min_score": 40, "level": "HIGH"},
+        {"min_score": 20, "level": "MEDIUM"}
+    ]
+}
+
+# Key classes: 1 = Trees, 6 = Built Area, 0 = Water
+RISK_METRICS = ("built_growth_pct", "tree_loss_pct", "tree_gain_pct", "water_change_pct", "volatility")
+
+def risk_metrics(baseline_counts, current_counts, volatility=None) -> dict:
+    """
+    Rule metrics for (n, NUM_CLASSES) baseline and current count arrays
+    volatility is a length-n array, NaN (or None for all) where no timeline
+    is available; NaN never crosses a threshold
+    """
+    baseline_pct = class_percentages(np.atleast_2d(baseline_counts))
+    current_pct = class_percentages(np.atleast_2d(current_counts))
+    if volatility is None:
+        volatility = np.full(len(baseline_pct), np.nan)
+
+    return {
+        "built_growth_pct": current_pct[:, 6] - baseline_pct[:, 6],
+        "tree_loss_pct": baseline_pct[:, 1] - current_pct[:, 1],
+        "tree_gain_pct": current_pct[:, 1] - baseline_pct[:, 1],
+        "water_change_pct": np.abs(baseline_pct[:, 0] - current_pct[:, 0]),
+        "volatility": np.asarray(volatility, dtype=float)
+    }
+
+def load_risk_methodology() -> dict:
+    """Methodology from RISK_RULES_PATH, or the built-in defaults"""
+    if not RISK_RULES_PATH:
+        return DEFAULT_RISK_METHODOLOGY
+    with open(RISK_RULES_PATH) as f:
+        return json.load(f)
+
+def _require(entry, key: str, kind, where: str, optional: bool = False):
+    """entry[key] checked against kind; ValueError names the offending entry"""
+    if not isinstance(entry, dict):
+        raise ValueError(f"{where} must be an object")
+    if key not in entry:
+        if optional:
+            return None
+        raise ValueError(f"{where} is missing '{key}'")
+    value = entry[key]
+    # bool is an int subclass but never a valid threshold or score
+    if isinstance(value, bool) or not isinstance(value, kind):
+        raise ValueError(f"{where} has an invalid '{key}': {value!r}")
+    return value
+
+def _check_reason(reason: str, where: str):
+    try:
+        reason.format(value=0.0)
+    except (KeyError, IndexError, ValueError) as e:
+        raise ValueError(f"{where} has an invalid 'reason' template: {e}")
+
+def validate_risk_methodology(methodology: dict):
+    """Raise ValueError unless every rule, band and level is complete and well typed"""
+    for r, rule in enumerate(_require(methodology, "rules", list, "Risk methodology")):
+        where = f"Rule {r}"
+        _require(rule, "type", str, where)
+        _check_reason(_require(rule, "reason", str, where), where)
+        metric = _require(rule, "metric", str, where)
+        if metric not in RISK_METRICS:
+            raise ValueError(f"Unknown risk metric: {metric}")
+        bands = _require(rule, "bands", list, where)
+        if not bands:
+            raise ValueError(f"{where} has no bands")
+        for b, band in enumerate(bands):
+            band_where = f"{where} band {b}"
+            _require(band, "above", (int, float), band_where)
+            _require(band, "severity", str, band_where)
+            _require(band, "score_impact", int, band_where)
+            _require(band, "explanation", str, band_where)
+            _require(band, "recommendation", str, band_where)
+            _require(band, "type", str, band_where, optional=True)
+            reason = _require(band, "reason", str, band_where, optional=True)
+            if reason is not None:
+                _check_reason(reason, band_where)
+    
+    for i, level in enumerate(_require(methodology, "levels", list, "Risk methodology", optional=True) or []):
+        _require(level, "min_score", (int, float), f"Level {i}")
+        _require(level, "level", str, f"Level {i}")
+
+def compile_risk_methodology(methodology: dict) -> dict:
+    """Validate rules and turn their bands into threshold/impact arrays"""
+    validate_risk_methodology(methodology)
+    rules = []
+    for rule in methodology["rules"]:
+        bands = sorted(rule["bands"], key=lambda band: band["above"], reverse=True)
+        rules.append({
+            **rule,
+            "bands": bands,
+            "thresholds": np.array([band["above"] for band in bands], dtype=float),
+            "impacts": np.array([band["score_impact"] for band in bands], dtype=int)
+        })
+
+    levels = sorted(methodology.get("levels", []), key=lambda level: level["min_score"], reverse=True)
+    return {
+        "rules": rules,
+        "level_scores": np.array([level["min_score"] for level in levels]),
+        "level_names": np.array([level["level"] for level in levels] + ["LOW"])
+    }
+
+def evaluate_risk_rules(compiled: dict, metrics: dict) -> dict:
+    """
+    Score every row of the metric arrays at once
+    Returns length-n risk_score, permanence_confidence and risk_level columns
+    plus an (n, rules) matrix of matched band indexes (-1 = rule not triggered)
+    """
+    rules = compiled["rules"]
+    n = len(metrics["tree_loss_pct"])
+    bands = np.full((n, len(rules)), -1)
+    impacts = np.zeros((n, len(rules)), dtype=int)
+
+    for column, rule in enumerate(rules):
+        hits = metrics[rule["metric"]][:, None] > rule["thresholds"]
+        matched = hits.any(axis=1)
+        first_hit = hits.argmax(axis=1)
+        bands[:, column] = np.where(matched, first_hit, -1)
+        impacts[:, column] = np.where(matched, rule["impacts"][first_hit], 0)
+
+    risk_score = np.maximum(impacts.sum(axis=1), 0)
+    level_index = (risk_score[:, None] < compiled["level_scores"]).sum(axis=1)
+    return {
+        "risk_score": risk_score,
+        "permanence_confidence": np.clip(100 - risk_score, 0, 100),
+        "risk_level": compiled["level_names"][level_index],
+        "bands": bands
+    }
+
+def risk_flags(compiled: dict, metrics: dict, bands, row: int = 0) -> list:
+    """Flag dicts for one scored row, in rule order"""
+    flags = []
+    for column, rule in enumerate(compiled["rules"]):
+        band_index = bands[row, column]
+        if band_index < 0:
+            continue
+        band = rule["bands"][band_index]
+        flags.append({
+            "type": band.get("type", rule["type"]),
+            "severity": band["severity"],
+            "score_impact": band["score_impact"],
+            "reason": band.get("reason", rule["reason"]).format(value=float(metrics[rule["metric"]][row])),
+            "explanation": band["explanation"],
+            "recommendation": band["recommendation"]
+        })
+    return flags
+
+# Compiled once per process
+RISK_RULES = compile_risk_methodology(load_risk_methodology())
@@ -1,29 +1,39 @@
 from pydantic import BaseModel
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Literal
 
 class AOIRequest(BaseModel):
     aoi: Dict[str, Any]
     start_date: str
     end_date: str
+    quality_tier: Optional[Literal["preview", "standard", "audit"]] = None  # None = endpoint default
 
 class LULCResponse(BaseModel):
     tile_url: str
     stats: Optional[Dict[str, Any]] = None
     aoi_area_km2: float
+    quality_tier: str
+    estimated_error_pct: float
+
+class LULCTileResponse(BaseModel):
+    tile_url: str
 
 class TimelineRequest(BaseModel):
     aoi: Dict[str, Any]
     start_year: int
     end_year: int
+    tile_years: Optional[List[int]] = None  # Years to mint tiles for (None = all)
+    quality_tier: Optional[Literal["preview", "standard", "audit"]] = None  # None = endpoint default
 
 class TimelineYearData(BaseModel):
     year: int
-    tile_url: str
+    tile_url: Optional[str] = None
     stats: Dict[str, Any]
 
 class TimelineResponse(BaseModel):
     timeline: List[TimelineYearData]
     aoi_area_km2: float
+    quality_tier: str
+    estimated_error_pct: float
 
 class BaselineRequest(BaseModel):
     aoi: Dict[str, Any]
@@ -65,6 +75,11 @@ class Transition(BaseModel):
     area_km2: float
     description: str
 
+class TransitionMatrix(BaseModel):
+    classes: List[str]
+    pixels: List[List[float]]  # Rows = baseline class, columns = current class
+    area_km2: List[List[float]]
+
 class ChangeDetectionResponse(BaseModel):
     baseline_year: int
     current_year: int
@@ -73,6 +88,7 @@ class ChangeDetectionResponse(BaseModel):
     transitions: Dict[str, Transition]
     summary: Dict[str, Any]
     current_tile_url: str
+    transition_matrix: Optional[TransitionMatrix] = None
 
 class RiskFlag(BaseModel):
     type: str
@@ -91,6 +107,25 @@ class RiskAssessmentResponse(BaseModel):
     critical_flags: int
     high_flags: int
     summary: Dict[str, Any]
+    volatility_complete: bool = True  # False when the volatility timeline overran its budget
+
+class RiskRescoreRequest(BaseModel):
+    current_year: int
+    baseline_ids: Optional[List[str]] = None  # Every locked baseline when omitted
+    methodology: Optional[Dict[str, Any]] = None  # Rule table to use instead of the configured one
+
+class RiskRescoreResult(BaseModel):
+    baseline_id: str
+    risk_score: int
+    risk_level: str
+    permanence_confidence: int
+    flag_types: List[str]
+    volatility_complete: bool
+
+class RiskRescoreResponse(BaseModel):
+    current_year: int
+    results: List[RiskRescoreResult]
+    skipped: List[str]  # Locked baselines with no stored stats for current_year
 
 class ZoneStats(BaseModel):
     baseline_forest_pct: float
@@ -98,6 +133,17 @@ class ZoneStats(BaseModel):
     deforestation_pct: float
     area_km2: float
 
+class RingStats(ZoneStats):
+    inner_km: float
+    outer_km: float
+    leakage_ratio: float
+    leakage_severity: str
+
+class LeakageAnalysisRequest(ChangeDetectionRequest):
+    buffer_km: int = 5
+    ring_radii_km: Optional[List[float]] = None  # Extra buffer radii for a ring-wise profile
+    quality_tier: Optional[Literal["preview", "standard", "audit"]] = None  # None = endpoint default
+
 class LeakageAnalysisResponse(BaseModel):
     leakage_detected: bool
     leakage_severity: str
@@ -106,6 +152,9 @@ class LeakageAnalysisResponse(BaseModel):
     buffer_tile_url: str
     project_area: ZoneStats
     buffer_zone: ZoneStats
+    rings: List[RingStats] = []
+    quality_tier: str
+    estimated_error_pct: float
     summary: str
     recommendation: str
 
@@ -115,6 +164,13 @@ class DACBRequest(BaseModel):
     current_year: int
     buffer_km: int = 5
     use_knn: bool = True
+    quality_tier: Optional[Literal["preview", "standard", "audit"]] = None  # None = endpoint default
+
+class DACBPortfolioProject(DACBRequest):
+    project_id: str
+
+class DACBPortfolioRequest(BaseModel):
+    projects: List[DACBPortfolioProject]
 
 class ControlAreaQuality(BaseModel):
     similarity_score: float
@@ -147,3 +203,10 @@ class DACBResponse(BaseModel):
     control_area_quality: ControlAreaQuality
     confidence: str
     control_selection: Dict[str, Any]
+    quality_tier: str
+    estimated_error_pct: float
+
+class DACBPortfolioResult(BaseModel):
+    project_id: str
+    result: Optional[DACBResponse] = None
+    error: Optional[str] = None
@@ -0,0 +1,65 @@
+"""
+Cache-hit latency for /api/lulc/analyze
+Times the handler on a warm cache, served from the in-process LRU and
+from SQLite alone, and compares versioned JSON record decoding with the
+old eval() decoding of a stored stats string. Hits must return the same
+full response as the miss and make no Earth Engine calls
+
+Usage: python -m benchmarks.cache_hit_latency
+"""
+import json
+import statistics
+import tempfile
+import time
+from benchmarks.fake_ee import install, lulc_handler, square_aoi
+
+fake = install(handler=lulc_handler)
+
+import app.database as database  # noqa: E402 (after the fake ee is installed)
+from app.main import run_analyze_lulc  # noqa: E402
+from app.schemas import AOIRequest  # noqa: E402
+
+def time_calls(fn, repeat: int, before=None) -> float:
+    """Median microseconds per call"""
+    samples = []
+    for _ in range(repeat):
+        if before:
+            before()
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1e6
+
+def run(repeat: int = 2000):
+    database.DB_PATH = tempfile.mktemp(suffix=".db")
+    database.init_db()
+    request = AOIRequest(aoi=square_aoi(10, 45), start_date="2022-01-01", end_date="2022-12-31")
+
+    miss = run_analyze_lulc(request)
+    calls_after_miss = dict(fake.calls)
+
+    memory_hit_us = time_calls(lambda: run_analyze_lulc(request), repeat)
+    sqlite_hit_us = time_calls(lambda: run_analyze_lulc(request), repeat, before=database.record_memory_cache.clear)
+
+    hit = run_analyze_lulc(request)
+    assert hit.model_dump() == miss.model_dump(), "cache hit differs from miss"
+    assert hit.aoi_area_km2 > 0
+    assert dict(fake.calls) == calls_after_miss, "cache hits reached Earth Engine"
+
+    # Decoding alone: a stored record vs the old str(dict) + eval() row
+    stats = {str(class_id): 1000 + class_id for class_id in range(9)}
+    record = database.encode_cache_record(stats=stats, area_km2=4.0)
+    legacy = str(stats)
+    json_us = time_calls(lambda: database.decode_cache_record(record), repeat * 5)
+    eval_us = time_calls(lambda: eval(legacy), repeat * 5)
+
+    print(json.dumps({
+        "hit_memory_us": round(memory_hit_us, 1),
+        "hit_sqlite_us": round(sqlite_hit_us, 1),
+        "decode_json_record_us": round(json_us, 2),
+        "decode_legacy_eval_us": round(eval_us, 2),
+        "earth_engine_calls": dict(fake.calls)
+    }, indent=2))
+
+if __name__ == "__main__":
+    run()
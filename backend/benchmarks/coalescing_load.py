@@ -0,0 +1,49 @@
+"""
+Request coalescing under concurrent identical requests
+Fires N identical /api/lulc/analyze calls at once through run_coalesced
+against a slow fake Earth Engine: every caller must get the same response
+from a single stats reduction and a single tile mint
+
+Usage: python -m benchmarks.coalescing_load [callers]
+"""
+import asyncio
+import json
+import sys
+import tempfile
+import time
+from benchmarks.fake_ee import install, lulc_handler, square_aoi
+
+EE_SECONDS = 0.5
+
+fake = install(handler=lulc_handler, latency=lambda op, expr: EE_SECONDS)
+
+import app.database as database  # noqa: E402 (after the fake ee is installed)
+from app.main import analyze_lulc  # noqa: E402
+from app.schemas import AOIRequest  # noqa: E402
+
+async def fire(callers: int):
+    request = AOIRequest(aoi=square_aoi(10, 45), start_date="2022-01-01", end_date="2022-12-31")
+    start = time.perf_counter()
+    responses = await asyncio.gather(*(analyze_lulc(request) for _ in range(callers)))
+    return responses, time.perf_counter() - start
+
+def run(callers: int = 32):
+    database.DB_PATH = tempfile.mktemp(suffix=".db")
+    database.init_db()
+
+    responses, wall = asyncio.run(fire(callers))
+
+    first = responses[0].model_dump()
+    assert all(response.model_dump() == first for response in responses), "coalesced callers got different responses"
+    assert fake.calls["getInfo"] == 1, f"{fake.calls['getInfo']} stats reductions for {callers} identical callers"
+    assert fake.calls["getMapId"] == 1, f"{fake.calls['getMapId']} tile mints for {callers} identical callers"
+
+    print(json.dumps({
+        "callers": callers,
+        "wall_s": round(wall, 2),
+        "uncoalesced_ee_calls": 2 * callers,
+        "earth_engine_calls": dict(fake.calls)
+    }, indent=2))
+
+if __name__ == "__main__":
+    run(*(int(arg) for arg in sys.argv[1:2]))
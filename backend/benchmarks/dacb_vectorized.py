@@ -0,0 +1,181 @@
+"""
+Vectorized DACB math: equivalence and throughput
+Builds synthetic project/control histograms and checks, for every project,
+that dacb_metrics_array (the portfolio path) and dacb_result (the
+single-project path) agree with the original per-project scalar code
+(reproduced here) and with each other, then times the paths
+
+Usage: python -m benchmarks.dacb_vectorized [projects]
+"""
+import json
+import sys
+import time
+import numpy as np
+from benchmarks.fake_ee import install
+
+install()
+
+from app.dacb_service import dacb_metrics, dacb_metrics_array, dacb_result, format_dacb_result  # noqa: E402 (after the fake ee is installed)
+from app.histograms import NUM_CLASSES  # noqa: E402
+
+BASELINE_YEAR = 2018
+
+# Original scalar DACB code, one project at a time
+def scalar_forest_area(stats, total_area_km2):
+    total_pixels = sum(stats.values())
+    if total_pixels == 0:
+        return 0.0
+    return total_area_km2 * (stats.get("1", 0) / total_pixels)
+
+def scalar_permanence_score(F_p_t0, F_p_obs_tn, leakage_ratio):
+    forest_change = abs(F_p_t0 - F_p_obs_tn)
+    FSI = 1 - (forest_change / F_p_t0) if F_p_t0 > 0 else 0
+    FSI = max(0, min(FSI, 1))
+    L_norm = min(leakage_ratio / 2, 1)
+    return round(100 * FSI * (1 - L_norm), 1)
+
+def scalar_dacb(pa_stats_t0, pa_stats_tn, A_p, ca_stats_t0, ca_stats_tn, A_c, years):
+    F_p_t0 = scalar_forest_area(pa_stats_t0, A_p)
+    F_p_obs_tn = scalar_forest_area(pa_stats_tn, A_p)
+    F_c_t0 = scalar_forest_area(ca_stats_t0, A_c)
+    F_c_tn = scalar_forest_area(ca_stats_tn, A_c)
+    
+    r_c = (F_c_t0 - F_c_tn) / years
+    F_hat_p_tn = max(F_p_t0 - r_c * years, 0)
+    AD = max(F_hat_p_tn - F_p_obs_tn, 0)
+    
+    project_loss = F_p_t0 - F_p_obs_tn
+    control_loss = F_c_t0 - F_c_tn
+    leakage_ratio = control_loss / (project_loss + 0.1) if project_loss != 0 else 0
+    if leakage_ratio < 0.8:
+        lambda_factor, severity = 1.00, "LOW"
+    elif leakage_ratio <= 1.5:
+        lambda_factor, severity = 0.75, "MEDIUM"
+    else:
+        lambda_factor, severity = 0.50, "HIGH"
+    PCS = scalar_permanence_score(F_p_t0, F_p_obs_tn, leakage_ratio)
+    
+    forest_pct_p = (F_p_t0 / A_p * 100) if A_p > 0 else 0
+    forest_pct_c = (F_c_t0 / A_c * 100) if A_c > 0 else 0
+    similarity = max(0, min(1 - abs(forest_pct_p - forest_pct_c) / 100, 1))
+    
+    return {
+        "project_forest_baseline_km2": F_p_t0,
+        "project_forest_current_km2": F_p_obs_tn,
+        "control_forest_baseline_km2": F_c_t0,
+        "control_forest_current_km2": F_c_tn,
+        "control_trend_km2_per_year": r_c,
+        "expected_forest_km2": F_hat_p_tn,
+        "avoided_deforestation_km2": AD,
+        "leakage_ratio": leakage_ratio,
+        "leakage_severity": severity,
+        "leakage_adjustment_factor": lambda_factor,
+        "adjusted_avoided_deforestation_km2": AD * lambda_factor,
+        "permanence_score": PCS,
+        "control_similarity": similarity,
+        "project_forest_pct": forest_pct_p,
+        "control_forest_pct": forest_pct_c,
+        "confidence": "HIGH" if PCS > 70 else "MEDIUM" if PCS > 50 else "LOW"
+    }
+
+def synthetic_projects(n: int, seed: int = 0) -> dict:
+    """Random histograms, with some empty and some forest-free rows"""
+    rng = np.random.default_rng(seed)
+    counts = {
+        name: rng.integers(0, 5000, size=(n, NUM_CLASSES))
+        for name in ("pa_counts_t0", "pa_counts_tn", "ca_counts_t0", "ca_counts_tn")
+    }
+    counts["pa_counts_t0"][::97] = 0
+    counts["pa_counts_tn"][::89, 1] = 0
+    counts["ca_counts_tn"][::83, 1] = 0
+    return {
+        **counts,
+        "pa_area_km2": rng.uniform(1, 500, n),
+        "ca_area_km2": rng.uniform(1, 2000, n),
+        "years": rng.integers(1, 12, n)
+    }
+
+def stats_dict(row) -> dict:
+    return {str(class_id): int(count) for class_id, count in enumerate(row) if count}
+
+def run(n: int = 100_000):
+    data = synthetic_projects(n)
+    stats = {name: [stats_dict(row) for row in data[name]] for name in data if name.endswith(("t0", "tn"))}
+    rows = [
+        (stats["pa_counts_t0"][i], stats["pa_counts_tn"][i], float(data["pa_area_km2"][i]),
+         stats["ca_counts_t0"][i], stats["ca_counts_tn"][i], float(data["ca_area_km2"][i]), int(data["years"][i]))
+        for i in range(n)
+    ]
+    
+    start = time.perf_counter()
+    array = dacb_metrics_array(**data)
+    array_s = time.perf_counter() - start
+    
+    # Portfolio responses: one columnar pass, then per-project formatting
+    start = time.perf_counter()
+    columns = {name: column.tolist() for name, column in array.items()}
+    formatted = [
+        format_dacb_result(
+            {name: column[i] for name, column in columns.items()},
+            BASELINE_YEAR, BASELINE_YEAR + int(data["years"][i]), 5, None, None, None, {}
+        )
+        for i in range(n)
+    ]
+    formatted_s = array_s + time.perf_counter() - start
+    
+    start = time.perf_counter()
+    reference = [scalar_dacb(*row) for row in rows]
+    scalar_s = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    scalar = [dacb_metrics(*row) for row in rows]
+    metrics_s = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    results = [
+        dacb_result(
+            {"stats": {BASELINE_YEAR: pa_t0, BASELINE_YEAR + years: pa_tn}, "area_km2": A_p},
+            {"stats": {BASELINE_YEAR: ca_t0, BASELINE_YEAR + years: ca_tn}, "area_km2": A_c},
+            BASELINE_YEAR, BASELINE_YEAR + years, 5, None, None, None, {}
+        )
+        for pa_t0, pa_tn, A_p, ca_t0, ca_tn, A_c, years in rows
+    ]
+    result_s = time.perf_counter() - start
+    
+    # Array columns match the original code exactly, row for row
+    for name, column in array.items():
+        expected = np.array([r[name] for r in reference])
+        assert np.array_equal(column, expected), f"dacb_metrics_array differs on {name}"
+    
+    assert scalar == reference, "dacb_metrics differs from the original code"
+    
+    # dacb_result keeps the original rounding and labels
+    rounding = {
+        "project_forest_baseline_km2": 2, "project_forest_current_km2": 2,
+        "control_forest_baseline_km2": 2, "control_forest_current_km2": 2,
+        "control_trend_km2_per_year": 3, "expected_forest_km2": 2,
+        "avoided_deforestation_km2": 2, "leakage_ratio": 2, "adjusted_avoided_deforestation_km2": 2
+    }
+    for result, expected in zip(results, reference):
+        for name, digits in rounding.items():
+            assert result[name] == round(expected[name], digits), f"dacb_result differs on {name}"
+        for name in ("leakage_severity", "leakage_adjustment_factor", "permanence_score", "confidence"):
+            assert result[name] == expected[name], f"dacb_result differs on {name}"
+        assert result["control_area_quality"]["similarity_score"] == round(expected["control_similarity"], 2)
+    
+    # Both paths produce identical responses
+    assert formatted == results, "portfolio and single-project responses differ"
+    
+    print(json.dumps({
+        "projects": n,
+        "dacb_metrics_array_s": round(array_s, 3),
+        "dacb_metrics_loop_s": round(metrics_s, 2),
+        "portfolio_responses_s": round(formatted_s, 2),
+        "dacb_result_loop_s": round(result_s, 2),
+        "original_scalar_loop_s": round(scalar_s, 2),
+        "speedup_vs_original": round(scalar_s / array_s, 1),
+        "equivalent": True
+    }, indent=2))
+
+if __name__ == "__main__":
+    run(*(int(arg) for arg in sys.argv[1:2]))
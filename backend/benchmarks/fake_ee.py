@@ -0,0 +1,142 @@
+"""
+Fake Earth Engine module for benchmarks
+Every ee call builds an expression tree locally; getInfo and getMapId are
+counted, delayed by an injectable latency and answered by a handler, so
+the app's code paths run unchanged without credentials or network
+
+Usage (before importing anything from app):
+    from benchmarks.fake_ee import install
+    fake = install()
+"""
+import sys
+import threading
+import time
+import types
+from collections import Counter
+
+class Expr:
+    """A server-side value: method name, arguments and the value it was called on"""
+
+    def __init__(self, name, args=(), kwargs=None, parent=None):
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.parent = parent
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: Expr(name, args, kwargs, self)
+
+    def getInfo(self):
+        return FAKE.call("getInfo", self)
+
+    def getMapId(self, vis_params=None):
+        return FAKE.call("getMapId", self)
+
+    def walk(self):
+        """Every Expr and plain value reachable from this one"""
+        stack, seen = [self], set()
+        while stack:
+            value = stack.pop()
+            if id(value) in seen:
+                continue
+            seen.add(id(value))
+            yield value
+            if isinstance(value, Expr):
+                stack.extend(value.args)
+                stack.extend(value.kwargs.values())
+                if value.parent is not None:
+                    stack.append(value.parent)
+            elif isinstance(value, dict):
+                stack.extend(value.values())
+            elif isinstance(value, (list, tuple)):
+                stack.extend(value)
+
+    def method_names(self) -> set:
+        return {value.name for value in self.walk() if isinstance(value, Expr)}
+
+    def years(self) -> set:
+        """Calendar years of every date window in the tree"""
+        return {
+            int(value[:4]) for value in self.walk()
+            if isinstance(value, str) and len(value) == 10 and value[4] == "-" and value[:4].isdigit()
+        }
+
+class Constructor:
+    """ee.Image, ee.Geometry, ee.Reducer, ...: callable, with static methods"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __call__(self, *args, **kwargs):
+        return Expr(self.name, args, kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: Expr(f"{self.name}.{name}", args, kwargs)
+
+class TileFetcher:
+    def __init__(self, url_format):
+        self.url_format = url_format
+
+class FakeEarthEngine:
+    """Call counters plus the latency and response hooks"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.latency = lambda op, expr: 0.0
+        self.handler = lambda op, expr: {}
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+
+    def call(self, op, expr):
+        with self.lock:
+            self.calls[op] += 1
+            serial = self.calls[op]
+        time.sleep(self.latency(op, expr))
+        if op == "getMapId":
+            return {"mapid": f"map-{serial}", "tile_fetcher": TileFetcher(f"https://tiles.test/{serial}/{{z}}/{{x}}/{{y}}")}
+        return self.handler(op, expr)
+
+FAKE = FakeEarthEngine()
+
+def install(handler=None, latency=None) -> FakeEarthEngine:
+    """Register the fake as the ee module and return its controller"""
+    module = types.ModuleType("ee")
+    for name in ("Image", "ImageCollection", "Geometry", "Reducer", "Dictionary",
+                 "Feature", "FeatureCollection", "Number", "List", "String", "Filter", "Join"):
+        setattr(module, name, Constructor(name))
+    module.Initialize = lambda *args, **kwargs: None
+    module.ServiceAccountCredentials = lambda *args, **kwargs: None
+    sys.modules["ee"] = module
+
+    if handler is not None:
+        FAKE.handler = handler
+    if latency is not None:
+        FAKE.latency = latency
+    return FAKE
+
+def lulc_handler(op, expr):
+    """
+    Plausible answers for the LULC stats reductions: a fixed label
+    histogram for every label band and a 4 km² AOI
+    """
+    histogram = {"1": 6000, "4": 2500, "6": 1500}
+    if expr.name == "Dictionary":
+        payload = expr.args[0]
+        if "histograms" in payload:
+            years = sorted(payload["histograms"].years())
+            return {"histograms": {f"label_{year}": dict(histogram) for year in years}, "area_m2": 4e6}
+        if "histogram" in payload:
+            return {"histogram": {"label": dict(histogram), "transition": {"10": 5000}}, "area_m2": 4e6}
+    return {}
+
+def square_aoi(lon: float, lat: float, size_deg: float = 0.02) -> dict:
+    """Small square AOI Feature; shift lon/lat to get distinct cache keys"""
+    ring = [[lon, lat], [lon + size_deg, lat], [lon + size_deg, lat + size_deg], [lon, lat + size_deg], [lon, lat]]
+    return {"type": "Feature", "geometry": {"type": "Polygon", "coordinates": [ring]}}
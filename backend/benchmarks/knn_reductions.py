@@ -0,0 +1,67 @@
+"""
+Earth Engine reductions per KNN control candidate
+Selects controls for a project with a fake Earth Engine and counts the
+reduceRegions round trips against the number of geometries featurized.
+The old per-feature map ran four reduceRegion calls for every candidate;
+the stacked image needs one reduceRegions for the whole ring, and a
+repeat selection is served from the tile feature store with none
+
+Usage: python -m benchmarks.knn_reductions [buffer_km]
+"""
+import json
+import random
+import sys
+import tempfile
+from benchmarks.fake_ee import install, square_aoi
+
+REDUCTIONS = {"reduceRegions": 0, "geometries": 0}
+
+def knn_handler(op, expr):
+    """Deterministic class fractions for every band of a reduceRegions call"""
+    if expr.name != "reduceRegions":
+        return {}
+    bands = [value.args[0] for value in expr.walk() if getattr(value, "name", None) == "rename"]
+    features = expr.kwargs["collection"].args[0]
+    REDUCTIONS["reduceRegions"] += 1
+    REDUCTIONS["geometries"] += len(features)
+
+    rows = []
+    for feature in features:
+        idx = feature.args[1]["idx"]
+        rng = random.Random(idx)
+        rows.append({"properties": {"idx": idx, **{band: rng.random() / 2 for band in bands}}})
+    return {"features": rows}
+
+fake = install(handler=knn_handler)
+
+import app.database as database  # noqa: E402 (after the fake ee is installed)
+from app.knn_service import select_control_areas_knn, generate_candidate_tiles  # noqa: E402
+
+def run(buffer_km: float = 10):
+    database.DB_PATH = tempfile.mktemp(suffix=".db")
+    database.init_db()
+    aoi = square_aoi(10, 45)
+    candidates = len(generate_candidate_tiles(aoi, buffer_km))
+
+    # Closed years only, so the features are persisted for the repeat run
+    cold = select_control_areas_knn(aoi, 2020, 2022, k=5, buffer_km=buffer_km)
+    cold_reductions = dict(REDUCTIONS)
+    warm = select_control_areas_knn(aoi, 2020, 2022, k=5, buffer_km=buffer_km)
+    warm_reductions = REDUCTIONS["reduceRegions"] - cold_reductions["reduceRegions"]
+
+    assert cold_reductions["reduceRegions"] == 1, f"{cold_reductions['reduceRegions']} reductions for one selection"
+    assert cold_reductions["geometries"] == candidates + 1, "every candidate and the project reduced once"
+    assert warm_reductions == 0, "repeat selection reached Earth Engine"
+    assert [t["tile_id"] for t in warm["selected_tiles"]] == [t["tile_id"] for t in cold["selected_tiles"]]
+
+    print(json.dumps({
+        "candidates": candidates,
+        "cold_reductions": cold_reductions["reduceRegions"],
+        "cold_reductions_per_candidate": round(cold_reductions["reduceRegions"] / candidates, 4),
+        "before_reductions_per_candidate": 4,
+        "warm_reductions": warm_reductions,
+        "earth_engine_calls": dict(fake.calls)
+    }, indent=2))
+
+if __name__ == "__main__":
+    run(*(float(arg) for arg in sys.argv[1:2]))
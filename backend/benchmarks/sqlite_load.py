@@ -0,0 +1,101 @@
+"""
+Mixed read/write SQLite cache load test
+N threads each run a mix of cache reads and writes against two layers:
+  before: a fresh sqlite3.connect() per call on the default rollback
+          journal (the original database.py functions, reproduced here)
+  after:  app.database's thread-local WAL connections, with the
+          in-process LRU disabled so every read reaches SQLite
+
+Usage: python -m benchmarks.sqlite_load [threads] [ops_per_thread]
+"""
+import json
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import app.database as database
+
+KEYS = 500
+WRITE_FRACTION = 0.2
+STATS = {str(class_id): 1000 + class_id for class_id in range(9)}
+
+# Original per-call connection layer
+def before_init(path: str):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS cache (aoi_hash TEXT PRIMARY KEY, tile_url TEXT NOT NULL, stats TEXT)")
+    conn.commit()
+    conn.close()
+
+def before_read(path: str, key: str):
+    conn = sqlite3.connect(path)
+    result = conn.execute("SELECT tile_url, stats FROM cache WHERE aoi_hash = ?", (key,)).fetchone()
+    conn.close()
+    return result
+
+def before_write(path: str, key: str):
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT OR REPLACE INTO cache (aoi_hash, tile_url, stats) VALUES (?, ?, ?)", (key, "", json.dumps(STATS)))
+    conn.commit()
+    conn.close()
+
+def after_read(path: str, key: str):
+    return database.get_cached_stats(key)
+
+def after_write(path: str, key: str):
+    database.save_cached_stats(key, STATS, 4.0)
+
+def load(read, write, path: str, threads: int, ops_per_thread: int) -> dict:
+    errors = []
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(seed: int):
+        rng = random.Random(seed)
+        barrier.wait()
+        for _ in range(ops_per_thread):
+            key = f"stats:{rng.randrange(KEYS)}"
+            try:
+                if rng.random() < WRITE_FRACTION:
+                    write(path, key)
+                else:
+                    read(path, key)
+            except sqlite3.OperationalError as e:
+                errors.append(str(e))
+
+    workers = [threading.Thread(target=worker, args=(seed,)) for seed in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return {"ops_per_s": round(threads * ops_per_thread / elapsed), "seconds": round(elapsed, 2), "errors": len(errors)}
+
+def run(threads: int = 16, ops_per_thread: int = 500):
+    before_path = tempfile.mktemp(suffix=".db")
+    before_init(before_path)
+    for key in range(KEYS):
+        before_write(before_path, f"stats:{key}")
+
+    database.DB_PATH = tempfile.mktemp(suffix=".db")
+    database.init_db()
+    database.record_memory_cache.max_entries = 0
+    for key in range(KEYS):
+        after_write(database.DB_PATH, f"stats:{key}")
+
+    before = load(before_read, before_write, before_path, threads, ops_per_thread)
+    after = load(after_read, after_write, database.DB_PATH, threads, ops_per_thread)
+    print(json.dumps({
+        "threads": threads,
+        "ops_per_thread": ops_per_thread,
+        "write_fraction": WRITE_FRACTION,
+        "before_connect_per_call": before,
+        "after_thread_local_wal": after,
+        "speedup": round(after["ops_per_s"] / before["ops_per_s"], 2)
+    }, indent=2))
+
+if __name__ == "__main__":
+    run(*(int(arg) for arg in sys.argv[1:3]))
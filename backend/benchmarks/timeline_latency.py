@@ -0,0 +1,55 @@
+"""
+Timeline wall time vs per-year Earth Engine latency
+Each fake call sleeps for the slowest year it touches, so a serial
+timeline would cost the sum of the per-year latencies while the batched
+stats reduction plus concurrent tile minting should cost about twice the
+slowest year, however many years are requested
+
+Usage: python -m benchmarks.timeline_latency
+"""
+import tempfile
+import time
+from benchmarks.fake_ee import install, lulc_handler, square_aoi
+
+SLOW_YEAR = 2020
+SLOW_SECONDS = 0.4
+FAST_SECONDS = 0.1
+
+def year_latency(year: int) -> float:
+    return SLOW_SECONDS if year == SLOW_YEAR else FAST_SECONDS
+
+fake = install(
+    handler=lulc_handler,
+    latency=lambda op, expr: max((year_latency(year) for year in expr.years()), default=0.0)
+)
+
+import app.database as database  # noqa: E402 (after the fake ee is installed)
+from app.main import run_analyze_timeline  # noqa: E402
+from app.schemas import TimelineRequest  # noqa: E402
+
+def run(year_counts=(1, 2, 3, 4, 6, 8)):
+    database.DB_PATH = tempfile.mktemp(suffix=".db")
+    database.init_db()
+
+    print(f"{'years':>5} {'wall s':>7} {'slowest s':>9} {'serial sum s':>12} {'stats calls':>11} {'tile calls':>10}")
+    for index, count in enumerate(year_counts):
+        years = list(range(SLOW_YEAR, SLOW_YEAR + count))
+        # A fresh AOI per run so nothing is served from the caches
+        request = TimelineRequest(aoi=square_aoi(10 + index, 45), start_year=years[0], end_year=years[-1])
+
+        fake.reset()
+        start = time.perf_counter()
+        response = run_analyze_timeline(request)
+        wall = time.perf_counter() - start
+
+        assert [entry.year for entry in response.timeline] == years
+        slowest = max(year_latency(year) for year in years)
+        # Before: map id, reduceRegion and area().getInfo() per year, back to back
+        serial = 3 * sum(year_latency(year) for year in years)
+        print(f"{count:>5} {wall:>7.2f} {slowest:>9.2f} {serial:>12.2f} {fake.calls['getInfo']:>11} {fake.calls['getMapId']:>10}")
+
+        # One stats reduction, then every tile minted concurrently
+        assert wall < 2 * slowest + 0.25, f"{count} years took {wall:.2f}s"
+
+if __name__ == "__main__":
+    run()